@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from django.conf import settings
 from core.models import ThreatDetection, AnalysisSession
 from visual.models import VisualCapture, VisualThreatDetection
 from audio.models import AudioCapture, AudioThreatDetection
@@ -15,7 +16,7 @@ class ThreatDetectionSerializer(serializers.ModelSerializer):
     class Meta:
         model = ThreatDetection
         fields = ['id', 'user', 'threat_level', 'description', 'source_type', 
-                 'confidence_score', 'is_false_positive', 'created_at']
+                 'confidence_score', 'analysis_tier', 'degraded', 'is_false_positive', 'created_at']
         read_only_fields = ['id', 'user', 'created_at']
 
 class AnalysisSessionSerializer(serializers.ModelSerializer):
@@ -79,9 +80,34 @@ class AudioAnalysisRequestSerializer(serializers.Serializer):
     transcription = serializers.CharField(required=False, help_text="Optional transcription of the audio")
     session_id = serializers.IntegerField(required=False, help_text="Optional session ID for continuing an existing session")
 
+class VisualUploadRequestSerializer(serializers.Serializer):
+    session_id = serializers.IntegerField(required=False, help_text="Optional session ID for continuing an existing session")
+
+class AudioUploadRequestSerializer(serializers.Serializer):
+    transcription = serializers.CharField(required=False, help_text="Optional transcription of the audio")
+    session_id = serializers.IntegerField(required=False, help_text="Optional session ID for continuing an existing session")
+    duration = serializers.FloatField(required=False, help_text="Duration in seconds; read from the file for WAV uploads")
+    sample_rate = serializers.IntegerField(required=False, help_text="Sample rate; read from the file for WAV uploads")
+    channels = serializers.IntegerField(required=False, help_text="Channel count; read from the file for WAV uploads")
+
 class TextAnalysisRequestSerializer(serializers.Serializer):
     text = serializers.CharField(help_text="Text content to analyze")
     session_id = serializers.IntegerField(required=False, help_text="Optional session ID for continuing an existing session")
+    source_type = serializers.CharField(
+        required=False,
+        help_text="Optional kind of text (chat, log, email). Chat messages are analyzed incrementally per session; "
+                  "send only the new message(s) and the session_id returned for the first one"
+    )
+
+class TextBatchAnalysisRequestSerializer(serializers.Serializer):
+    texts = serializers.ListField(
+        child=serializers.CharField(),
+        min_length=1,
+        max_length=settings.TEXT_BATCH_MAX_ITEMS,
+        help_text="Texts to analyze, each judged on its own"
+    )
+    session_id = serializers.IntegerField(required=False, help_text="Optional session ID for continuing an existing session")
+    source_type = serializers.CharField(required=False, help_text="Optional kind of the texts (chat, log, email)")
 
 class MultimodalAnalysisRequestSerializer(serializers.Serializer):
     text = serializers.CharField(required=False, help_text="Optional text content to analyze")
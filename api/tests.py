@@ -1,3 +1,262 @@
-from django.test import TestCase
+import os
+import io
+import json
+import base64
+import shutil
+import tempfile
+from unittest import mock
+from celery import states
+from celery.backends.cache import CacheBackend
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+from core.blob_store import FileSystemBlobStore, MediaBlobStore, blob_key
+from core.models import AnalysisSession
+from core.task_owners import TaskOwners
+from visual.models import VisualCapture
+from .uploads import MULTIPART_OVERHEAD_BYTES
+from rt_cta.celery import app as celery_app
 
-# Create your tests here.
+def png(size=(4, 4)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+PNG = png()
+
+class TaskStatusViewTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', password='pw')
+        self.other = User.objects.create_user('other', password='pw')
+        self.backend = CacheBackend(app=celery_app, url='memory://')
+        self.owners = TaskOwners(backend=self.backend)
+        for target, value in (('api.views.get_task_owners', lambda: self.owners),
+                              ('api.views.celery_app', mock.Mock(backend=self.backend))):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def submit(self, task_id):
+        with mock.patch('api.views.process_text_analysis.delay', return_value=mock.Mock(id=task_id)):
+            response = self.client_for(self.owner).post('/api/analyze/text/', {'text': 'hello'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['task_id']
+
+    def status(self, user, *task_ids):
+        response = self.client_for(user).get('/api/tasks/status/', {'ids': ','.join(task_ids)})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['tasks']
+
+    def test_only_the_owner_sees_a_task(self):
+        task_id = self.submit('task-1')
+        self.backend.store_result(task_id, {"threat_detected": True, "threat_level": "HIGH",
+                                            "confidence_score": 0.9}, states.SUCCESS)
+
+        self.assertEqual(self.status(self.owner, task_id)[task_id]['threat_level'], 'HIGH')
+        self.assertEqual(self.status(self.other, task_id)[task_id], {"state": "UNKNOWN", "status": "unknown"})
+
+    def test_unknown_ids_are_not_looked_up(self):
+        self.backend.store_result('stranger', {"threat_detected": False}, states.SUCCESS)
+        self.assertEqual(self.status(self.owner, 'stranger')['stranger']['status'], 'unknown')
+
+    def test_running_state_is_not_cached(self):
+        task_id = self.submit('task-2')
+        self.backend.store_result(task_id, None, states.STARTED)
+        self.assertEqual(self.status(self.owner, task_id)[task_id]['status'], 'processing')
+
+        self.backend.store_result(task_id, {"threat_detected": False, "threat_level": "LOW",
+                                            "confidence_score": 0.8}, states.SUCCESS)
+        summary = self.status(self.owner, task_id)[task_id]
+        self.assertEqual((summary['state'], summary['status']), (states.SUCCESS, 'completed'))
+
+    def test_id_limits(self):
+        client = self.client_for(self.owner)
+        self.assertEqual(client.get('/api/tasks/status/').status_code, 400)
+        with self.settings(TASK_STATUS_MAX_IDS=2):
+            self.assertEqual(client.get('/api/tasks/status/', {'ids': 'a,b,c'}).status_code, 400)
+
+@override_settings(UPLOAD_MAX_IMAGE_BYTES=1024)
+class UploadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('analyst', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        media_root = override_settings(MEDIA_ROOT=self.media)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.store = MediaBlobStore()
+        for target, value in (('core.blob_store._blob_store', self.store),
+                              ('api.views.get_task_owners', lambda: TaskOwners(backend=None))):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def stored_files(self):
+        return [name for _, _, files in os.walk(self.media) for name in files]
+
+    def post(self, path, data=None, **kwargs):
+        with mock.patch('api.views.process_visual_analysis.delay', return_value=mock.Mock(id='task-1')) as delay:
+            return self.client.post(path, data, **kwargs), delay
+
+    def test_base64_image_is_passed_to_the_task_by_key(self):
+        response, delay = self.post('/api/analyze/visual/', {'image': base64.b64encode(PNG).decode()}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(delay.call_args.args[0], blob_key(PNG))
+        self.assertEqual(self.store.read(blob_key(PNG)), PNG)
+
+    def test_invalid_base64_is_a_bad_request(self):
+        response, delay = self.post('/api/analyze/visual/', {'image': 'not base64!'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.json()['error'])
+        delay.assert_not_called()
+        self.assertEqual(self.stored_files(), [])
+
+    def test_multipart_image_is_stored_once_and_attached(self):
+        response, delay = self.post('/api/analyze/visual/upload/',
+                                    {'image': SimpleUploadedFile('shot.png', PNG, 'image/png')}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        capture = VisualCapture.objects.get(id=response.json()['capture_id'])
+        self.assertEqual(capture.image.name, self.store.name(blob_key(PNG)))
+        self.assertEqual((capture.metadata['width'], capture.metadata['format']), (4, 'PNG'))
+        self.assertEqual(delay.call_args.args[0], blob_key(PNG))
+        self.assertEqual(len(self.stored_files()), 1)
+
+    def test_raw_body_is_the_image(self):
+        response, delay = self.post('/api/analyze/visual/upload/?filename=shot.png', PNG, content_type='image/png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(delay.call_args.args[0], blob_key(PNG))
+
+    def test_oversized_upload_is_cut_off(self):
+        big = PNG + b'x' * 2048
+        for data, kwargs in ((big, {'content_type': 'image/png'}),
+                             ({'image': SimpleUploadedFile('big.png', big, 'image/png')}, {'format': 'multipart'})):
+            response, delay = self.post('/api/analyze/visual/upload/', data, **kwargs)
+            self.assertEqual(response.status_code, 413)
+            delay.assert_not_called()
+        self.assertEqual(self.stored_files(), [])
+        self.assertFalse(VisualCapture.objects.exists())
+
+    def test_announced_oversized_body_is_refused_unread(self):
+        with mock.patch('api.uploads.get_blob_store') as get_blob_store:
+            response, _ = self.post('/api/analyze/visual/upload/', b'x', content_type='image/png',
+                                    CONTENT_LENGTH=str(1024 + MULTIPART_OVERHEAD_BYTES + 1))
+        self.assertEqual(response.status_code, 413)
+        get_blob_store.assert_not_called()
+
+    def test_empty_body_is_a_bad_request(self):
+        response, delay = self.post('/api/analyze/visual/upload/', b'', content_type='image/png')
+        self.assertEqual(response.status_code, 400)
+        delay.assert_not_called()
+
+    def test_bad_multimodal_upload_leaves_no_session(self):
+        response = self.client.post(
+            '/api/analyze/multimodal/', {'text': 'hello', 'image': 'not base64!'}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(AnalysisSession.objects.exists())
+
+class TextBatchAnalysisViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('analyst', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch('api.views.get_task_owners', lambda: TaskOwners(backend=None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, data):
+        with mock.patch('api.views.process_text_analysis_batch.delay', return_value=mock.Mock(id='task-1')) as delay:
+            return self.client.post('/api/analyze/text/batch/', data, format='json'), delay
+
+    def test_whole_batch_goes_to_one_task(self):
+        response, delay = self.post({'texts': ['a', 'b', 'c'], 'source_type': 'log'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 3)
+        delay.assert_called_once_with(['a', 'b', 'c'], self.user.id, response.json()['session_id'], source_type='log')
+
+    def test_session_of_another_user_is_not_found(self):
+        other = User.objects.create_user('other', password='pw')
+        session = AnalysisSession.objects.create(user=other, session_type='text', status='processing')
+        response, delay = self.post({'texts': ['a'], 'session_id': session.id})
+        self.assertEqual(response.status_code, 404)
+        delay.assert_not_called()
+
+class TextIngestViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('analyst', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch('core.ingest.get_task_owners', lambda: TaskOwners(backend=None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('core.ingest.queue_depth', return_value=0)
+        self.queue_depth = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ingest(self, body, **kwargs):
+        with mock.patch('core.ingest.process_text_analysis.delay', return_value=mock.Mock(id='task-1')) as delay:
+            response = self.client.post('/api/ingest/text/', body, content_type='application/x-ndjson', **kwargs)
+            acks = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        return response, acks, delay
+
+    def test_records_are_batched_and_acknowledged(self):
+        response, acks, delay = self.ingest(b'{"text": "a"}\nnot json\n{"message": "b"}\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(acks[0]["line"], 2)
+        self.assertTrue(acks[0]["error"].startswith("Invalid JSON"))
+        self.assertEqual((acks[-1]["status"], acks[-1]["records"], acks[-1]["rejected"]), ('complete', 2, 1))
+        delay.assert_called_once()
+        self.assertEqual(delay.call_args.args[0], "a\nb")
+
+    def test_full_queue_is_refused(self):
+        self.queue_depth.return_value = 10 ** 6
+        response = self.client.post('/api/ingest/text/', b'{"text": "a"}\n', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_unknown_encoding_is_unsupported(self):
+        response = self.client.post('/api/ingest/text/', b'x', content_type='application/x-ndjson',
+                                    HTTP_CONTENT_ENCODING='br')
+        self.assertEqual(response.status_code, 415)
+
+class MultimodalAnalysisViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('analyst', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        blobs = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, blobs)
+        for target, value in (('core.blob_store._blob_store', FileSystemBlobStore(blobs)),
+                              ('api.views.get_task_owners', lambda: TaskOwners(backend=None))):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, data):
+        with mock.patch('api.views.chord') as chord:
+            chord.return_value.return_value = mock.Mock(id='callback-1')
+            return self.client.post('/api/analyze/multimodal/', data, format='json'), chord
+
+    def test_modalities_run_as_one_chord(self):
+        response, chord = self.post({'text': 'hello', 'image': base64.b64encode(PNG).decode()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['task_id'], 'callback-1')
+        self.assertEqual([task['type'] for task in response.json()['tasks']], ['text', 'visual'])
+        header = chord.call_args.args[0]
+        self.assertEqual([signature.args[0] for signature in header], ['text', 'visual'])
+        self.assertEqual(header[1].args[1][0], blob_key(PNG))
+
+    def test_request_without_any_input_is_a_bad_request(self):
+        response, chord = self.post({'transcription': 'hello'})
+        self.assertEqual(response.status_code, 400)
+        chord.assert_not_called()
+        self.assertFalse(AnalysisSession.objects.exists())
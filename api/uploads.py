@@ -0,0 +1,149 @@
+import os
+import wave
+import logging
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from core.blob_store import BlobTooLarge, get_blob_store
+
+logger = logging.getLogger('rt_cta')
+
+# Room for multipart boundaries and form fields on top of the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+class BlobUpload(UploadedFile):
+    """A file that was streamed straight into the blob store; only its key is kept"""
+
+    def __init__(self, blob_key, name, content_type, size):
+        super().__init__(file=None, name=name, content_type=content_type, size=size)
+        self.blob_key = blob_key
+
+class BlobUploadHandler(FileUploadHandler):
+    """
+    Multipart upload handler writing file parts into the blob store as they arrive
+
+    Each chunk is hashed and written through a BlobWriter, so the upload is
+    never held in memory or copied to a second temporary file, and it is cut
+    off with BlobTooLarge as soon as it passes the size cap. When a field is
+    given, only the first file part of that field is stored; other parts are
+    read past and dropped.
+    """
+
+    def __init__(self, request=None, max_bytes=None, field=None):
+        super().__init__(request)
+        self.chunk_size = settings.UPLOAD_CHUNK_BYTES
+        self.max_bytes = max_bytes
+        self.field = field
+        self.writer = None
+        self.received = False
+
+    def new_file(self, field_name, *args, **kwargs):
+        if self.field is not None and (field_name != self.field or self.received):
+            logger.debug(f"Skipping unexpected upload part {field_name!r}")
+            raise SkipFile()
+        super().new_file(field_name, *args, **kwargs)
+        self.writer = get_blob_store().writer(self.max_bytes)
+        self.received = True
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.writer.write(raw_data)
+
+    def file_complete(self, file_size):
+        key = self.writer.commit()
+        self.writer = None
+        return BlobUpload(key, self.file_name, self.content_type, file_size)
+
+    def upload_interrupted(self):
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+
+def receive_upload(request, field, max_bytes):
+    """
+    Stream an uploaded file into the blob store
+
+    multipart/form-data bodies carry the file in `field` next to the other
+    form fields. Any other content type is the raw file itself, with the
+    other fields in the query string.
+
+    Args:
+        request (Request): The DRF request, before its data has been read
+        field (str): Form field holding the file
+        max_bytes (int): Size cap for the file
+
+    Returns:
+        tuple: (BlobUpload, the other fields as a QueryDict)
+    """
+    content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    if content_length > max_bytes + MULTIPART_OVERHEAD_BYTES:
+        # Refuse before reading anything when the client announces an oversized body
+        raise BlobTooLarge(max_bytes)
+
+    if request.content_type.startswith('multipart/form-data'):
+        request._request.upload_handlers = [BlobUploadHandler(request._request, max_bytes, field)]
+        upload = request.FILES.get(field)
+        if upload is None:
+            raise ValidationError({field: "No file was uploaded"})
+        return upload, request.data
+
+    writer = get_blob_store().writer(max_bytes)
+    try:
+        stream = request.stream
+        while stream is not None:
+            chunk = stream.read(settings.UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            writer.write(chunk)
+    except BaseException:
+        writer.abort()
+        raise
+    if writer.size == 0:
+        writer.abort()
+        raise ValidationError({field: "The request body is empty"})
+    name = request.query_params.get('filename') or field
+    return BlobUpload(writer.commit(), name, request.content_type, writer.size), request.query_params
+
+def attach_blob(field_file, upload):
+    """
+    Point a model's FileField at an uploaded blob
+
+    Blobs kept in the default storage are referenced in place; otherwise
+    the content is copied into the field's upload_to directory.
+    """
+    store = get_blob_store()
+    name = store.storage_name(upload.blob_key)
+    if name is not None:
+        field_file.name = name
+        return
+    extension = os.path.splitext(upload.name or '')[1]
+    with store.open(upload.blob_key) as blob:
+        field_file.save(upload.blob_key.split(':', 1)[1] + extension, File(blob), save=False)
+
+def image_metadata(upload):
+    """Size and format of an uploaded image, read from its header only"""
+    try:
+        with get_blob_store().open(upload.blob_key) as blob:
+            image = Image.open(blob)
+            width, height = image.size
+            image_format = image.format
+    except Exception:
+        raise ValidationError({"image": "Not a supported image file"})
+    return {"width": width, "height": height, "format": image_format}
+
+def audio_metadata(upload):
+    """Duration, sample rate and channels of a WAV upload, or an empty dict for other formats"""
+    try:
+        with get_blob_store().open(upload.blob_key) as blob:
+            with wave.open(blob, 'rb') as audio:
+                sample_rate = audio.getframerate()
+                return {
+                    "duration": audio.getnframes() / sample_rate if sample_rate else 0.0,
+                    "sample_rate": sample_rate,
+                    "channels": audio.getnchannels(),
+                }
+    except (wave.Error, EOFError):
+        return {}
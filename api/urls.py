@@ -16,10 +16,19 @@ urlpatterns = [
     
     # Analysis endpoints
     path('analyze/visual/', views.VisualAnalysisView.as_view(), name='visual-analysis'),
+    path('analyze/visual/upload/', views.VisualUploadView.as_view(), name='visual-upload'),
     path('analyze/audio/', views.AudioAnalysisView.as_view(), name='audio-analysis'),
+    path('analyze/audio/upload/', views.AudioUploadView.as_view(), name='audio-upload'),
     path('analyze/text/', views.TextAnalysisView.as_view(), name='text-analysis'),
+    path('analyze/text/batch/', views.TextBatchAnalysisView.as_view(), name='text-batch-analysis'),
     path('analyze/multimodal/', views.MultimodalAnalysisView.as_view(), name='multimodal-analysis'),
     
+    # Task status, for clients that cannot hold a WebSocket
+    path('tasks/status/', views.TaskStatusView.as_view(), name='task-status'),
+    
+    # Streaming ingest for log shippers
+    path('ingest/text/', views.TextIngestView.as_view(), name='text-ingest'),
+    
     # Results endpoints
     path('results/', views.AnalysisResultView.as_view(), name='analysis-results'),
     path('results/<int:session_id>/', views.AnalysisResultView.as_view(), name='session-results'),
@@ -1,6 +1,9 @@
 from django.shortcuts import render
+from django.http import StreamingHttpResponse
 from rest_framework import views, status, viewsets
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
@@ -8,19 +11,47 @@ from django.contrib.auth import authenticate
 from django.conf import settings
 import logging
 import json
+import time
 import base64
-from core.tasks import process_visual_analysis, process_audio_analysis, process_text_analysis
+import binascii
+from celery import chord, states
+from rt_cta.celery import app as celery_app
+from core.tasks import (
+    process_visual_analysis, process_audio_analysis, process_text_analysis, process_text_analysis_batch,
+    analyze_modality, finalize_multimodal_analysis
+)
 from core.models import ThreatDetection, AnalysisSession
+from core.blob_store import get_blob_store, BlobTooLarge
+from core.notifications import summarize_outcome
+from core.task_owners import get_task_owners
+from core.ingest import NdjsonIngest, QueueMonitor, UnsupportedEncoding, open_body, STOP
+from visual.models import VisualCapture
+from audio.models import AudioCapture
 from drf_yasg.utils import swagger_auto_schema
+from .uploads import receive_upload, attach_blob, image_metadata, audio_metadata
 from .serializers import (
     VisualAnalysisRequestSerializer, AudioAnalysisRequestSerializer,
-    TextAnalysisRequestSerializer, MultimodalAnalysisRequestSerializer,
+    VisualUploadRequestSerializer, AudioUploadRequestSerializer,
+    TextAnalysisRequestSerializer, TextBatchAnalysisRequestSerializer, MultimodalAnalysisRequestSerializer,
     ThreatDetectionSerializer, AnalysisSessionSerializer,
     UserSerializer
 )
 
 logger = logging.getLogger('rt_cta')
 
+def store_upload(encoded, field):
+    """
+    Store a base64 upload once in the blob store and return the key tasks receive instead of the data
+
+    Raises:
+        ValidationError: The field is not valid base64, answered with a 400
+    """
+    try:
+        data = base64.b64decode(encoded, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValidationError({field: ["Invalid base64 data"]})
+    return get_blob_store().put(data)
+
 class LoginView(TokenObtainPairView):
     permission_classes = [AllowAny]
     
@@ -70,8 +101,21 @@ class BaseAnalysisView(views.APIView):
             # Process the request (to be implemented in subclasses)
             result = self.process_request(request)
             
+            # Only this user can poll the tasks on /api/tasks/status/
+            get_task_owners().record(
+                [result["task_id"]] + [task["task_id"] for task in result.get("tasks", [])],
+                request.user.id
+            )
+            
             return Response(result, status=status.HTTP_200_OK)
             
+        except ValidationError as e:
+            return Response({"error": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+        except AnalysisSession.DoesNotExist:
+            return Response({"error": "Analysis session not found"}, status=status.HTTP_404_NOT_FOUND)
+        except BlobTooLarge as e:
+            logger.warning(f"Rejected oversized {analysis_type} request from user {request.user}: {str(e)}")
+            return Response({"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
         except Exception as e:
             logger.error(f"Error in {analysis_type} analysis: {str(e)}")
             return Response(
@@ -96,12 +140,12 @@ class VisualAnalysisView(BaseAnalysisView):
         serializer = VisualAnalysisRequestSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        image_data = serializer.validated_data['image']
+        image_key = store_upload(serializer.validated_data['image'], 'image')
         session_id = serializer.validated_data.get('session_id')
         
         # Submit task for asynchronous processing
         task = process_visual_analysis.delay(
-            image_data, 
+            image_key,
             request.user.id,
             session_id
         )
@@ -126,13 +170,13 @@ class AudioAnalysisView(BaseAnalysisView):
         serializer = AudioAnalysisRequestSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        audio_data = serializer.validated_data['audio']
+        audio_key = store_upload(serializer.validated_data['audio'], 'audio')
         transcription = serializer.validated_data.get('transcription', '')
         session_id = serializer.validated_data.get('session_id')
         
         # Submit task for asynchronous processing
         task = process_audio_analysis.delay(
-            audio_data,
+            audio_key,
             transcription,
             request.user.id,
             session_id
@@ -144,6 +188,114 @@ class AudioAnalysisView(BaseAnalysisView):
             "status": "processing"
         }
 
+class BinaryUploadView(BaseAnalysisView):
+    """
+    Base for endpoints taking media as a binary body instead of base64 JSON
+
+    Accepts multipart/form-data with the file in `upload_field`, or the raw
+    file with any other content type (e.g. application/octet-stream) and the
+    other fields in the query string. The body is streamed into the blob store
+    and hashed on the way; the capture row points at the stored blob.
+    """
+    parser_classes = [MultiPartParser]
+    upload_field = None
+    session_type = None
+
+    def get_session(self, request, session_id):
+        if session_id:
+            return AnalysisSession.objects.get(id=session_id, user=request.user)
+        return AnalysisSession.objects.create(
+            user=request.user,
+            session_type=self.session_type,
+            status='processing'
+        )
+
+    def upload_metadata(self, upload):
+        return {
+            "blob_key": upload.blob_key,
+            "filename": upload.name,
+            "content_type": upload.content_type,
+            "size": upload.size,
+        }
+
+class VisualUploadView(BinaryUploadView):
+    upload_field = 'image'
+    session_type = 'visual'
+
+    @swagger_auto_schema(
+        operation_description="Upload an image as multipart/form-data (field 'image') or as the raw "
+                              "request body for visual threat analysis",
+        responses={200: "Analysis task submitted successfully", 413: "Image too large"}
+    )
+    def post(self, request, *args, **kwargs):
+        return self.handle_analysis(request, "visual upload")
+
+    def process_request(self, request):
+        upload, fields = receive_upload(request, self.upload_field, settings.UPLOAD_MAX_IMAGE_BYTES)
+        serializer = VisualUploadRequestSerializer(data=fields)
+        serializer.is_valid(raise_exception=True)
+        
+        capture = VisualCapture(metadata=dict(self.upload_metadata(upload), **image_metadata(upload)))
+        capture.session = self.get_session(request, serializer.validated_data.get('session_id'))
+        attach_blob(capture.image, upload)
+        capture.save()
+        
+        task = process_visual_analysis.delay(
+            upload.blob_key,
+            request.user.id,
+            capture.session_id
+        )
+        
+        return {
+            "message": "Visual analysis task submitted successfully",
+            "task_id": task.id,
+            "session_id": capture.session_id,
+            "capture_id": capture.id,
+            "status": "processing"
+        }
+
+class AudioUploadView(BinaryUploadView):
+    upload_field = 'audio'
+    session_type = 'audio'
+
+    @swagger_auto_schema(
+        operation_description="Upload audio as multipart/form-data (field 'audio') or as the raw "
+                              "request body for threat analysis",
+        responses={200: "Analysis task submitted successfully", 413: "Audio too large"}
+    )
+    def post(self, request, *args, **kwargs):
+        return self.handle_analysis(request, "audio upload")
+
+    def process_request(self, request):
+        upload, fields = receive_upload(request, self.upload_field, settings.UPLOAD_MAX_AUDIO_BYTES)
+        serializer = AudioUploadRequestSerializer(data=fields)
+        serializer.is_valid(raise_exception=True)
+        
+        # Fields sent by the client win over what the file header says
+        properties = dict({"duration": 0.0, "sample_rate": 0, "channels": 0}, **audio_metadata(upload))
+        properties.update(
+            (name, serializer.validated_data[name]) for name in properties if name in serializer.validated_data
+        )
+        capture = AudioCapture(metadata=self.upload_metadata(upload), **properties)
+        capture.session = self.get_session(request, serializer.validated_data.get('session_id'))
+        attach_blob(capture.audio_file, upload)
+        capture.save()
+        
+        task = process_audio_analysis.delay(
+            upload.blob_key,
+            serializer.validated_data.get('transcription', ''),
+            request.user.id,
+            capture.session_id
+        )
+        
+        return {
+            "message": "Audio analysis task submitted successfully",
+            "task_id": task.id,
+            "session_id": capture.session_id,
+            "capture_id": capture.id,
+            "status": "processing"
+        }
+
 class TextAnalysisView(BaseAnalysisView):
     @swagger_auto_schema(
         request_body=TextAnalysisRequestSerializer,
@@ -160,20 +312,127 @@ class TextAnalysisView(BaseAnalysisView):
         
         text = serializer.validated_data['text']
         session_id = serializer.validated_data.get('session_id')
+        source_type = serializer.validated_data.get('source_type')
+        
+        if session_id:
+            # Only the caller's own sessions (and conversations) can be continued
+            session_id = AnalysisSession.objects.get(id=session_id, user=request.user).id
+        elif source_type == 'chat':
+            # A chat's messages arrive one at a time; they share a session holding the conversation state
+            session_id = AnalysisSession.objects.create(
+                user=request.user,
+                session_type='text',
+                status='active'
+            ).id
         
         # Submit task for asynchronous processing
         task = process_text_analysis.delay(
             text,
             request.user.id,
-            session_id
+            session_id,
+            source_type=source_type
         )
         
         return {
             "message": "Text analysis task submitted successfully",
             "task_id": task.id,
+            "session_id": session_id,
+            "status": "processing"
+        }
+
+class TextBatchAnalysisView(BaseAnalysisView):
+    @swagger_auto_schema(
+        request_body=TextBatchAnalysisRequestSerializer,
+        operation_description="Submit many texts in one request for threat analysis by a single task",
+        responses={200: "Analysis task submitted successfully"}
+    )
+    def post(self, request, *args, **kwargs):
+        return self.handle_analysis(request, "text batch")
+
+    def process_request(self, request):
+        serializer = TextBatchAnalysisRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        texts = serializer.validated_data['texts']
+        session_id = serializer.validated_data.get('session_id')
+        if session_id:
+            session_id = AnalysisSession.objects.get(id=session_id, user=request.user).id
+        else:
+            session_id = AnalysisSession.objects.create(
+                user=request.user,
+                session_type='text',
+                status='processing'
+            ).id
+        
+        # One task for the whole batch rather than one per text
+        task = process_text_analysis_batch.delay(
+            texts,
+            request.user.id,
+            session_id,
+            source_type=serializer.validated_data.get('source_type')
+        )
+        
+        return {
+            "message": "Batch text analysis task submitted successfully",
+            "task_id": task.id,
+            "session_id": session_id,
+            "count": len(texts),
             "status": "processing"
         }
 
+class TextIngestView(views.APIView):
+    """
+    Streaming NDJSON ingest for log shippers
+
+    The body is one JSON record per line ({"text" or "message", optional
+    "source_type" and "session_id"}), optionally gzip or zstd compressed
+    (Content-Encoding). It is read incrementally, never buffered whole, and
+    the response streams back one NDJSON acknowledgement per dispatched
+    batch, one per rejected line and a final status.
+
+    Serve this endpoint with a WSGI server (rt_cta/wsgi.py): under ASGI
+    Django receives the whole body before the view runs, so there is no
+    backpressure on the shipper and no acknowledgement until it is uploaded.
+    """
+    permission_classes = [IsAuthenticated]
+    # The body is read as a stream, never through request.data
+    parser_classes = []
+
+    @swagger_auto_schema(
+        operation_description="Stream newline-delimited JSON records for batched threat analysis. "
+                              "Query parameters: source_type (default 'log'), session_id",
+        responses={
+            200: "NDJSON stream of per-batch acknowledgements",
+            415: "Unsupported Content-Encoding",
+            429: "Analysis queue is full, retry later"
+        }
+    )
+    def post(self, request, *args, **kwargs):
+        monitor = QueueMonitor()
+        if monitor.check()[1] == STOP:
+            return Response(
+                {"error": "Analysis queue is full, retry later"},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(settings.INGEST_RETRY_AFTER_SECONDS)}
+            )
+        try:
+            reader = open_body(request._request, request.META.get('HTTP_CONTENT_ENCODING'))
+        except UnsupportedEncoding as e:
+            return Response({"error": str(e)}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        
+        logger.info(f"Received text ingest stream from user {request.user}")
+        ingest = NdjsonIngest(
+            request.user,
+            reader,
+            source_type=request.query_params.get('source_type'),
+            session_id=request.query_params.get('session_id'),
+            monitor=monitor
+        )
+        return StreamingHttpResponse(
+            (json.dumps(ack) + "\n" for ack in ingest),
+            content_type='application/x-ndjson'
+        )
+
 class MultimodalAnalysisView(BaseAnalysisView):
     @swagger_auto_schema(
         request_body=MultimodalAnalysisRequestSerializer,
@@ -188,6 +447,15 @@ class MultimodalAnalysisView(BaseAnalysisView):
         serializer = MultimodalAnalysisRequestSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
+        if not {'text', 'image', 'audio'} & set(serializer.validated_data):
+            raise ValidationError("Provide at least one of text, image or audio")
+        
+        # Uploads are checked before the session exists, so a bad one leaves no session behind
+        keys = {
+            field: store_upload(serializer.validated_data[field], field)
+            for field in ('image', 'audio') if field in serializer.validated_data
+        }
+        
         # Create a multimodal analysis session
         session = AnalysisSession.objects.create(
             user=request.user,
@@ -195,42 +463,80 @@ class MultimodalAnalysisView(BaseAnalysisView):
             status='processing'
         )
         
-        tasks = []
-        
-        # Process each input type if available
+        parts = []
         if 'text' in serializer.validated_data:
-            task = process_text_analysis.delay(
-                serializer.validated_data['text'],
-                request.user.id,
-                session.id
-            )
-            tasks.append({"type": "text", "task_id": task.id})
-            
-        if 'image' in serializer.validated_data:
-            task = process_visual_analysis.delay(
-                serializer.validated_data['image'],
-                request.user.id,
-                session.id
-            )
-            tasks.append({"type": "visual", "task_id": task.id})
-            
-        if 'audio' in serializer.validated_data:
+            parts.append(('text', [serializer.validated_data['text'], request.user.id, session.id]))
+        if 'image' in keys:
+            parts.append(('visual', [keys['image'], request.user.id, session.id]))
+        if 'audio' in keys:
             transcription = serializer.validated_data.get('transcription', '')
-            task = process_audio_analysis.delay(
-                serializer.validated_data['audio'],
-                transcription,
-                request.user.id,
-                session.id
-            )
-            tasks.append({"type": "audio", "task_id": task.id})
+            parts.append(('audio', [keys['audio'], transcription, request.user.id, session.id]))
+        # One chord: the modalities run in parallel and a single callback fuses
+        # their verdicts and finalizes the session
+        dispatched_at = time.time()
+        header = [analyze_modality.s(modality, args, dispatched_at) for modality, args in parts]
+        tasks = [{"type": modality, "task_id": signature.freeze().id} for (modality, _), signature in zip(parts, header)]
+        result = chord(header)(finalize_multimodal_analysis.s(request.user.id, session.id))
         
         return {
             "message": "Multimodal analysis tasks submitted successfully",
             "session_id": session.id,
+            "task_id": result.id,
             "tasks": tasks,
             "status": "processing"
         }
 
+class TaskStatusView(views.APIView):
+    """
+    Status of many analysis tasks in one request
+
+    The same summary the WebSocket pushes when a task finishes, for clients
+    that cannot hold a socket. With a key-value result backend (Redis) all
+    ids are read in a single round trip. Only the caller's own tasks are
+    reported; other ids are "unknown", whether they exist or not.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_description="Get the status of up to TASK_STATUS_MAX_IDS analysis tasks, "
+                              "given as ?ids=<id>,<id>,... (or repeated ids parameters)",
+        responses={200: "Task statuses by id", 400: "No ids or too many ids"}
+    )
+    def get(self, request):
+        ids = []
+        for value in request.query_params.getlist('ids'):
+            ids.extend(task_id.strip() for task_id in value.split(',') if task_id.strip())
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return Response({"error": "Pass task ids as ?ids=<id>,<id>"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > settings.TASK_STATUS_MAX_IDS:
+            return Response(
+                {"error": f"At most {settings.TASK_STATUS_MAX_IDS} ids per request"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        owned = get_task_owners().owned(ids, request.user.id)
+        owned_ids = [task_id for task_id in ids if task_id in owned]
+        backend = celery_app.backend
+        if not owned_ids:
+            metas = {}
+        elif hasattr(backend, 'get_many'):
+            # One MGET of the finished tasks; the others are still queued or running
+            metas = dict(backend.get_many(owned_ids, interval=0, max_iterations=1))
+        else:
+            metas = {}
+            for task_id in owned_ids:
+                result = celery_app.AsyncResult(task_id)
+                metas[task_id] = {"status": result.state, "result": result.result}
+        
+        return Response({"tasks": {
+            task_id: summarize_outcome(
+                metas.get(task_id, {}).get("status", states.PENDING),
+                metas.get(task_id, {}).get("result")
+            ) if task_id in owned else {"state": "UNKNOWN", "status": "unknown"}
+            for task_id in ids
+        }})
+
 class AnalysisResultView(views.APIView):
     permission_classes = [IsAuthenticated]
     
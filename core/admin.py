@@ -3,8 +3,8 @@ from .models import ThreatDetection, AnalysisSession
 
 @admin.register(ThreatDetection)
 class ThreatDetectionAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'threat_level', 'source_type', 'confidence_score', 'is_false_positive', 'created_at')
-    list_filter = ('threat_level', 'source_type', 'is_false_positive')
+    list_display = ('id', 'user', 'threat_level', 'source_type', 'confidence_score', 'analysis_tier', 'is_false_positive', 'created_at')
+    list_filter = ('threat_level', 'source_type', 'analysis_tier', 'degraded', 'is_false_positive')
     search_fields = ('description',)
     date_hierarchy = 'created_at'
 
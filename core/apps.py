@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "core"
+
+    def ready(self):
+        # Connects the receivers pushing task outcomes and dashboard changes over WebSocket
+        from . import notifications
+        notifications.connect_threat_receivers()
@@ -0,0 +1,462 @@
+import json
+import time
+import asyncio
+import inspect
+import logging
+import weakref
+import groq
+import httpx
+from django.conf import settings
+from .rate_limit import estimate_tokens, off_loop
+from .circuit_breaker import CircuitOpenError
+from .groq_utils import GroqClient, GroqClientPool, get_groq_client
+
+logger = logging.getLogger('rt_cta')
+
+# httpx connection pools are bound to the event loop they were created on
+_http_clients = weakref.WeakKeyDictionary()
+_connection_gates = weakref.WeakKeyDictionary()
+
+def get_async_http_client():
+    """
+    Return the shared pooled HTTP client for the running event loop
+
+    All AsyncGroqClient instances on a loop share one connection pool, sized
+    by GROQ_ASYNC_MAX_CONNECTIONS, so hundreds of concurrent analyses reuse a
+    few keep-alive sockets instead of opening one each.
+    """
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.GROQ_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.GROQ_ASYNC_MAX_KEEPALIVE,
+                keepalive_expiry=settings.GROQ_ASYNC_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                settings.GROQ_TIMEOUT,
+                connect=settings.GROQ_ASYNC_CONNECT_TIMEOUT,
+                pool=settings.GROQ_ASYNC_POOL_TIMEOUT,
+            ),
+        )
+        _http_clients[loop] = client
+    return client
+
+def _connection_gate():
+    """
+    Semaphore admitting at most GROQ_ASYNC_MAX_CONNECTIONS requests into the pool
+
+    Queueing hundreds of requests inside httpcore's pool costs far more CPU
+    per request than waiting on a semaphore in front of it.
+    """
+    loop = asyncio.get_running_loop()
+    gate = _connection_gates.get(loop)
+    if gate is None:
+        gate = _connection_gates[loop] = asyncio.Semaphore(settings.GROQ_ASYNC_MAX_CONNECTIONS)
+    return gate
+
+async def close_async_http_client():
+    """Close the shared HTTP client of the running event loop, if any"""
+    client = _http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+class AsyncGroqClient:
+    """
+    Asyncio counterpart of GroqClient for consumers, async views and asyncio workers.
+
+    Wraps a GroqClient or GroqClientPool and offers its analyze_* API as
+    coroutines. Requests are built and replies parsed by the wrapped client,
+    and go through its verdict cache, rate-limit budgets and circuit
+    breakers; a pool's members are picked and failed over by the pool's own
+    policy. Calls go out over the loop's pooled keep-alive HTTP client, and
+    whatever talks to Redis (shared cache, budgets, usage counters) runs in
+    a worker thread so the loop never blocks on it. Identical analyses in
+    flight on the same loop are coalesced into one request.
+    """
+
+    def __init__(self, client=None):
+        self.sync = client if client is not None else get_groq_client()
+        self.cache = self.sync.cache
+        self.prompt = self.sync.prompt
+        self._clients = weakref.WeakKeyDictionary()
+        self._inflight = weakref.WeakKeyDictionary()
+        logger.info("Initialized async Groq client")
+
+    def _client(self, endpoint):
+        """
+        Groq SDK client for an endpoint (the wrapped client or a pool member),
+        bound to the running loop's shared HTTP pool
+        """
+        http_client = get_async_http_client()
+        clients = self._clients.setdefault(asyncio.get_running_loop(), {})
+        client = clients.get(id(endpoint))
+        if client is None or client._client is not http_client:
+            # Retries are handled by the rate-limit scheduler, not the SDK
+            client = clients[id(endpoint)] = groq.AsyncGroq(
+                api_key=endpoint.api_key,
+                base_url=endpoint.base_url,
+                max_retries=0,
+                timeout=settings.GROQ_TIMEOUT,
+                http_client=http_client,
+            )
+        return client
+
+    def circuit_retry_after(self):
+        """Seconds until a Groq endpoint may accept calls again (0 if one is available)"""
+        return self.sync.circuit_retry_after()
+
+    async def _send(self, endpoint, consume, kwargs):
+        """One call to an endpoint, inside the connection gate"""
+        async with _connection_gate():
+            response = await self._client(endpoint).chat.completions.create(**kwargs)
+            if consume is not None:
+                return await consume(response)
+            return response
+
+    async def _create_completion(self, consume=None, **kwargs):
+        """
+        Send a chat completion through the rate-limit scheduler and circuit breaker
+
+        Args:
+            consume (coroutine function, optional): Awaited with the response
+                inside the breaker and connection gate, so reading a streamed
+                reply counts as part of the call
+        """
+        if isinstance(self.sync, GroqClientPool):
+            return await self._create_pooled_completion(consume, kwargs)
+        endpoint = self.sync
+        tokens = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens", 0))
+        return await endpoint.scheduler.acall(
+            lambda: endpoint.breaker.acall(lambda: self._send(endpoint, consume, kwargs)),
+            tokens,
+            kwargs["model"],
+        )
+
+    async def _create_pooled_completion(self, consume, kwargs):
+        """GroqClientPool._create_completion on the event loop: best member first, failing over on errors"""
+        pool = self.sync
+        tokens = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens", 0))
+        model = kwargs["model"]
+        last_error = None
+
+        for attempt in range(settings.GROQ_MAX_RETRIES + 1):
+            waits = []
+            for member in pool._candidates():
+                wait = await member.scheduler.atry_acquire(tokens, model)
+                if wait > 0:
+                    waits.append(wait)
+                    continue
+
+                pool._started(member)
+                try:
+                    return await member.breaker.acall(lambda: self._send(member, consume, kwargs))
+                except pool.FAILOVER_ERRORS as e:
+                    last_error = e
+                    await off_loop(member.scheduler.redis is not None, pool._member_failed, member, e, waits)
+                finally:
+                    pool._finished(member)
+
+            if attempt == settings.GROQ_MAX_RETRIES:
+                break
+            await asyncio.sleep(pool._failover_delay(attempt, waits, last_error))
+
+        raise pool._exhausted(last_error, waits)
+
+    async def _cached(self, key):
+        """Verdict cache lookup; a shared lookup runs off the loop"""
+        if self.cache is None:
+            return None
+        return await off_loop(self.cache.redis is not None, self.cache.get, key)
+
+    async def _store(self, key, result):
+        if self.cache is not None:
+            await off_loop(self.cache.redis is not None, self.cache.set, key, result)
+
+    async def _reply(self, kind, request, response, started, content=None):
+        """GroqClient._reply; shared usage counters are written off the loop"""
+        return await off_loop(self.sync.usage.redis is not None, self.sync._reply, kind, request, response, started, content)
+
+    async def _coalesce(self, key, factory):
+        """Share one in-flight request per key among concurrent callers on this loop"""
+        inflight = self._inflight.setdefault(asyncio.get_running_loop(), {})
+        task = inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            inflight[key] = task
+            task.add_done_callback(lambda _: inflight.pop(key, None))
+        # Shielded so one cancelled caller does not cancel the request for the others
+        return await asyncio.shield(task)
+
+    async def analyze_text(self, text, model=None, modality='text'):
+        """
+        Analyze text content for potential threats
+
+        Args:
+            text (str): The text content to analyze
+            model (str, optional): The model to use for analysis. When omitted
+                the small/large cascade is used if enabled, else the large model
+            modality (str): Input modality, used to pick cascade thresholds
+
+        Returns:
+            str: The JSON analysis, as returned by GroqClient.analyze_text
+        """
+        if model is None:
+            if settings.GROQ_CASCADE_ENABLED:
+                return await self._cascade_text_analysis(text, modality)
+            model = settings.GROQ_LARGE_MODEL
+
+        cache_key = self.sync._cache_key(text, model)
+        cached = await self._cached(cache_key)
+        if cached is not None:
+            logger.info(f"Verdict cache hit for text analysis with model: {model}")
+            return cached
+
+        return await self._coalesce(cache_key, lambda: self._request_text_analysis(text, model, cache_key))
+
+    async def _cascade_text_analysis(self, text, modality):
+        """Screen with the small model and escalate to the large model only when needed"""
+        result = await self.analyze_text(text, model=settings.GROQ_SMALL_MODEL)
+        verdict, escalate = GroqClient._screen(result, modality)
+        if not escalate:
+            verdict["analysis_tier"] = "small"
+            return json.dumps(verdict)
+
+        logger.info(f"Escalating {modality} analysis to {settings.GROQ_LARGE_MODEL}")
+        result = await self.analyze_text(text, model=settings.GROQ_LARGE_MODEL)
+        return GroqClient._with_tier(result, "large")
+
+    async def _request_text_analysis(self, text, model, cache_key):
+        """Call Groq for a single text analysis and cache the verdict"""
+        try:
+            logger.info(f"Analyzing text with Groq model: {model} (async)")
+            request = self.sync._text_request(text, model)
+            started = time.monotonic()
+            response = await self._create_completion(**request)
+            result = self.prompt.parse_text(await self._reply('text', request, response, started))
+            logger.info(f"Groq text analysis completed successfully")
+            await self._store(cache_key, result)
+            return result
+
+        except Exception as e:
+            logger.error(f"Error analyzing text with Groq: {str(e)}")
+            raise
+
+    async def analyze_text_stream(self, text, model=None, on_update=None, modality='text'):
+        """
+        Analyze text with a streamed completion, surfacing key fields early
+
+        Goes through the same cascade and in-flight coalescing as
+        analyze_text; only the caller that made the call receives early updates.
+
+        Args:
+            text (str): The text content to analyze
+            model (str, optional): The model to use for analysis. When omitted
+                the small/large cascade is used if enabled, else the large model
+            on_update (callable, optional): Called (or awaited, if a coroutine
+                function) with the fields extracted so far, once the early
+                fields are known
+            modality (str): Input modality, used to pick cascade thresholds
+
+        Returns:
+            str: The complete JSON analysis
+        """
+        if model is None:
+            if settings.GROQ_CASCADE_ENABLED:
+                result = await self.analyze_text(text, model=settings.GROQ_SMALL_MODEL)
+                verdict, escalate = GroqClient._screen(result, modality)
+                if not escalate:
+                    verdict["analysis_tier"] = "small"
+                    return json.dumps(verdict)
+                logger.info(f"Escalating streamed {modality} analysis to {settings.GROQ_LARGE_MODEL}")
+                result = await self.analyze_text_stream(text, settings.GROQ_LARGE_MODEL, on_update, modality)
+                return GroqClient._with_tier(result, "large")
+            model = settings.GROQ_LARGE_MODEL
+
+        cache_key = self.sync._cache_key(text, model)
+        cached = await self._cached(cache_key)
+        if cached is not None:
+            logger.info(f"Verdict cache hit for streamed text analysis with model: {model}")
+            return cached
+
+        return await self._coalesce(cache_key, lambda: self._request_text_stream(text, model, cache_key, on_update))
+
+    async def _request_text_stream(self, text, model, cache_key, on_update):
+        """Call Groq for a streamed text analysis and cache the verdict"""
+        notified = False
+
+        async def consume(stream):
+            nonlocal notified
+            parser = self.prompt.stream_parser()
+            async for chunk in stream:
+                fields = GroqClient._feed_stream(parser, chunk)
+                if fields is None:
+                    continue
+                if on_update and not notified and parser.early_fields_ready:
+                    notified = True
+                    try:
+                        update = on_update(fields)
+                        if inspect.isawaitable(update):
+                            await update
+                    except Exception as e:
+                        logger.error(f"Error in streaming update callback: {str(e)}")
+            return parser
+
+        try:
+            logger.info(f"Streaming text analysis with Groq model: {model} (async)")
+            request = self.sync._text_request(text, model, stream=True)
+            started = time.monotonic()
+            parser = await self._create_completion(consume=consume, **request)
+            result = self.prompt.parse_text(await self._reply('stream', request, None, started, parser.content))
+            logger.info(f"Groq streamed text analysis completed successfully")
+            await self._store(cache_key, result)
+            return result
+
+        except Exception as e:
+            logger.error(f"Error streaming text analysis with Groq: {str(e)}")
+            raise
+
+    async def analyze_text_batch(self, texts, model=None, modality='text'):
+        """
+        Analyze many short texts in as few requests as possible, batches running concurrently
+
+        Args:
+            texts (list[str]): The text contents to analyze
+            model (str, optional): The model to use for analysis. When omitted
+                the small/large cascade is used if enabled, else the large model
+            modality (str): Input modality, used to pick cascade thresholds
+
+        Returns:
+            list: One analysis result per input, in input order
+        """
+        if model is None:
+            if not settings.GROQ_CASCADE_ENABLED:
+                return await self._analyze_text_batch(texts, settings.GROQ_LARGE_MODEL)
+
+            results = []
+            escalated = []
+            for index, result in enumerate(await self._analyze_text_batch(texts, settings.GROQ_SMALL_MODEL)):
+                verdict, escalate = GroqClient._screen(result, modality)
+                if escalate:
+                    escalated.append(index)
+                    results.append(None)
+                else:
+                    verdict["analysis_tier"] = "small"
+                    results.append(json.dumps(verdict))
+
+            if escalated:
+                logger.info(f"Escalating {len(escalated)} of {len(texts)} batched texts to {settings.GROQ_LARGE_MODEL}")
+                large_results = await self._analyze_text_batch([texts[i] for i in escalated], settings.GROQ_LARGE_MODEL)
+                for index, result in zip(escalated, large_results):
+                    results[index] = GroqClient._with_tier(result, "large")
+            return results
+
+        return await self._analyze_text_batch(texts, model)
+
+    async def _analyze_text_batch(self, texts, model):
+        """Batch-analyze texts with a single model"""
+        results = [None] * len(texts)
+        cache_keys = [None] * len(texts)
+        if self.cache is not None:
+            cache_keys = [self.sync._cache_key(text, model) for text in texts]
+            results = list(await asyncio.gather(*(self._cached(key) for key in cache_keys)))
+        pending = [index for index, result in enumerate(results) if result is None]
+
+        await asyncio.gather(*(
+            self._run_text_batch(texts, batch, results, cache_keys, model)
+            for batch in GroqClient._split_batches(texts, pending)
+        ))
+        return results
+
+    async def _run_text_batch(self, texts, indices, results, cache_keys, model):
+        """Send one packed request for the given indices and fill in results"""
+        if len(indices) == 1:
+            index = indices[0]
+            results[index] = await self.analyze_text(texts[index], model=model)
+            return
+
+        parsed = {}
+        try:
+            logger.info(f"Analyzing batch of {len(indices)} texts with Groq model: {model} (async)")
+            request = self.sync._batch_request(texts, indices, model)
+            started = time.monotonic()
+            response = await self._create_completion(**request)
+            parsed = self.prompt.parse_batch(await self._reply('batch', request, response, started), len(indices))
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Error analyzing text batch with Groq: {str(e)}")
+
+        missing = [(number, index) for number, index in enumerate(indices, start=1) if number not in parsed]
+        fallbacks = await asyncio.gather(*(self.analyze_text(texts[index], model=model) for _, index in missing))
+        for (_, index), result in zip(missing, fallbacks):
+            results[index] = result
+        for number, index in enumerate(indices, start=1):
+            if number in parsed:
+                results[index] = json.dumps(parsed[number])
+                if cache_keys[index] is not None:
+                    await self._store(cache_keys[index], results[index])
+        GroqClient._log_batch_outcome(len(missing), len(indices))
+
+    async def analyze_conversation(self, summary, risk_level, recent, new, model=None):
+        """
+        Analyze new chat messages against the rolling summary of the conversation
+
+        Args:
+            summary (str): Rolling summary of the conversation so far
+            risk_level (str): Current conversation risk level
+            recent (list[str]): Last already-analyzed messages, for context
+            new (list[str]): Messages not analyzed yet
+            model (str, optional): The model to use, defaults to the large model
+
+        Returns:
+            str: The JSON analysis plus an updated "summary" field
+        """
+        model = model or settings.GROQ_LARGE_MODEL
+        try:
+            logger.info(f"Analyzing {len(new)} new chat messages with Groq model: {model} (async)")
+            request = self.sync._conversation_request(summary, risk_level, recent, new, model)
+            started = time.monotonic()
+            response = await self._create_completion(**request)
+            return self.prompt.parse_text(await self._reply('conversation', request, response, started))
+
+        except Exception as e:
+            logger.error(f"Error analyzing conversation with Groq: {str(e)}")
+            raise
+
+    async def analyze_image(self, image_data, prompt, model=None):
+        """
+        Analyze image content for potential threats
+
+        Args:
+            image_data (bytes): The image data to analyze
+            prompt (str): Additional prompt to guide the analysis
+            model (str, optional): The model to use for analysis
+
+        Returns:
+            dict: Analysis results including threat detection and confidence
+        """
+        return self.sync.analyze_image(image_data, prompt, model)
+
+    async def analyze_audio(self, audio_text, model=None):
+        """
+        Analyze transcribed audio content for potential threats
+
+        Args:
+            audio_text (str): The transcribed audio content to analyze
+            model (str, optional): The model to use for analysis
+
+        Returns:
+            str: The JSON analysis
+        """
+        return await self.analyze_text(audio_text, model=model, modality='audio')
+
+_async_groq_client = None
+
+def get_async_groq_client():
+    """Return the process-wide async Groq client, wrapping the Groq client configured in settings"""
+    global _async_groq_client
+    if _async_groq_client is None:
+        _async_groq_client = AsyncGroqClient()
+    return _async_groq_client
@@ -0,0 +1,336 @@
+import os
+import re
+import mmap
+import hashlib
+import logging
+import tempfile
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger('rt_cta')
+
+KEY_PREFIX = 'sha256:'
+KEY_PATTERN = re.compile(r'^sha256:[0-9a-f]{64}$')
+
+def is_blob_key(value):
+    """Whether a task argument is a claim-check key rather than inline (base64) data"""
+    return isinstance(value, str) and value.startswith(KEY_PREFIX)
+
+def blob_key(data):
+    """The content address of some bytes"""
+    return KEY_PREFIX + hashlib.sha256(data).hexdigest()
+
+class BlobTooLarge(ValueError):
+    """An upload exceeded the size cap while being streamed in"""
+
+    def __init__(self, max_bytes):
+        super().__init__(f"Upload exceeds the {max_bytes} byte limit")
+        self.max_bytes = max_bytes
+
+class BlobWriter:
+    """
+    Streams a blob into a store chunk by chunk, hashing as it goes
+
+    Content goes to a temporary file and is moved under its SHA-256 on
+    commit(), so nothing is held in memory and a partial upload never
+    becomes visible.
+    """
+
+    def __init__(self, store, max_bytes=None):
+        self.store = store
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._temp_path = store._temp_path()
+        self._file = open(self._temp_path, 'wb')
+
+    def write(self, chunk):
+        """Append a chunk, aborting with BlobTooLarge once the size cap is passed"""
+        self.size += len(chunk)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            self.abort()
+            raise BlobTooLarge(self.max_bytes)
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def commit(self):
+        """Finish the blob and return its key"""
+        self._file.close()
+        key = KEY_PREFIX + self._hash.hexdigest()
+        try:
+            self.store._commit(self._temp_path, key)
+        finally:
+            if os.path.exists(self._temp_path):
+                os.unlink(self._temp_path)
+        return key
+
+    def abort(self):
+        """Discard everything written so far"""
+        self._file.close()
+        if os.path.exists(self._temp_path):
+            os.unlink(self._temp_path)
+
+class BlobStore:
+    """
+    Content-addressed store for uploaded media (claim-check pattern).
+
+    Uploads are written once under the SHA-256 of their content and only the
+    key travels through Celery; workers read or memory-map the blob. Storing
+    the same content twice is a no-op.
+    """
+
+    def put(self, data):
+        """
+        Store bytes
+
+        Args:
+            data (bytes): The content
+
+        Returns:
+            str: The blob key ("sha256:<hex>")
+        """
+        writer = self.writer()
+        writer.write(data)
+        return writer.commit()
+
+    def writer(self, max_bytes=None):
+        """Start streaming a blob in; see BlobWriter"""
+        return BlobWriter(self, max_bytes)
+
+    def storage_name(self, key):
+        """Name of the blob in Django's default storage, or None if it lives elsewhere"""
+        return None
+
+    def _temp_path(self):
+        """A new temporary file to stream an upload into"""
+        raise NotImplementedError
+
+    def _commit(self, temp_path, key):
+        """Move a finished temporary file into place under its key"""
+        raise NotImplementedError
+
+    def open(self, key):
+        """Open a blob for binary reading"""
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def size(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def prune(self, older_than, keep=()):
+        """
+        Delete blobs last written before a cutoff
+
+        Args:
+            older_than (datetime): Timezone-aware cutoff
+            keep (set): Keys of blobs still referenced, never deleted
+
+        Returns:
+            int: Number of blobs deleted
+        """
+        raise NotImplementedError
+
+    def read(self, key):
+        with self.open(key) as blob:
+            return blob.read()
+
+    @contextmanager
+    def mmap(self, key):
+        """
+        Map a blob read-only into memory
+
+        Falls back to reading it when the backend has no local file to map.
+
+        Yields:
+            mmap.mmap or bytes: The blob content
+        """
+        with self.open(key) as blob:
+            try:
+                fileno = blob.fileno()
+            except (AttributeError, OSError):
+                yield blob.read()
+                return
+            if os.fstat(fileno).st_size == 0:
+                yield b''
+                return
+            mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+            try:
+                yield mapped
+            finally:
+                mapped.close()
+
+    @staticmethod
+    def _digest(key):
+        if not KEY_PATTERN.match(key or ''):
+            raise ValueError(f"Invalid blob key: {key!r}")
+        return key[len(KEY_PREFIX):]
+
+    @staticmethod
+    def _relative_path(digest):
+        # Two levels of fan-out keep directories small
+        return os.path.join(digest[:2], digest[2:4], digest)
+
+class FileSystemBlobStore(BlobStore):
+    """Blobs as files under a local directory, written atomically"""
+
+    def __init__(self, root=None):
+        self.root = root or settings.BLOB_STORE_ROOT
+
+    def path(self, key):
+        return os.path.join(self.root, self._relative_path(self._digest(key)))
+
+    def _temp_path(self):
+        # Inside the root so the final move is an atomic rename on the same filesystem
+        os.makedirs(self.root, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        os.close(fd)
+        return temp_path
+
+    def _commit(self, temp_path, key):
+        path = self.path(key)
+        if os.path.exists(path):
+            # Refresh the mtime so pruning by age keeps blobs still being uploaded
+            os.utime(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def delete(self, key):
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def prune(self, older_than, keep=()):
+        cutoff = older_than.timestamp()
+        deleted = 0
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    # Leftover temp files of interrupted uploads go too
+                    if KEY_PREFIX + name not in keep and os.path.getmtime(path) < cutoff:
+                        os.unlink(path)
+                        deleted += 1
+                except FileNotFoundError:
+                    continue
+        return deleted
+
+class MediaBlobStore(BlobStore):
+    """
+    Blobs in Django's default storage (MEDIA_ROOT unless configured otherwise) under a prefix
+
+    Storing content that already exists refreshes its modified time so
+    pruning by age keeps it; storages without local files (S3 and the like)
+    get an empty marker under USED_DIR instead, which prune() honours.
+    """
+
+    USED_DIR = '.used'
+
+    def __init__(self, storage=None, prefix=None):
+        self.storage = storage or default_storage
+        self.prefix = prefix if prefix is not None else settings.BLOB_STORE_MEDIA_PREFIX
+
+    def name(self, key):
+        return os.path.join(self.prefix, self._relative_path(self._digest(key)))
+
+    def storage_name(self, key):
+        return self.name(key)
+
+    def _temp_path(self):
+        fd, temp_path = tempfile.mkstemp(dir=settings.FILE_UPLOAD_TEMP_DIR, prefix='rt_cta-upload-')
+        os.close(fd)
+        return temp_path
+
+    def _used_name(self, name):
+        return os.path.join(self.prefix, self.USED_DIR, os.path.relpath(name, self.prefix))
+
+    def _touch(self, name):
+        """Record that a stored blob was uploaded again"""
+        try:
+            os.utime(self.storage.path(name))
+        except NotImplementedError:
+            used = self._used_name(name)
+            self.storage.delete(used)
+            self.storage.save(used, ContentFile(b''))
+
+    def _commit(self, temp_path, key):
+        name = self.name(key)
+        if self.storage.exists(name):
+            self._touch(name)
+            return
+        with open(temp_path, 'rb') as temp:
+            saved = self.storage.save(name, File(temp))
+        if saved != name:
+            # Another worker stored the same content first; keep theirs
+            self.storage.delete(saved)
+
+    def open(self, key):
+        return self.storage.open(self.name(key), 'rb')
+
+    def exists(self, key):
+        return self.storage.exists(self.name(key))
+
+    def size(self, key):
+        return self.storage.size(self.name(key))
+
+    def delete(self, key):
+        name = self.name(key)
+        self.storage.delete(name)
+        self.storage.delete(self._used_name(name))
+
+    def prune(self, older_than, keep=()):
+        deleted = 0
+        used_root = os.path.join(self.prefix, self.USED_DIR)
+        pending = [self.prefix]
+        while pending:
+            directory = pending.pop()
+            try:
+                directories, files = self.storage.listdir(directory)
+            except FileNotFoundError:
+                continue
+            pending.extend(os.path.join(directory, name) for name in directories
+                           if os.path.join(directory, name) != used_root)
+            for name in files:
+                if KEY_PREFIX + name in keep:
+                    continue
+                name = os.path.join(directory, name)
+                if self.storage.get_modified_time(name) >= older_than:
+                    continue
+                used = self._used_name(name)
+                if self.storage.exists(used) and self.storage.get_modified_time(used) >= older_than:
+                    continue
+                self.storage.delete(name)
+                self.storage.delete(used)
+                deleted += 1
+        return deleted
+
+BACKENDS = {'filesystem': FileSystemBlobStore, 'media': MediaBlobStore}
+
+_blob_store = None
+
+def get_blob_store():
+    """Return the process-wide blob store for BLOB_STORE_BACKEND"""
+    global _blob_store
+    if _blob_store is None:
+        if settings.BLOB_STORE_BACKEND not in BACKENDS:
+            raise ValueError(f"Unknown blob store backend: {settings.BLOB_STORE_BACKEND}")
+        _blob_store = BACKENDS[settings.BLOB_STORE_BACKEND]()
+    return _blob_store
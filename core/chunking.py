@@ -0,0 +1,199 @@
+import json
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.conf import settings
+from .triage import LEVEL_ORDER, normalize_level
+
+logger = logging.getLogger('rt_cta')
+
+# A slice of the original text; text == original[start_index:end_index]
+TextChunk = namedtuple('TextChunk', ['text', 'start_index', 'end_index'])
+
+# Same ~4 characters per token heuristic as the rate-limit scheduler
+CHARS_PER_TOKEN = 4
+
+def estimate_text_tokens(text):
+    """Roughly estimate the tokens a piece of text will take in a prompt"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def needs_chunking(text, max_tokens=None):
+    """Whether text is too long to analyze in a single prompt"""
+    max_tokens = max_tokens or settings.GROQ_CHUNK_MAX_TOKENS
+    return estimate_text_tokens(text) > max_tokens
+
+def _records(text):
+    """
+    Split text into records on line boundaries
+
+    Indented lines (stack trace frames, wrapped or pretty-printed fields)
+    continue the record above them rather than starting a new one.
+
+    Yields:
+        tuple: (start_index, end_index) of each record, newlines included
+    """
+    start = None
+    position = 0
+    for line in text.splitlines(keepends=True):
+        continuation = line[:1] in (' ', '\t') and line.strip()
+        if start is not None and not continuation:
+            yield start, position
+            start = None
+        if start is None:
+            start = position
+        position += len(line)
+    if start is not None:
+        yield start, position
+
+def chunk_text(text, max_tokens=None):
+    """
+    Split text into chunks of whole records within a token budget
+
+    Records are packed greedily; a single record larger than the budget is
+    split on character boundaries as a last resort.
+
+    Args:
+        text (str): The text to split
+        max_tokens (int, optional): Token budget per chunk, defaults to GROQ_CHUNK_MAX_TOKENS
+
+    Returns:
+        list[TextChunk]: Chunks covering the text in order
+    """
+    max_tokens = max_tokens or settings.GROQ_CHUNK_MAX_TOKENS
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    chunks = []
+    chunk_start = chunk_end = 0
+
+    def flush():
+        if chunk_end > chunk_start and text[chunk_start:chunk_end].strip():
+            chunks.append(TextChunk(text[chunk_start:chunk_end], chunk_start, chunk_end))
+
+    for record_start, record_end in _records(text):
+        if record_end - chunk_start <= max_chars:
+            chunk_end = record_end
+            continue
+        flush()
+        chunk_start = record_start
+        while record_end - chunk_start > max_chars:
+            chunk_end = chunk_start + max_chars
+            flush()
+            chunk_start = chunk_end
+        chunk_end = record_end
+    flush()
+    return chunks
+
+def analyze_chunks(chunks, analyze, concurrency=None):
+    """
+    Map step: analyze chunks concurrently, stopping early on a CRITICAL verdict
+
+    Once any chunk comes back CRITICAL the overall level cannot rise any
+    further, so chunks not yet started are cancelled.
+
+    Args:
+        chunks (list[TextChunk]): Chunks to analyze
+        analyze (callable): Takes the chunk text and returns a verdict (dict or JSON string)
+        concurrency (int, optional): Parallel analyses, defaults to GROQ_CHUNK_CONCURRENCY
+
+    Returns:
+        tuple: (list of (TextChunk, verdict dict) in text order, whether processing stopped early)
+    """
+    concurrency = concurrency or settings.GROQ_CHUNK_CONCURRENCY
+    results = {}
+    stopped_early = False
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(analyze, chunk.text): index for index, chunk in enumerate(chunks)}
+        try:
+            for future in as_completed(futures):
+                verdict = future.result()
+                if isinstance(verdict, str):
+                    verdict = json.loads(verdict)
+                results[futures[future]] = verdict
+                if verdict.get("threat_detected") and normalize_level(verdict.get("threat_level")) == "CRITICAL":
+                    stopped_early = len(results) < len(chunks)
+                    break
+        finally:
+            # Drop chunks that have not started (early exit or an error)
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    if stopped_early:
+        logger.info(f"CRITICAL threat found, stopped after {len(results)} of {len(chunks)} chunks")
+    return [(chunks[index], results[index]) for index in sorted(results)], stopped_early
+
+def reduce_verdicts(chunk_results, total_chunks=None, stopped_early=False):
+    """
+    Reduce step: merge per-chunk verdicts into one
+
+    Args:
+        chunk_results (list): (TextChunk, verdict dict) pairs from analyze_chunks
+        total_chunks (int, optional): Number of chunks the text was split into
+        stopped_early (bool): Whether the map step exited early
+
+    Returns:
+        dict: A verdict in the usual analysis shape plus chunking details
+    """
+    reduced = merge_verdicts([verdict for _, verdict in chunk_results])
+    reduced["chunks_total"] = total_chunks if total_chunks is not None else len(chunk_results)
+    reduced["chunks_analyzed"] = len(chunk_results)
+    reduced["stopped_early"] = stopped_early
+    return reduced
+
+def merge_verdicts(verdicts):
+    """
+    Merge verdicts for parts of one input into a single verdict
+
+    Keeps the highest threat level (and the threat type and confidence of
+    the part that reported it) and merges indicators across parts. Levels
+    and confidences are normalized first, so odd model output ("none",
+    "High", "0.9") does not break the comparison.
+
+    Args:
+        verdicts (list[dict]): Parsed verdicts
+
+    Returns:
+        dict: A verdict in the usual analysis shape
+    """
+    threats = [verdict for verdict in verdicts if verdict.get("threat_detected")]
+    indicators = []
+    for verdict in threats:
+        for indicator in verdict.get("indicators") or []:
+            if indicator not in indicators:
+                indicators.append(indicator)
+
+    if threats:
+        worst = max(threats, key=lambda verdict: (
+            LEVEL_ORDER.index(normalize_level(verdict.get("threat_level"))), verdict_confidence(verdict, 0.0)
+        ))
+        descriptions = []
+        for verdict in threats:
+            if verdict.get("description") and verdict["description"] not in descriptions:
+                descriptions.append(verdict["description"])
+        merged = {
+            "threat_detected": True,
+            "threat_level": normalize_level(worst.get("threat_level")),
+            "confidence_score": verdict_confidence(worst, 0.5),
+            "threat_type": worst.get("threat_type", "unknown"),
+            "description": " ".join(descriptions),
+            "indicators": indicators,
+        }
+    else:
+        merged = {
+            "threat_detected": False,
+            "threat_level": "LOW",
+            "confidence_score": min((verdict_confidence(v, 0.5) for v in verdicts), default=0.5),
+            "threat_type": "none",
+            "description": "No threats detected in any part of the input",
+            "indicators": [],
+        }
+
+    tiers = {verdict.get("analysis_tier") for verdict in verdicts} - {None, ""}
+    if len(tiers) == 1:
+        merged["analysis_tier"] = tiers.pop()
+    return merged
+
+def verdict_confidence(verdict, default):
+    """A verdict's confidence score as a float, or default when missing or not a number"""
+    try:
+        return float(verdict.get("confidence_score", default))
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,178 @@
+import time
+import logging
+import threading
+from collections import deque
+import groq
+from django.conf import settings
+
+logger = logging.getLogger('rt_cta')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Groq while the circuit is open"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Groq circuit is open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    Circuit breaker for Groq calls.
+
+    Tracks the outcome of the last `window` calls. Once at least `min_calls`
+    have been seen and the share of failures (errors or calls slower than
+    `slow_call_seconds`) reaches `failure_rate`, the circuit opens and calls
+    fail fast for `open_seconds`. It then half-opens and lets a limited
+    number of probe calls through: a successful probe closes the circuit, a
+    failed one opens it again.
+
+    The state lives in the process: each worker opens and closes its own
+    circuit from the calls it makes itself.
+    """
+
+    # Errors that indicate Groq itself is unhealthy; client errors and 429s do not count
+    OUTAGE_ERRORS = (groq.APIConnectionError, groq.InternalServerError)
+
+    def __init__(self, failure_rate=None, min_calls=None, window=None, slow_call_seconds=None,
+                 open_seconds=None, half_open_probes=None):
+        self.failure_rate = failure_rate if failure_rate is not None else settings.GROQ_BREAKER_FAILURE_RATE
+        self.min_calls = min_calls if min_calls is not None else settings.GROQ_BREAKER_MIN_CALLS
+        self.slow_call_seconds = slow_call_seconds if slow_call_seconds is not None else settings.GROQ_BREAKER_SLOW_CALL_SECONDS
+        self.open_seconds = open_seconds if open_seconds is not None else settings.GROQ_BREAKER_OPEN_SECONDS
+        self.half_open_probes = half_open_probes if half_open_probes is not None else settings.GROQ_BREAKER_HALF_OPEN_PROBES
+        self._outcomes = deque(maxlen=window if window is not None else settings.GROQ_BREAKER_WINDOW)
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def retry_after(self):
+        """Seconds until the circuit will let a probe through"""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def call(self, fn):
+        """
+        Run fn unless the circuit is open
+
+        Args:
+            fn (callable): Zero-argument function performing the Groq request
+
+        Returns:
+            The result of fn
+
+        Raises:
+            CircuitOpenError: If the circuit is open (or half-open with probes in flight)
+        """
+        probing = self._admit()
+        started = time.monotonic()
+        try:
+            result = fn()
+        except self.OUTAGE_ERRORS:
+            self._record(False, probing)
+            raise
+        except Exception:
+            self._release_probe(probing)
+            raise
+
+        self._record_elapsed(started, probing)
+        return result
+
+    async def acall(self, fn):
+        """
+        Async variant of call
+
+        Args:
+            fn (callable): Zero-argument function returning an awaitable Groq request
+
+        Returns:
+            The awaited result of fn
+        """
+        probing = self._admit()
+        started = time.monotonic()
+        try:
+            result = await fn()
+        except self.OUTAGE_ERRORS:
+            self._record(False, probing)
+            raise
+        except BaseException:
+            # Includes cancellation, which must not leak a probe slot
+            self._release_probe(probing)
+            raise
+
+        self._record_elapsed(started, probing)
+        return result
+
+    def _admit(self):
+        """Raise CircuitOpenError unless a call may go through; return whether it is a probe"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == OPEN:
+                raise CircuitOpenError(self._opened_at + self.open_seconds - time.monotonic())
+            probing = self._state == HALF_OPEN
+            if probing:
+                if self._probes_in_flight >= self.half_open_probes:
+                    raise CircuitOpenError(1.0)
+                self._probes_in_flight += 1
+            return probing
+
+    def _release_probe(self, probing):
+        # Not an outage signal; release the probe slot without judging health
+        if probing:
+            with self._lock:
+                self._probes_in_flight -= 1
+
+    def _record_elapsed(self, started, probing):
+        elapsed = time.monotonic() - started
+        if elapsed > self.slow_call_seconds:
+            logger.warning(f"Slow Groq call ({elapsed:.1f}s) counted as a failure by the circuit breaker")
+        self._record(elapsed <= self.slow_call_seconds, probing)
+
+    def _maybe_half_open(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes_in_flight = 0
+            logger.info("Groq circuit half-open, probing")
+
+    def _record(self, success, probing):
+        with self._lock:
+            if probing:
+                self._probes_in_flight -= 1
+                if success:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                    logger.info("Groq circuit closed")
+                else:
+                    self._open()
+                return
+
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if (self._state == CLOSED and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.failure_rate):
+                self._open()
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        logger.error(f"Groq circuit opened for {self.open_seconds}s")
+
+_circuit_breaker = None
+
+def get_circuit_breaker():
+    """Return the process-wide Groq circuit breaker"""
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        _circuit_breaker = CircuitBreaker()
+    return _circuit_breaker
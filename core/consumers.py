@@ -1,12 +1,144 @@
 import json
+import asyncio
 import logging
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from django.contrib.auth.models import User
+from django.conf import settings
+from .dashboard import dashboard_snapshot, merge_delta
+from .replay import get_replay_buffer
+from .triage import LEVEL_ORDER, get_triage_engine, heuristic_verdict
+from .async_groq_utils import get_async_groq_client
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
 
 logger = logging.getLogger('rt_cta')
 
+GROQ_UNAVAILABLE = (CircuitOpenError,) + CircuitBreaker.OUTAGE_ERRORS
+
+def _severity(level):
+    return LEVEL_ORDER.index(level) if level in LEVEL_ORDER else 0
+
+def threat_group_name(user_id, level):
+    """Group receiving a user's threat notifications of one severity"""
+    return f"user_{user_id}_threats_{level}"
+
+class Subscription:
+    """
+    What one connection asked to hear about
+
+    Threats below min_level are never delivered to the connection (it only
+    joins the groups of the levels it wants); source_types and session_ids,
+    when given, are matched by the consumer before anything is queued.
+    """
+
+    def __init__(self, min_level='LOW', source_types=None, session_ids=None):
+        self.min_level = min_level
+        self.source_types = set(source_types) if source_types else None
+        self.session_ids = set(session_ids) if session_ids else None
+
+    @classmethod
+    def from_message(cls, message):
+        """
+        Build a subscription from a client's subscribe message
+
+        Raises:
+            ValueError: If a filter is malformed
+        """
+        min_level = message.get('min_level') or 'LOW'
+        if min_level not in LEVEL_ORDER:
+            raise ValueError(f"min_level must be one of {', '.join(LEVEL_ORDER)}")
+        source_types = message.get('source_types')
+        if source_types is not None and (
+                not isinstance(source_types, list) or not all(isinstance(value, str) for value in source_types)):
+            raise ValueError("source_types must be a list of strings")
+        session_ids = message.get('session_ids')
+        if session_ids is not None and (
+                not isinstance(session_ids, list)
+                or not all(isinstance(value, int) and not isinstance(value, bool) for value in session_ids)):
+            raise ValueError("session_ids must be a list of integers")
+        return cls(min_level, source_types, session_ids)
+
+    def levels(self):
+        """Threat levels the connection receives"""
+        return LEVEL_ORDER[LEVEL_ORDER.index(self.min_level):]
+
+    def matches(self, data):
+        """Whether a notification passes the filters; fields it does not carry are not filtered on"""
+        if 'level' in data and _severity(data['level']) < _severity(self.min_level):
+            return False
+        if self.source_types is not None and 'source_type' in data and data['source_type'] not in self.source_types:
+            return False
+        if self.session_ids is not None and 'session_id' in data and data['session_id'] not in self.session_ids:
+            return False
+        return True
+
+    def as_dict(self):
+        return {
+            'min_level': self.min_level,
+            'source_types': sorted(self.source_types) if self.source_types is not None else None,
+            'session_ids': sorted(self.session_ids) if self.session_ids is not None else None,
+        }
+
+class NotificationCoalescer:
+    """
+    Threat notifications waiting to be sent on one connection
+
+    Identical alerts (same level, source and description) collapse into one
+    item with a count. At most max_items distinct alerts are kept: past that
+    the lowest severity one (oldest first) is dropped, or the new alert if it
+    is less severe than everything queued, and the drop is counted.
+    """
+
+    def __init__(self, max_items=None):
+        self.max_items = max_items or settings.NOTIFY_QUEUE_MAX
+        self._items = {}
+        self._dropped = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, data):
+        key = (data.get('level'), data.get('source_type'), data.get('description'))
+        item = self._items.get(key)
+        if item is not None:
+            item['count'] += 1
+            item['last_timestamp'] = data.get('timestamp')
+            if 'seq' in data:
+                item['last_seq'] = data['seq']
+            return
+        if len(self._items) >= self.max_items:
+            # min() keeps the first of equals, i.e. the oldest of the least severe
+            victim = min(self._items, key=lambda k: _severity(self._items[k].get('level')))
+            if _severity(data.get('level')) < _severity(self._items[victim].get('level')):
+                victim_level, count = data.get('level'), 1
+            else:
+                evicted = self._items.pop(victim)
+                victim_level, count = evicted.get('level'), evicted['count']
+                self._items[key] = dict(data, count=1)
+            self._dropped[victim_level] = self._dropped.get(victim_level, 0) + count
+            return
+        self._items[key] = dict(data, count=1)
+
+    def take(self):
+        """
+        Everything queued, emptying the queue
+
+        Returns:
+            tuple: (list of items in arrival order, {level: dropped count})
+        """
+        items, dropped = list(self._items.values()), self._dropped
+        self._items, self._dropped = {}, {}
+        return items, dropped
+
 class ThreatNotificationConsumer(AsyncWebsocketConsumer):
+    """
+    The user's live feed: threats, analysis updates and dashboard changes
+
+    A new connection starts with a dashboard_snapshot frame and is then
+    kept current with dashboard_delta frames. A client reconnecting with
+    ?last_seq=N gets no snapshot and sends a resume message instead.
+    """
+
     async def connect(self):
         self.user = self.scope["user"]
         
@@ -17,29 +149,51 @@ class ThreatNotificationConsumer(AsyncWebsocketConsumer):
         
         # Each user gets their own group
         self.group_name = f"user_{self.user.id}_notifications"
+        self.coalescer = NotificationCoalescer()
+        self._flush_task = None
+        self._analyses = set()
+        self.subscription = Subscription()
+        # Pending dashboard change, and the sequence number the last snapshot already covers
+        self._delta = None
+        self._snapshot_seq = None
         
-        # Join the group
+        # Join the group, and the threat groups of every level until the client subscribes
         await self.channel_layer.group_add(
             self.group_name,
             self.channel_name
         )
+        for level in self.subscription.levels():
+            await self.channel_layer.group_add(threat_group_name(self.user.id, level), self.channel_name)
         
         logger.info(f"WebSocket connected for user {self.user.id}")
         await self.accept()
+        if 'last_seq' not in parse_qs(self.scope.get('query_string', b'').decode()):
+            await self.send_snapshot()
 
     async def disconnect(self, close_code):
+        if getattr(self, '_flush_task', None) is not None:
+            self._flush_task.cancel()
+        for task in getattr(self, '_analyses', ()):
+            task.cancel()
         # Leave the group
         if hasattr(self, 'group_name'):
             await self.channel_layer.group_discard(
                 self.group_name,
                 self.channel_name
             )
+            for level in self.subscription.levels():
+                await self.channel_layer.group_discard(threat_group_name(self.user.id, level), self.channel_name)
             logger.info(f"WebSocket disconnected for user {self.user.id}")
 
     async def receive(self, text_data):
         """
         Receive message from WebSocket.
-        Currently only used for ping/pong to keep the connection alive.
+        Used for ping/pong to keep the connection alive, for subscribe
+        messages narrowing what the connection receives, e.g.
+        {"type": "subscribe", "min_level": "HIGH", "source_types": ["visual"], "session_ids": [12]},
+        for resume messages ({"type": "resume", "last_seq": 41}) asking
+        for what was missed while disconnected, and for analyze messages
+        ({"type": "analyze", "text": "...", "request_id": "r1"}).
         """
         text_data_json = json.loads(text_data)
         message_type = text_data_json.get('type', '')
@@ -49,21 +203,208 @@ class ThreatNotificationConsumer(AsyncWebsocketConsumer):
                 'type': 'pong',
                 'timestamp': text_data_json.get('timestamp', '')
             }))
+        elif message_type == 'subscribe':
+            await self.subscribe(text_data_json)
+        elif message_type == 'resume':
+            await self.resume(text_data_json)
+        elif message_type == 'analyze':
+            await self.analyze(text_data_json)
+
+    async def subscribe(self, message):
+        """Replace the connection's filters, moving it between the per-severity threat groups"""
+        try:
+            subscription = Subscription.from_message(message)
+        except ValueError as e:
+            await self.send(text_data=json.dumps({'type': 'error', 'message': str(e)}))
+            return
+        current, wanted = set(self.subscription.levels()), set(subscription.levels())
+        for level in wanted - current:
+            await self.channel_layer.group_add(threat_group_name(self.user.id, level), self.channel_name)
+        for level in current - wanted:
+            await self.channel_layer.group_discard(threat_group_name(self.user.id, level), self.channel_name)
+        self.subscription = subscription
+        logger.debug(f"WebSocket of user {self.user.id} subscribed to {subscription.as_dict()}")
+        await self.send(text_data=json.dumps({'type': 'subscribed', 'data': subscription.as_dict()}))
+
+    async def resume(self, message):
+        """
+        Replay the notifications sent after the client's last_seq that pass its filters
+
+        truncated is set when the buffer no longer holds all of them; a
+        fresh dashboard snapshot follows so the client can start over.
+        """
+        last_seq = message.get('last_seq')
+        if not isinstance(last_seq, int) or isinstance(last_seq, bool) or last_seq < 0:
+            await self.send(text_data=json.dumps({'type': 'error', 'message': "last_seq must be a non-negative integer"}))
+            return
+        events, current, complete = await sync_to_async(get_replay_buffer().since)(self.user.id, last_seq)
+        # A truncated replay would be thrown away by the client, which gets the snapshot instead
+        events = [
+            event for event in events
+            if event['type'] == 'dashboard_delta' or self.subscription.matches(event['data'])
+        ] if complete else []
+        logger.debug(f"Replaying {len(events)} notifications after {last_seq} to user {self.user.id}")
+        await self.send(text_data=json.dumps({
+            'type': 'replay',
+            'data': {'events': events, 'last_seq': current, 'truncated': not complete}
+        }))
+        if not complete:
+            await self.send_snapshot()
+
+    async def send_snapshot(self):
+        """Send the whole dashboard state; deltas it already covers are skipped from then on"""
+        snapshot = await dashboard_snapshot(self.user)
+        self._snapshot_seq = snapshot['seq']
+        self._delta = None
+        await self.send(text_data=json.dumps({'type': 'dashboard_snapshot', 'data': snapshot}))
+
+    async def analyze(self, message):
+        """
+        Analyze a text on the spot with the async Groq client, answering on this connection
+
+        For interactive checks, e.g. of a chat message before it is sent:
+        the verdict comes back as an analysis_result frame carrying the
+        client's request_id, after a partial analysis_update as soon as the
+        threat level has streamed in. Analyses run concurrently, so the
+        connection keeps receiving notifications meanwhile. Nothing is
+        stored; texts to be recorded go through /api/analyze/text/.
+        """
+        text = message.get('text')
+        request_id = message.get('request_id')
+        if not isinstance(text, str) or not text.strip():
+            error = "text must be a non-empty string"
+        elif len(text) > settings.WS_ANALYZE_MAX_CHARS:
+            error = f"text must be at most {settings.WS_ANALYZE_MAX_CHARS} characters"
+        elif len(self._analyses) >= settings.WS_ANALYZE_MAX_IN_FLIGHT:
+            error = f"at most {settings.WS_ANALYZE_MAX_IN_FLIGHT} analyses may run at once"
+        else:
+            task = asyncio.ensure_future(self._analyze(text, request_id))
+            self._analyses.add(task)
+            task.add_done_callback(self._analyses.discard)
+            return
+        await self.send(text_data=json.dumps({'type': 'error', 'message': error, 'request_id': request_id}))
+
+    async def _analyze(self, text, request_id):
+        async def send_partial(fields):
+            await self.send(text_data=json.dumps({'type': 'analysis_update', 'data': {
+                'request_id': request_id,
+                'status': 'partial',
+                'threat_detected': fields.get('threat_detected'),
+                'threat_level': fields.get('threat_level'),
+                'confidence': fields.get('confidence_score'),
+            }}))
+
+        try:
+            engine = get_triage_engine()
+            verdict = (await sync_to_async(engine.classify, thread_sensitive=False)(text)).verdict if engine else None
+            if verdict is None:
+                client = get_async_groq_client()
+                if settings.GROQ_STREAMING_ENABLED:
+                    result = await client.analyze_text_stream(text, on_update=send_partial)
+                else:
+                    result = await client.analyze_text(text)
+                verdict = json.loads(result) if isinstance(result, str) else result
+        except GROQ_UNAVAILABLE:
+            verdict = await sync_to_async(heuristic_verdict, thread_sensitive=False)(text)
+        except Exception as e:
+            logger.error(f"Error in WebSocket analysis for user {self.user.id}: {str(e)}")
+            await self.send(text_data=json.dumps({
+                'type': 'error', 'message': "analysis failed", 'request_id': request_id
+            }))
+            return
+        await self.send(text_data=json.dumps({'type': 'analysis_result', 'data': dict(verdict, request_id=request_id)}))
 
     async def threat_notification(self, event):
         """
         Receive threat notification from group and send to WebSocket.
+
+        Within NOTIFY_COALESCE_MS of each other, notifications are merged
+        into one threat_batch frame instead of a frame each.
         """
-        # Send message to WebSocket
+        await self._queue_threats([event['data']])
+
+    async def threat_batch(self, event):
+        """
+        Receive several threat notifications sent as one group message.
+        """
+        await self._queue_threats(event['data']['items'])
+
+    async def _queue_threats(self, threats):
+        threats = [threat for threat in threats if self.subscription.matches(threat)]
+        if not threats:
+            return
+        if not settings.NOTIFY_COALESCE_MS:
+            for threat in threats:
+                await self.send(text_data=json.dumps({
+                    'type': 'threat_notification',
+                    'data': threat
+                }))
+            return
+        for threat in threats:
+            self.coalescer.add(threat)
+        self._schedule_flush()
+
+    async def dashboard_delta(self, event):
+        """
+        Receive a change to the dashboard's counters, threat list or session status.
+
+        Changes within NOTIFY_COALESCE_MS are merged into one frame.
+        """
+        delta = event['data']
+        if self._snapshot_seq is not None and (delta.get('seq') or 0) <= self._snapshot_seq:
+            # Already counted in the snapshot this connection was sent
+            return
+        if not settings.NOTIFY_COALESCE_MS:
+            await self.send(text_data=json.dumps({'type': 'dashboard_delta', 'data': delta}))
+            return
+        self._delta = merge_delta(self._delta or {}, delta)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush(settings.NOTIFY_COALESCE_MS / 1000))
+
+    async def _flush(self, delay):
+        """Send what accumulated every window until nothing is left; a slow send lets more accumulate"""
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                delta, self._delta = self._delta, None
+                items, dropped = self.coalescer.take()
+                if delta is None and not items and not dropped:
+                    break
+                if delta is not None:
+                    await self.send(text_data=json.dumps({'type': 'dashboard_delta', 'data': delta}))
+                if items or dropped:
+                    await self._send_threats(items, dropped)
+                if self._delta is None and not len(self.coalescer):
+                    break
+        finally:
+            self._flush_task = None
+
+    async def _send_threats(self, items, dropped):
+        if len(items) == 1 and items[0]['count'] == 1 and not dropped:
+            # A lone alert keeps the plain frame older clients understand
+            threat = dict(items[0])
+            del threat['count']
+            await self.send(text_data=json.dumps({'type': 'threat_notification', 'data': threat}))
+            return
         await self.send(text_data=json.dumps({
-            'type': 'threat_notification',
-            'data': event['data']
+            'type': 'threat_batch',
+            'data': {
+                'items': items,
+                'total': sum(item['count'] for item in items),
+                'dropped': dropped,
+                'seq': max(item.get('last_seq', item.get('seq')) or 0 for item in items),
+            }
         }))
 
     async def analysis_update(self, event):
         """
         Receive analysis status update from group and send to WebSocket.
         """
+        if not self.subscription.matches(event['data']):
+            return
         # Send message to WebSocket
         await self.send(text_data=json.dumps({
             'type': 'analysis_update',
@@ -74,19 +415,41 @@ class ThreatNotificationConsumer(AsyncWebsocketConsumer):
     async def notify_user(cls, user_id, notification_type, data):
         """
         Utility method to send a notification to a specific user.
+
+        Threats go to the group of their severity, so they only reach the
+        connections subscribed to that level. Each threat and update is
+        numbered and kept in the replay buffer on the way.
         
         Args:
             user_id (int): The ID of the user to notify
-            notification_type (str): The type of notification (threat_notification or analysis_update)
+            notification_type (str): The type of notification (threat_notification, threat_batch or analysis_update)
             data (dict): The data to send
         """
         from channels.layers import get_channel_layer
         channel_layer = get_channel_layer()
+        replay_buffer = get_replay_buffer()
+
+        if notification_type in ('threat_notification', 'threat_batch'):
+            threats = data['items'] if notification_type == 'threat_batch' else [data]
+            # The replay buffer talks to Redis; keep it off the event loop
+            threats = await sync_to_async(lambda: [
+                replay_buffer.append(user_id, 'threat_notification', threat) for threat in threats
+            ])()
+            by_level = {}
+            for threat in threats:
+                by_level.setdefault(threat.get('level'), []).append(threat)
+            for level, threats in by_level.items():
+                group = threat_group_name(user_id, level if level in LEVEL_ORDER else LEVEL_ORDER[0])
+                if len(threats) == 1:
+                    await channel_layer.group_send(group, {'type': 'threat_notification', 'data': threats[0]})
+                else:
+                    await channel_layer.group_send(group, {'type': 'threat_batch', 'data': {'items': threats}})
+            return
         
         await channel_layer.group_send(
             f"user_{user_id}_notifications",
             {
                 'type': notification_type,
-                'data': data
+                'data': await sync_to_async(replay_buffer.append)(user_id, notification_type, data)
             }
         ) 
\ No newline at end of file
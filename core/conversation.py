@@ -0,0 +1,123 @@
+import json
+import logging
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import AnalysisSession
+from .triage import LEVEL_ORDER, normalize_level
+from .chunking import verdict_confidence
+
+logger = logging.getLogger('rt_cta')
+
+# Longest a single message may be when kept as recent context
+RECENT_MESSAGE_MAX_CHARS = 500
+
+def format_message(message):
+    """A chat message as one prompt line; dict messages become 'sender: text'"""
+    if isinstance(message, dict):
+        sender = message.get('sender') or message.get('author') or 'unknown'
+        return f"{sender}: {message.get('text', '')}"
+    return str(message)
+
+def new_conversation_state():
+    """Conversation state of a session that has not analyzed any message yet"""
+    return {
+        "summary": "",
+        "risk_level": "LOW",
+        "peak_level": "LOW",
+        "confidence_score": 0.0,
+        "threat_type": "none",
+        "indicators": [],
+        "recent": [],
+        "messages_analyzed": 0,
+        "updated_at": None,
+        "version": 0,
+    }
+
+def update_conversation(session, messages, analyze):
+    """
+    Fold new chat messages into a session's rolling conversation state
+
+    Only the stored summary, the running risk and the last few messages go
+    to the LLM along with the new messages, and the summary it returns
+    replaces the stored one. The LLM is called outside any transaction; the
+    session row is only locked to fold the verdict in. If another batch was
+    folded meanwhile (the state's version moved on), the newer summary is
+    kept, these messages are appended to it and the higher of the two risk
+    levels stands, since the other batch's verdict was not seen by this one.
+
+    Args:
+        session (AnalysisSession): The conversation's session; its metadata is refreshed
+        messages (list): New messages, as strings or {"sender", "text"} dicts
+        analyze (callable): Takes (summary, risk_level, recent, new) and returns
+            a verdict with a "summary" field, like GroqClient.analyze_conversation
+
+    Returns:
+        dict: The verdict for the conversation so far, with its running state
+        under "conversation"
+    """
+    lines = [format_message(message) for message in messages]
+    current = AnalysisSession.objects.only('metadata').get(id=session.id)
+    state = dict(new_conversation_state(), **current.metadata.get('conversation', {}))
+    result = analyze(state["summary"], state["risk_level"], state["recent"], lines)
+    verdict = json.loads(result) if isinstance(result, str) else dict(result)
+    summary = verdict.pop("summary", None)
+    if not summary:
+        logger.warning("Conversation analysis returned no summary, appending the new messages instead")
+
+    with transaction.atomic():
+        locked = AnalysisSession.objects.select_for_update().get(id=session.id)
+        latest = dict(new_conversation_state(), **locked.metadata.get('conversation', {}))
+        merge = latest["version"] != state["version"]
+        if merge:
+            # The summary was written against an older one; keep the newer summary
+            logger.info(f"Conversation in session {session.id} changed during analysis, merging")
+            state, summary = latest, None
+        _fold(state, verdict, summary, lines, merge)
+        locked.metadata = dict(locked.metadata, conversation=state)
+        locked.save(update_fields=['metadata', 'updated_at'])
+    session.metadata = locked.metadata
+
+    logger.info(
+        f"Conversation in session {session.id}: {state['messages_analyzed']} messages, "
+        f"risk {state['risk_level']} (peak {state['peak_level']})"
+    )
+    verdict["conversation"] = {
+        "risk_level": state["risk_level"],
+        "peak_level": state["peak_level"],
+        "messages_analyzed": state["messages_analyzed"],
+    }
+    return verdict
+
+def _fold(state, verdict, summary, lines, merge=False):
+    """
+    Update the running state in place with a verdict on the new messages
+
+    Args:
+        merge (bool): The verdict was reached without the latest state, so it
+            may not lower the stored risk level
+    """
+    max_words = settings.CHAT_SUMMARY_MAX_WORDS
+    if not summary:
+        # Keep the new messages in the summary rather than lose them
+        summary = " ".join([state["summary"]] + lines)
+    words = summary.split()
+    # Models overshoot the word limit now and then; bound it so the prompt stays constant-size
+    state["summary"] = " ".join(words[-2 * max_words:])
+
+    level = normalize_level(verdict.get("threat_level")) if verdict.get("threat_detected") else "LOW"
+    stored = normalize_level(state["risk_level"])
+    if not merge or LEVEL_ORDER.index(level) >= LEVEL_ORDER.index(stored):
+        state["risk_level"] = level
+        state["confidence_score"] = verdict_confidence(verdict, 0.0)
+        state["threat_type"] = verdict.get("threat_type", "none")
+    state["peak_level"] = max(normalize_level(state["peak_level"]), level, key=LEVEL_ORDER.index)
+    for indicator in verdict.get("indicators") or []:
+        if indicator not in state["indicators"]:
+            state["indicators"].append(indicator)
+    state["indicators"] = state["indicators"][-settings.CHAT_MAX_INDICATORS:]
+    recent = state["recent"] + [line[:RECENT_MESSAGE_MAX_CHARS] for line in lines]
+    state["recent"] = recent[-settings.CHAT_RECENT_MESSAGES:] if settings.CHAT_RECENT_MESSAGES else []
+    state["messages_analyzed"] += len(lines)
+    state["updated_at"] = timezone.now().isoformat()
+    state["version"] += 1
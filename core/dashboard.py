@@ -0,0 +1,146 @@
+import logging
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Count
+from .models import ThreatDetection, AnalysisSession
+from .replay import get_replay_buffer
+from .triage import LEVEL_ORDER
+
+logger = logging.getLogger('rt_cta')
+
+# Threats listed on the dashboard, newest first
+RECENT_THREATS = 10
+
+# Session types whose latest status the dashboard shows
+SESSION_TYPES = ('visual', 'audio', 'text')
+
+def threat_summary(threat):
+    """A threat as listed on the dashboard"""
+    return {
+        'id': threat.id,
+        'level': threat.threat_level,
+        'description': threat.description,
+        'source_type': threat.source_type,
+        'confidence': threat.confidence_score,
+        'created_at': threat.created_at.isoformat(),
+        'is_false_positive': threat.is_false_positive,
+    }
+
+# Times the dashboard is read again when a change is numbered while reading it
+SNAPSHOT_ATTEMPTS = 3
+
+def _read_dashboard(user):
+    """Read everything the dashboard shows in one transaction"""
+    with transaction.atomic():
+        threats = ThreatDetection.objects.filter(user=user)
+
+        recent = [threat_summary(threat) for threat in threats.order_by('-created_at')[:RECENT_THREATS]]
+
+        threat_counts = dict.fromkeys(LEVEL_ORDER, 0)
+        for row in threats.order_by().values('threat_level').annotate(count=Count('id')):
+            threat_counts[row['threat_level']] = row['count']
+
+        source_counts = dict.fromkeys(SESSION_TYPES, 0)
+        for row in threats.filter(source_type__in=SESSION_TYPES).order_by().values('source_type').annotate(
+                count=Count('id')):
+            source_counts[row['source_type']] = row['count']
+
+        session_status, session_started = {}, {}
+        for session_type in SESSION_TYPES:
+            latest = AnalysisSession.objects.filter(user=user, session_type=session_type).order_by(
+                '-start_time').only('status', 'start_time').first()
+            session_status[session_type] = latest.status if latest else 'inactive'
+            session_started[session_type] = latest.start_time.timestamp() if latest else None
+
+    return {
+        'threats': recent,
+        'threat_counts': threat_counts,
+        'source_counts': source_counts,
+        'session_status': session_status,
+        'session_started': session_started,
+    }
+
+def _snapshot(user):
+    replay = get_replay_buffer()
+    seq = replay.current(user.id)
+    for attempt in range(SNAPSHOT_ATTEMPTS):
+        snapshot = _read_dashboard(user)
+        after = replay.current(user.id)
+        if after == seq:
+            break
+        seq = after
+    else:
+        logger.warning(f"Dashboard of user {user.id} kept changing while it was read; "
+                       f"deltas after {seq} may count some rows twice")
+    snapshot['seq'] = seq
+    return snapshot
+
+async def dashboard_snapshot(user):
+    """
+    Everything the dashboard shows, with the sequence number it is current to
+
+    Deltas are numbered as soon as their transaction commits. The sequence
+    number is read before and after the dashboard queries, which run in one
+    transaction; when a delta was numbered in between, its rows may or may
+    not be counted, so the dashboard is read again. Deltas up to "seq" can
+    then be skipped and later ones applied on top.
+
+    Args:
+        user (User): The dashboard's user
+
+    Returns:
+        dict: {"threats", "threat_counts", "source_counts", "session_status",
+        "session_started", "seq"}
+    """
+    return await sync_to_async(_snapshot)(user)
+
+def threat_delta(threats, removed=False):
+    """
+    The dashboard change for threats being stored (or deleted)
+
+    Returns:
+        dict: Counter increments (decrements when removed) and the threats to
+        add to the list, newest first, or the ids to take off it
+    """
+    sign = -1 if removed else 1
+    delta = {'threat_counts': {}, 'source_counts': {}}
+    for threat in threats:
+        delta['threat_counts'][threat.threat_level] = delta['threat_counts'].get(threat.threat_level, 0) + sign
+        if threat.source_type in SESSION_TYPES:
+            delta['source_counts'][threat.source_type] = delta['source_counts'].get(threat.source_type, 0) + sign
+    if removed:
+        delta['removed_threats'] = [threat.id for threat in threats]
+    else:
+        newest = sorted(threats, key=lambda threat: threat.created_at, reverse=True)[:RECENT_THREATS]
+        delta['recent_threats'] = [threat_summary(threat) for threat in newest]
+    return delta
+
+def merge_delta(delta, other):
+    """
+    Fold a later dashboard delta into an earlier one, in place
+
+    Returns:
+        dict: The merged delta
+    """
+    for counts in ('threat_counts', 'source_counts'):
+        merged = delta.setdefault(counts, {})
+        for key, change in other.get(counts, {}).items():
+            merged[key] = merged.get(key, 0) + change
+    if other.get('recent_threats'):
+        delta['recent_threats'] = (other['recent_threats'] + delta.get('recent_threats', []))[:RECENT_THREATS]
+    if other.get('removed_threats'):
+        removed = set(other['removed_threats'])
+        if 'recent_threats' in delta:
+            delta['recent_threats'] = [threat for threat in delta['recent_threats'] if threat['id'] not in removed]
+        delta['removed_threats'] = delta.get('removed_threats', []) + other['removed_threats']
+    if other.get('session_status'):
+        # Only the latest session of each type is shown, whatever order their updates come in
+        status, started = delta.setdefault('session_status', {}), delta.setdefault('session_started', {})
+        for session_type, session_status in other['session_status'].items():
+            other_started = other.get('session_started', {}).get(session_type) or 0
+            if session_type not in status or other_started >= (started.get(session_type) or 0):
+                status[session_type] = session_status
+                started[session_type] = other_started
+    if other.get('seq') is not None:
+        delta['seq'] = other['seq']
+    return delta
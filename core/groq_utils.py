@@ -1,80 +1,470 @@
-import os
+import json
+import time
+import random
+import hashlib
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import groq
 from django.conf import settings
+from .verdict_cache import VerdictCache, get_verdict_cache
+from .singleflight import get_single_flight
+from .rate_limit import RateLimitScheduler, estimate_tokens, parse_retry_after, get_rate_limit_redis, get_rate_limit_scheduler
+from .circuit_breaker import OPEN, CircuitBreaker, CircuitOpenError, get_circuit_breaker
+from .prompts import get_prompt_format
+from .token_usage import get_token_usage
 
 logger = logging.getLogger('rt_cta')
 
 class GroqClient:
     """Utility class for interacting with Groq's API for AI inference"""
     
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, cache=None, single_flight=None, scheduler=None, base_url=None,
+                 breaker=None, prompt_format=None):
         self.api_key = api_key or settings.GROQ_API_KEY
-        # Initialize with minimal parameters for compatibility
-        self.client = groq.Client(api_key=self.api_key)
+        self.base_url = base_url or settings.GROQ_BASE_URL
+        # Retries are handled by the rate-limit scheduler, not the SDK
+        self.client = groq.Client(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            max_retries=0,
+            timeout=settings.GROQ_TIMEOUT,
+        )
+        self.cache = cache if cache is not None else get_verdict_cache()
+        self.single_flight = single_flight if single_flight is not None else get_single_flight()
+        self.scheduler = scheduler if scheduler is not None else get_rate_limit_scheduler()
+        self.breaker = breaker if breaker is not None else get_circuit_breaker()
+        self.prompt = prompt_format or get_prompt_format()
+        self.usage = get_token_usage()
         logger.info("Initialized Groq client")
+
+    def circuit_retry_after(self):
+        """Seconds until a Groq endpoint may accept calls again (0 if one is available)"""
+        return self.breaker.retry_after()
+
+    def _create_completion(self, consume=None, **kwargs):
+        """
+        Send a chat completion through the rate-limit scheduler and circuit breaker
+
+        Args:
+            consume (callable, optional): Applied to the response inside the
+                breaker, so reading a streamed reply counts as part of the call
+                (and a retry reads it again from the start)
+        """
+        tokens = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens", 0))
+        consume = consume or (lambda response: response)
+        return self.scheduler.call(
+            lambda: self.breaker.call(lambda: consume(self.client.chat.completions.create(**kwargs))),
+            tokens,
+            kwargs["model"],
+        )
+
+    # Requests are built and replies read here for AsyncGroqClient too
+
+    def _cache_key(self, text, model):
+        return VerdictCache.make_key(text, model, self.prompt.version)
+
+    def _text_request(self, text, model, stream=False):
+        """Chat completion arguments for analyzing one text"""
+        request = {
+            "model": model,
+            "messages": self.prompt.text_messages(text),
+            "temperature": 0.1,
+            "max_tokens": self.prompt.text_max_tokens,
+        }
+        if stream:
+            request["stream"] = True
+        return request
+
+    def _batch_request(self, texts, indices, model):
+        """Chat completion arguments for analyzing texts[i] for each i in indices in one packed request"""
+        return {
+            "model": model,
+            "messages": self.prompt.batch_messages(texts, indices),
+            "temperature": 0.1,
+            "max_tokens": self.prompt.batch_max_tokens(len(indices)),
+        }
+
+    def _conversation_request(self, summary, risk_level, recent, new, model):
+        """Chat completion arguments for analyzing new chat messages against the rolling summary"""
+        return {
+            "model": model,
+            "messages": self.prompt.conversation_messages(summary, risk_level, recent, new),
+            "temperature": 0.1,
+            "max_tokens": self.prompt.text_max_tokens + 2 * settings.CHAT_SUMMARY_MAX_WORDS,
+        }
+
+    def _reply(self, kind, request, response, started, content=None):
+        """
+        Record a completed call's token usage and return the reply text
+
+        Args:
+            kind (str): 'text', 'stream', 'batch' or 'conversation'
+            request (dict): The chat completion arguments sent
+            response: The SDK response, or None for streams
+            started (float): time.monotonic() when the call was made
+            content (str, optional): The reply text of a stream
+
+        Returns:
+            str: The reply text
+        """
+        if response is not None:
+            content = response.choices[0].message.content
+        self.usage.record(self.prompt.mode, kind, request["messages"], response, content, time.monotonic() - started)
+        return content
+
+    @staticmethod
+    def _feed_stream(parser, chunk):
+        """Feed one streamed chunk to the parser; return the fields so far, or None if it carried no text"""
+        if not chunk.choices:
+            return None
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            return None
+        return parser.feed(delta)
     
-    def analyze_text(self, text, model="llama3-70b-8192"):
+    def analyze_text(self, text, model=None, modality='text'):
         """
         Analyze text content for potential threats
         
         Args:
             text (str): The text content to analyze
-            model (str): The model to use for analysis
+            model (str, optional): The model to use for analysis. When omitted
+                the small/large cascade is used if enabled, else the large model
+            modality (str): Input modality, used to pick cascade thresholds
             
         Returns:
             dict: Analysis results including threat detection and confidence
         """
+        if model is None:
+            if settings.GROQ_CASCADE_ENABLED:
+                return self._cascade_text_analysis(text, modality)
+            model = settings.GROQ_LARGE_MODEL
+
+        cache_key = self._cache_key(text, model)
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Verdict cache hit for text analysis with model: {model}")
+                return cached
+
+        # Identical analyses already in flight share one upstream call
+        return self.single_flight.do(cache_key, lambda: self._request_text_analysis(text, model, cache_key))
+
+    def _cascade_text_analysis(self, text, modality):
+        """Screen with the small model and escalate to the large model only when needed"""
+        verdict, escalate = self._screen(self.analyze_text(text, model=settings.GROQ_SMALL_MODEL), modality)
+        if not escalate:
+            verdict["analysis_tier"] = "small"
+            return json.dumps(verdict)
+
+        logger.info(f"Escalating {modality} analysis to {settings.GROQ_LARGE_MODEL}")
+        result = self.analyze_text(text, model=settings.GROQ_LARGE_MODEL)
+        return self._with_tier(result, "large")
+
+    @staticmethod
+    def _screen(result, modality):
+        """
+        Decide whether a small-model verdict needs the large model
+
+        Returns:
+            tuple: (parsed verdict or None, whether to escalate)
+        """
+        thresholds = settings.GROQ_CASCADE_THRESHOLDS.get(modality, settings.GROQ_CASCADE_THRESHOLDS['text'])
+        try:
+            verdict = json.loads(result) if isinstance(result, str) else dict(result)
+            confidence = float(verdict.get("confidence_score", 0.0))
+        except (TypeError, ValueError):
+            # An unparseable screening answer is as uncertain as it gets
+            return None, True
+
+        low, high = thresholds['uncertain_band']
+        if low <= confidence <= high:
+            return verdict, True
+        if verdict.get("threat_detected") and verdict.get("threat_level") in thresholds['escalate_levels']:
+            return verdict, True
+        return verdict, False
+
+    @staticmethod
+    def _with_tier(result, tier):
+        """Tag a raw verdict with the cascade tier that decided it"""
+        try:
+            verdict = json.loads(result) if isinstance(result, str) else dict(result)
+        except (TypeError, ValueError):
+            return result
+        verdict["analysis_tier"] = tier
+        return json.dumps(verdict)
+
+    def _request_text_analysis(self, text, model, cache_key):
+        """Call Groq for a single text analysis and cache the verdict"""
         try:
             logger.info(f"Analyzing text with Groq model: {model}")
             
-            prompt = f"""
-            You are a cybersecurity threat detection system. 
-            Analyze the following text for potential security threats such as phishing attempts, 
-            social engineering, malware indications, or suspicious instructions.
-            
-            Text: {text}
-            
-            Provide your analysis in the following JSON format:
-            {{
-                "threat_detected": true/false,
-                "threat_level": "LOW"/"MEDIUM"/"HIGH"/"CRITICAL",
-                "confidence_score": 0.0-1.0,
-                "threat_type": "string",
-                "description": "string",
-                "indicators": ["string", "string"]
-            }}
-            
-            Only provide the JSON output, nothing else.
-            """
-            
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "You are a cybersecurity threat detection AI."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=1000,
-            )
+            request = self._text_request(text, model)
+            started = time.monotonic()
+            response = self._create_completion(**request)
             
             # Extract and parse the JSON response
-            result = response.choices[0].message.content
+            result = self.prompt.parse_text(self._reply('text', request, response, started))
             logger.info(f"Groq text analysis completed successfully")
+            if self.cache is not None:
+                self.cache.set(cache_key, result)
             return result
             
         except Exception as e:
             logger.error(f"Error analyzing text with Groq: {str(e)}")
             raise
-    
-    def analyze_image(self, image_data, prompt, model="llama3-70b-8192"):
+
+    def analyze_text_stream(self, text, model=None, on_update=None, modality='text'):
+        """
+        Analyze text with a streamed completion, surfacing key fields early
+
+        The reply is parsed incrementally; as soon as threat_detected and
+        threat_level have been emitted, on_update is called with them so an
+        alert can go out before the description is finished. Like analyze_text,
+        the small model screens first when no model is given (only escalated
+        texts are streamed), and identical analyses in flight share one call;
+        only the caller that made the call receives early updates.
+
+        Args:
+            text (str): The text content to analyze
+            model (str, optional): The model to use for analysis. When omitted
+                the small/large cascade is used if enabled, else the large model
+            on_update (callable, optional): Called with a dict of the fields
+                extracted so far, once the early fields are known
+            modality (str): Input modality, used to pick cascade thresholds
+
+        Returns:
+            str: The complete JSON analysis, as returned by analyze_text
+        """
+        if model is None:
+            if settings.GROQ_CASCADE_ENABLED:
+                verdict, escalate = self._screen(self.analyze_text(text, model=settings.GROQ_SMALL_MODEL), modality)
+                if not escalate:
+                    verdict["analysis_tier"] = "small"
+                    return json.dumps(verdict)
+                logger.info(f"Escalating streamed {modality} analysis to {settings.GROQ_LARGE_MODEL}")
+                result = self.analyze_text_stream(text, settings.GROQ_LARGE_MODEL, on_update, modality)
+                return self._with_tier(result, "large")
+            model = settings.GROQ_LARGE_MODEL
+
+        cache_key = self._cache_key(text, model)
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Verdict cache hit for streamed text analysis with model: {model}")
+                return cached
+
+        return self.single_flight.do(cache_key, lambda: self._request_text_stream(text, model, cache_key, on_update))
+
+    def _request_text_stream(self, text, model, cache_key, on_update):
+        """Call Groq for a streamed text analysis and cache the verdict"""
+        notified = False
+
+        def consume(stream):
+            nonlocal notified
+            parser = self.prompt.stream_parser()
+            for chunk in stream:
+                fields = self._feed_stream(parser, chunk)
+                if fields is None:
+                    continue
+                if on_update and not notified and parser.early_fields_ready:
+                    notified = True
+                    try:
+                        on_update(fields)
+                    except Exception as e:
+                        logger.error(f"Error in streaming update callback: {str(e)}")
+            return parser
+
+        try:
+            logger.info(f"Streaming text analysis with Groq model: {model}")
+            request = self._text_request(text, model, stream=True)
+            started = time.monotonic()
+            parser = self._create_completion(consume=consume, **request)
+
+            result = self.prompt.parse_text(self._reply('stream', request, None, started, parser.content))
+            logger.info(f"Groq streamed text analysis completed successfully")
+            if self.cache is not None:
+                self.cache.set(cache_key, result)
+            return result
+
+        except Exception as e:
+            logger.error(f"Error streaming text analysis with Groq: {str(e)}")
+            raise
+
+    def analyze_text_batch(self, texts, model=None, modality='text'):
+        """
+        Analyze many short texts (log lines, chat messages) in as few requests as possible
+
+        Inputs are packed into one chat completion per batch with a numbered
+        response schema and the reply is split back into per-item verdicts.
+        Items the model does not answer cleanly fall back to analyze_text.
+
+        Args:
+            texts (list[str]): The text contents to analyze
+            model (str, optional): The model to use for analysis. When omitted
+                the small/large cascade is used if enabled, else the large model
+            modality (str): Input modality, used to pick cascade thresholds
+
+        Returns:
+            list: One analysis result per input, in input order
+        """
+        if model is None:
+            if not settings.GROQ_CASCADE_ENABLED:
+                return self._analyze_text_batch(texts, settings.GROQ_LARGE_MODEL)
+
+            results = []
+            escalated = []
+            for index, result in enumerate(self._analyze_text_batch(texts, settings.GROQ_SMALL_MODEL)):
+                verdict, escalate = self._screen(result, modality)
+                if escalate:
+                    escalated.append(index)
+                    results.append(None)
+                else:
+                    verdict["analysis_tier"] = "small"
+                    results.append(json.dumps(verdict))
+
+            if escalated:
+                logger.info(f"Escalating {len(escalated)} of {len(texts)} batched texts to {settings.GROQ_LARGE_MODEL}")
+                large_results = self._analyze_text_batch([texts[i] for i in escalated], settings.GROQ_LARGE_MODEL)
+                for index, result in zip(escalated, large_results):
+                    results[index] = self._with_tier(result, "large")
+            return results
+
+        return self._analyze_text_batch(texts, model)
+
+    def _analyze_text_batch(self, texts, model):
+        """Batch-analyze texts with a single model"""
+        results = [None] * len(texts)
+        cache_keys = [None] * len(texts)
+        pending = []
+
+        for index, text in enumerate(texts):
+            if self.cache is not None:
+                cache_keys[index] = self._cache_key(text, model)
+                cached = self.cache.get(cache_keys[index])
+                if cached is not None:
+                    results[index] = cached
+                    continue
+            pending.append(index)
+
+        batches = list(self._split_batches(texts, pending))
+        if len(batches) > 1 and settings.GROQ_BATCH_CONCURRENCY > 1:
+            # Hundreds of texts make many packed requests; the scheduler still paces them
+            executor = ThreadPoolExecutor(max_workers=min(settings.GROQ_BATCH_CONCURRENCY, len(batches)))
+            try:
+                futures = [
+                    executor.submit(self._run_text_batch, texts, batch, results, cache_keys, model)
+                    for batch in batches
+                ]
+                for future in futures:
+                    future.result()
+            finally:
+                # Drop batches that have not started if one failed (e.g. the circuit opened)
+                executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            for batch in batches:
+                self._run_text_batch(texts, batch, results, cache_keys, model)
+
+        return results
+
+    @staticmethod
+    def _split_batches(texts, indices):
+        """Group indices into batches bounded by GROQ_BATCH_MAX_ITEMS and GROQ_BATCH_MAX_CHARS"""
+        max_items = settings.GROQ_BATCH_MAX_ITEMS
+        max_chars = settings.GROQ_BATCH_MAX_CHARS
+        batch = []
+        batch_chars = 0
+        for index in indices:
+            size = len(texts[index])
+            if batch and (len(batch) >= max_items or batch_chars + size > max_chars):
+                yield batch
+                batch, batch_chars = [], 0
+            batch.append(index)
+            batch_chars += size
+        if batch:
+            yield batch
+
+    def _run_text_batch(self, texts, indices, results, cache_keys, model):
+        """Send one packed request for the given indices and fill in results"""
+        if len(indices) == 1:
+            index = indices[0]
+            results[index] = self.analyze_text(texts[index], model=model)
+            return
+
+        parsed = {}
+        try:
+            logger.info(f"Analyzing batch of {len(indices)} texts with Groq model: {model}")
+            request = self._batch_request(texts, indices, model)
+            started = time.monotonic()
+            response = self._create_completion(**request)
+            parsed = self.prompt.parse_batch(self._reply('batch', request, response, started), len(indices))
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"Error analyzing text batch with Groq: {str(e)}")
+
+        fallbacks = 0
+        for number, index in enumerate(indices, start=1):
+            verdict = parsed.get(number)
+            if verdict is None:
+                fallbacks += 1
+                results[index] = self.analyze_text(texts[index], model=model)
+                continue
+            self._store_batch_verdict(verdict, index, results, cache_keys)
+        self._log_batch_outcome(fallbacks, len(indices))
+
+    def _store_batch_verdict(self, verdict, index, results, cache_keys):
+        results[index] = json.dumps(verdict)
+        if cache_keys[index] is not None:
+            self.cache.set(cache_keys[index], results[index])
+
+    @staticmethod
+    def _log_batch_outcome(fallbacks, total):
+        if fallbacks:
+            logger.warning(f"Fell back to single analysis for {fallbacks} of {total} batched texts")
+        else:
+            logger.info(f"Groq batch analysis of {total} texts completed successfully")
+
+    def analyze_conversation(self, summary, risk_level, recent, new, model=None):
+        """
+        Analyze new chat messages against the rolling summary of the conversation
+
+        Only the summary, the current risk and a few recent messages are sent
+        along with the new messages, so the cost per message stays constant
+        however long the conversation gets. Replies are not cached since they
+        depend on the conversation state.
+
+        Args:
+            summary (str): Rolling summary of the conversation so far
+            risk_level (str): Current conversation risk level
+            recent (list[str]): Last already-analyzed messages, for context
+            new (list[str]): Messages not analyzed yet
+            model (str, optional): The model to use, defaults to the large model
+
+        Returns:
+            str: The JSON analysis plus an updated "summary" field
+        """
+        model = model or settings.GROQ_LARGE_MODEL
+        try:
+            logger.info(f"Analyzing {len(new)} new chat messages with Groq model: {model}")
+            request = self._conversation_request(summary, risk_level, recent, new, model)
+            started = time.monotonic()
+            response = self._create_completion(**request)
+            return self.prompt.parse_text(self._reply('conversation', request, response, started))
+
+        except Exception as e:
+            logger.error(f"Error analyzing conversation with Groq: {str(e)}")
+            raise
+
+    def analyze_image(self, image_data, prompt, model=None):
         """
         Analyze image content for potential threats
         
         Args:
             image_data (bytes): The image data to analyze
             prompt (str): Additional prompt to guide the analysis
-            model (str): The model to use for analysis
+            model (str, optional): The model to use for analysis
             
         Returns:
             dict: Analysis results including threat detection and confidence
@@ -87,16 +477,214 @@ class GroqClient:
             "message": "Image analysis not implemented yet"
         }
     
-    def analyze_audio(self, audio_text, model="llama3-70b-8192"):
+    def analyze_audio(self, audio_text, model=None):
         """
         Analyze transcribed audio content for potential threats
         
         Args:
             audio_text (str): The transcribed audio content to analyze
-            model (str): The model to use for analysis
+            model (str, optional): The model to use for analysis
             
         Returns:
             dict: Analysis results including threat detection and confidence
         """
         # For now, we'll use text analysis for the transcribed audio
-        return self.analyze_text(audio_text, model=model) 
\ No newline at end of file
+        return self.analyze_text(audio_text, model=model, modality='audio')
+
+class GroqPoolMember:
+    """One API key / endpoint in a GroqClientPool, with its own budget and health"""
+
+    def __init__(self, api_key, base_url=None, weight=1.0, redis_client=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.weight = weight
+        self.client = groq.Client(api_key=api_key, base_url=base_url, max_retries=0, timeout=settings.GROQ_TIMEOUT)
+        # Budgets are namespaced per key/endpoint so workers share them through Redis
+        namespace = hashlib.sha256(f"{api_key}|{base_url}".encode()).hexdigest()[:12]
+        self.scheduler = RateLimitScheduler(redis_client=redis_client, namespace=namespace, max_retries=0)
+        self.breaker = CircuitBreaker()
+        self.name = base_url or f"key ...{api_key[-4:]}"
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.current_weight = 0.0
+
+    @property
+    def healthy(self):
+        return self.breaker.state != OPEN
+
+class GroqClientPool(GroqClient):
+    """
+    GroqClient spread over several API keys and/or base URLs.
+
+    Each request goes to the member picked by the selection strategy
+    ('least_loaded' or 'weighted_round_robin') among those with rate-limit
+    budget left and a closed circuit. Rate limits, outages and open circuits
+    fail over to the next member; when every member is exhausted the pool
+    waits and retries with jittered backoff.
+    """
+
+    STRATEGIES = ('least_loaded', 'weighted_round_robin')
+    # Errors after which the next member is tried
+    FAILOVER_ERRORS = (CircuitOpenError, groq.RateLimitError) + CircuitBreaker.OUTAGE_ERRORS
+
+    def __init__(self, members, strategy=None, cache=None, single_flight=None, prompt_format=None):
+        if not members:
+            raise ValueError("GroqClientPool needs at least one member")
+        strategy = strategy or settings.GROQ_POOL_STRATEGY
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown Groq pool strategy: {strategy}")
+        # The single-endpoint client, scheduler and breaker are the first member's;
+        # requests go through _create_completion, which picks a member for each
+        super().__init__(
+            api_key=members[0].api_key,
+            base_url=members[0].base_url,
+            cache=cache,
+            single_flight=single_flight,
+            scheduler=members[0].scheduler,
+            breaker=members[0].breaker,
+            prompt_format=prompt_format,
+        )
+        self.client = members[0].client
+        self.members = members
+        self.strategy = strategy
+        self._lock = threading.Lock()
+        logger.info(f"Initialized Groq client pool with {len(members)} members ({self.strategy})")
+
+    @classmethod
+    def from_settings(cls):
+        """Build a pool from GROQ_API_KEYS, GROQ_BASE_URLS and GROQ_POOL_WEIGHTS"""
+        keys = settings.GROQ_API_KEYS
+        urls = settings.GROQ_BASE_URLS or [settings.GROQ_BASE_URL]
+        if len(keys) > 1 and len(urls) > 1 and len(keys) != len(urls):
+            raise ValueError("GROQ_API_KEYS and GROQ_BASE_URLS must have the same length when both list several entries")
+        count = max(len(keys), len(urls))
+        keys = keys * count if len(keys) == 1 else keys
+        urls = urls * count if len(urls) == 1 else urls
+        weights = settings.GROQ_POOL_WEIGHTS or [1.0] * count
+        if len(weights) != count:
+            raise ValueError("GROQ_POOL_WEIGHTS must list one weight per pool member")
+
+        redis_client = get_rate_limit_redis()
+        return cls([
+            GroqPoolMember(key, base_url=url, weight=weight, redis_client=redis_client)
+            for key, url, weight in zip(keys, urls, weights)
+        ])
+
+    def circuit_retry_after(self):
+        """Seconds until a Groq endpoint may accept calls again (0 if one is available)"""
+        return min(member.breaker.retry_after() for member in self.members)
+
+    def stats(self):
+        """Per-member load, health and failure counters"""
+        with self._lock:
+            return [{
+                "member": member.name,
+                "weight": member.weight,
+                "state": member.breaker.state,
+                "in_flight": member.in_flight,
+                "requests": member.requests,
+                "failures": member.failures,
+            } for member in self.members]
+
+    def _candidates(self):
+        """Members in the order they should be tried for the next request"""
+        with self._lock:
+            healthy = [m for m in self.members if m.healthy]
+            unhealthy = [m for m in self.members if not m.healthy]
+            if self.strategy == 'least_loaded':
+                healthy.sort(key=lambda m: (m.in_flight / m.weight, m.failures / (m.requests or 1)))
+            elif healthy:
+                # Smooth weighted round-robin picks the first member; the rest follow by weight
+                total = sum(m.weight for m in healthy)
+                for member in healthy:
+                    member.current_weight += member.weight
+                chosen = max(healthy, key=lambda m: m.current_weight)
+                chosen.current_weight -= total
+                healthy.remove(chosen)
+                healthy = [chosen] + sorted(healthy, key=lambda m: -m.weight)
+            return healthy + unhealthy
+
+    def _create_completion(self, consume=None, **kwargs):
+        """Send a chat completion to the best available member, failing over on errors"""
+        tokens = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens", 0))
+        consume = consume or (lambda response: response)
+        model = kwargs["model"]
+        last_error = None
+
+        for attempt in range(settings.GROQ_MAX_RETRIES + 1):
+            waits = []
+            for member in self._candidates():
+                wait = member.scheduler.try_acquire(tokens, model)
+                if wait > 0:
+                    waits.append(wait)
+                    continue
+
+                self._started(member)
+                try:
+                    return member.breaker.call(lambda: consume(member.client.chat.completions.create(**kwargs)))
+                except self.FAILOVER_ERRORS as e:
+                    last_error = e
+                    self._member_failed(member, e, waits)
+                finally:
+                    self._finished(member)
+
+            if attempt == settings.GROQ_MAX_RETRIES:
+                break
+            time.sleep(self._failover_delay(attempt, waits, last_error))
+
+        raise self._exhausted(last_error, waits)
+
+    # Failover policy, shared with AsyncGroqClient
+
+    def _started(self, member):
+        with self._lock:
+            member.in_flight += 1
+            member.requests += 1
+
+    def _finished(self, member):
+        with self._lock:
+            member.in_flight -= 1
+
+    def _member_failed(self, member, error, waits):
+        """Account for a member's failed call; waits gets how long it is unavailable, if known"""
+        if isinstance(error, CircuitOpenError):
+            waits.append(error.retry_after)
+        elif isinstance(error, groq.RateLimitError):
+            delay = parse_retry_after(error) or settings.GROQ_RETRY_BASE_DELAY
+            member.scheduler.block(delay)
+            waits.append(delay)
+        else:
+            with self._lock:
+                member.failures += 1
+        logger.warning(f"Groq pool member {member.name} failed ({type(error).__name__}), failing over")
+
+    def _failover_delay(self, attempt, waits, last_error):
+        """Seconds to wait before trying every member again"""
+        if last_error is None and waits:
+            # Every member is merely out of budget: wait for the earliest one to free up
+            delay = min(waits)
+        else:
+            delay = random.uniform(0, min(settings.GROQ_RETRY_MAX_DELAY, settings.GROQ_RETRY_BASE_DELAY * (2 ** attempt)))
+            if waits:
+                delay = max(delay, min(min(waits), settings.GROQ_RETRY_MAX_DELAY))
+        logger.warning(f"All Groq pool members unavailable, retry {attempt + 1} in {delay:.1f}s")
+        return delay
+
+    @staticmethod
+    def _exhausted(last_error, waits):
+        """The error to raise once every attempt failed"""
+        if last_error is None:
+            last_error = CircuitOpenError(min(waits) if waits else settings.GROQ_RETRY_MAX_DELAY)
+        return last_error
+
+def get_groq_client():
+    """
+    Return the Groq client configured in settings
+
+    A GroqClientPool when several API keys or base URLs are configured,
+    otherwise a plain GroqClient.
+    """
+    if len(settings.GROQ_API_KEYS) > 1 or len(settings.GROQ_BASE_URLS) > 1:
+        return GroqClientPool.from_settings()
+    return GroqClient()
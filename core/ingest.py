@@ -0,0 +1,413 @@
+import io
+import gzip
+import json
+import time
+import queue
+import logging
+import threading
+from collections import namedtuple
+from django.conf import settings
+from .models import AnalysisSession
+from .tasks import process_text_analysis, process_text_analysis_batch
+from .task_owners import get_task_owners
+
+logger = logging.getLogger('rt_cta')
+
+# A flushed group of records sharing a route (source type, session)
+IngestBatch = namedtuple('IngestBatch', ['source_type', 'session_id', 'lines', 'texts'])
+
+# Backpressure levels reported in acknowledgements
+OK, SLOW, STOP = 'ok', 'slow', 'stop'
+
+class UnsupportedEncoding(ValueError):
+    """The body uses a Content-Encoding the ingest endpoint cannot decode"""
+
+def open_body(stream, content_encoding=None):
+    """
+    Wrap a request body in a reader that decompresses it on the fly
+
+    Args:
+        stream: File-like request body
+        content_encoding (str, optional): The Content-Encoding header (gzip or zstd)
+
+    Returns:
+        A file-like object yielding the decoded NDJSON
+    """
+    encoding = (content_encoding or 'identity').strip().lower()
+    if encoding == 'identity':
+        return stream
+    if encoding in ('gzip', 'x-gzip'):
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if encoding == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise UnsupportedEncoding("zstd bodies need the zstandard package installed")
+        # Buffered so records can be read a line at a time
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(stream))
+    raise UnsupportedEncoding(f"Unsupported Content-Encoding: {content_encoding}")
+
+def iter_records(reader, chunk_size=None, max_record_bytes=None):
+    """
+    Parse an NDJSON body incrementally, one line at a time
+
+    A record is a JSON object with the text under "text" (or "message", as
+    most log shippers send it) and optional "source_type" and "session_id",
+    or a bare JSON string. Blank lines are skipped. The body is read a line
+    at a time (at most chunk_size bytes) where the reader allows it, so a
+    record is parsed as soon as its line is complete rather than once a
+    whole chunk has arrived.
+
+    Yields:
+        tuple: (line number, record dict, None), or (line number, None, error)
+        for a line that is not a valid record
+    """
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_BYTES
+    max_record_bytes = max_record_bytes or settings.INGEST_MAX_RECORD_BYTES
+    buffer = b''
+    line_number = 0
+    oversized = False
+    read = getattr(reader, 'readline', reader.read)
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            break
+        *lines, buffer = (buffer + chunk).split(b'\n')
+        for line in lines:
+            line_number += 1
+            if oversized:
+                oversized = False
+                yield line_number, None, f"Record exceeds {max_record_bytes} bytes"
+            elif line.strip():
+                yield (line_number,) + _parse_record(line)
+        if len(buffer) > max_record_bytes:
+            # Drop the rest of an overlong line as it arrives instead of buffering it
+            oversized = True
+            buffer = b''
+    if oversized:
+        yield line_number + 1, None, f"Record exceeds {max_record_bytes} bytes"
+    elif buffer.strip():
+        yield (line_number + 1,) + _parse_record(buffer)
+
+def _parse_record(line):
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        return None, f"Invalid JSON: {str(e)}"
+    if isinstance(record, str):
+        record = {"text": record}
+    if not isinstance(record, dict):
+        return None, "A record must be a JSON object or string"
+    text = record.get("text", record.get("message"))
+    if not isinstance(text, str) or not text.strip():
+        return None, "A record needs a non-empty \"text\" or \"message\" string"
+    return {"text": text, "source_type": record.get("source_type"), "session_id": record.get("session_id")}, None
+
+class MicroBatcher:
+    """
+    Groups records per route and releases them by count, size or age
+
+    Each (source type, session) route has its own buffer, so a batch always
+    goes to one task with one routing decision.
+    """
+
+    def __init__(self, max_records=None, max_bytes=None, max_seconds=None, clock=time.monotonic):
+        self.max_records = max_records or settings.INGEST_BATCH_MAX_RECORDS
+        self.max_bytes = max_bytes or settings.INGEST_BATCH_MAX_BYTES
+        self.max_seconds = max_seconds if max_seconds is not None else settings.INGEST_BATCH_MAX_SECONDS
+        self.clock = clock
+        # route -> [started, size, lines, texts]
+        self._buffers = {}
+
+    def add(self, route, line_number, text):
+        """Buffer a record; returns the batch it completed, if any"""
+        buffer = self._buffers.setdefault(route, [self.clock(), 0, [], []])
+        buffer[1] += len(text)
+        buffer[2].append(line_number)
+        buffer[3].append(text)
+        if len(buffer[3]) >= self.max_records or buffer[1] >= self.max_bytes:
+            return self._release(route)
+        return None
+
+    def next_due(self):
+        """Seconds until the oldest buffered batch is due, or None when nothing is buffered"""
+        if not self._buffers:
+            return None
+        oldest = min(buffer[0] for buffer in self._buffers.values())
+        return max(0.0, oldest + self.max_seconds - self.clock())
+
+    def due(self):
+        """Batches whose first record has waited max_seconds"""
+        now = self.clock()
+        expired = [route for route, buffer in self._buffers.items() if now - buffer[0] >= self.max_seconds]
+        return [self._release(route) for route in expired]
+
+    def drain(self):
+        """Every batch still buffered"""
+        return [self._release(route) for route in list(self._buffers)]
+
+    def _release(self, route):
+        _, _, lines, texts = self._buffers.pop(route)
+        return IngestBatch(route[0], route[1], lines, texts)
+
+class ReadAhead:
+    """
+    Parses a request body on a background thread
+
+    Reading the body blocks until the shipper sends more, so records are
+    handed over through a bounded queue the ingest loop can wait on with a
+    timeout, flushing batches by age in between. Once max_pending records
+    wait unprocessed the thread stops reading, which leaves the rest of the
+    body to the server's flow control.
+    """
+
+    END = object()
+
+    def __init__(self, records, max_pending):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(records,), daemon=True)
+        self._thread.start()
+
+    def _run(self, records):
+        try:
+            for item in records:
+                if not self._put(item):
+                    return
+        except Exception as e:
+            self._put(e)
+            return
+        self._put(self.END)
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def next(self, timeout=None):
+        """
+        The next (line number, record, error), END after the last, or None if timeout seconds passed first
+
+        Raises:
+            Exception: The error that stopped reading the body
+        """
+        try:
+            item = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def close(self):
+        """Stop reading the body"""
+        self._stopped.set()
+
+class QueueMonitor:
+    """
+    Celery queue depth, sampled at most every INGEST_QUEUE_CHECK_SECONDS
+
+    Ingest slows down reading once workers fall INGEST_QUEUE_SLOW_DEPTH
+    messages behind and stops at INGEST_QUEUE_STOP_DEPTH.
+    """
+
+    def __init__(self, slow_depth=None, stop_depth=None, interval=None):
+        self.slow_depth = slow_depth or settings.INGEST_QUEUE_SLOW_DEPTH
+        self.stop_depth = stop_depth or settings.INGEST_QUEUE_STOP_DEPTH
+        self.interval = interval if interval is not None else settings.INGEST_QUEUE_CHECK_SECONDS
+        self._checked_at = None
+        self._depth = None
+
+    def depth(self):
+        """Messages waiting in the default queue, or None if the broker cannot tell"""
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.interval:
+            self._checked_at = now
+            self._depth = queue_depth()
+        return self._depth
+
+    def check(self):
+        """
+        Returns:
+            tuple: (queue depth or None, backpressure level)
+        """
+        depth = self.depth()
+        if depth is None or depth < self.slow_depth:
+            return depth, OK
+        return depth, STOP if depth >= self.stop_depth else SLOW
+
+def queue_depth():
+    """Messages waiting in Celery's default queue, or None if the broker is unreachable"""
+    from rt_cta.celery import app
+    try:
+        with app.connection_for_read() as connection:
+            connection.ensure_connection(max_retries=0)
+            declared = connection.default_channel.queue_declare(queue=app.conf.task_default_queue, passive=True)
+            return declared.message_count
+    except Exception as e:
+        logger.debug(f"Could not read the Celery queue depth: {str(e)}")
+        return None
+
+def dispatch_batch(batch, user_id):
+    """
+    Enqueue the analysis of one batch, routed on its source type
+
+    Log lines are analyzed as one text so template mining and chunking see
+    the whole burst, chat messages fold into their session's conversation,
+    and anything else (emails, ...) goes to the batch task, each text on its own.
+
+    Returns:
+        AsyncResult: The enqueued task
+    """
+    if batch.source_type == 'log':
+        task = process_text_analysis.delay("\n".join(batch.texts), user_id, batch.session_id, source_type='log')
+    elif batch.source_type == 'chat':
+        task = process_text_analysis.delay(batch.texts, user_id, batch.session_id, source_type='chat')
+    else:
+        task = process_text_analysis_batch.delay(batch.texts, user_id, batch.session_id, source_type=batch.source_type)
+    # The acknowledgement's task id can be polled on /api/tasks/status/ by this user only
+    get_task_owners().record([task.id], user_id)
+    return task
+
+class NdjsonIngest:
+    """
+    One streaming ingest request: parse, micro-batch, dispatch, acknowledge
+
+    Iterating yields acknowledgement dicts as the body is consumed: one per
+    dispatched batch (with the backpressure level), one per rejected line
+    and a final status. Batches are flushed by age even while no new line
+    arrives. Once the queue is too deep the body is no longer read; the
+    final status says up to which line records were accepted so the shipper
+    can resend the rest after retry_after seconds.
+
+    This streams only under a WSGI server. Django's ASGI handler (as in
+    rt_cta/asgi.py) receives the whole body before the view runs, so there
+    the upload is not slowed down and acknowledgements only start once it
+    has been sent completely.
+    """
+
+    def __init__(self, user, reader, source_type=None, session_id=None, monitor=None, batcher=None):
+        self.user = user
+        self.reader = reader
+        self.source_type = source_type or 'log'
+        self.session_id = session_id
+        self.monitor = monitor or QueueMonitor()
+        self.batcher = batcher or MicroBatcher()
+        self._sessions = {}
+        self.records = 0
+        self.batches = 0
+        self.rejected = 0
+        self.last_line = 0
+
+    def __iter__(self):
+        records = ReadAhead(iter_records(self.reader), self.batcher.max_records)
+        try:
+            yield from self._acknowledge(records)
+        finally:
+            # Also when the client goes away mid-stream
+            records.close()
+
+    def _acknowledge(self, records):
+        status = 'complete'
+        try:
+            while True:
+                item = records.next(self.batcher.next_due())
+                if item is ReadAhead.END:
+                    break
+                ready = []
+                if item is not None:
+                    line_number, record, error = item
+                    self.last_line = line_number
+                    batch = None
+                    if error is None:
+                        batch, error = self._add(line_number, record)
+                    if error is not None:
+                        self.rejected += 1
+                        yield {"line": line_number, "error": error}
+                    if batch is not None:
+                        ready.append(batch)
+                ready += self.batcher.due()
+                for batch in ready:
+                    ack = self._dispatch(batch)
+                    yield ack
+                    if ack["backpressure"] == SLOW:
+                        # Taking records slower fills the read-ahead queue, and under WSGI
+                        # TCP flow control then pushes back on the shipper
+                        time.sleep(settings.INGEST_SLOWDOWN_SECONDS)
+                if ready and self.monitor.check()[1] == STOP:
+                    status = 'throttled'
+                    break
+        except Exception as e:
+            # Truncated or corrupt (compressed) body: keep what was read up to here
+            logger.error(f"Ingest stream from user {self.user} ended with an error: {str(e)}")
+            status = 'error'
+            yield {"line": self.last_line + 1, "error": f"Could not read the body: {str(e)}"}
+
+        for batch in self.batcher.drain():
+            yield self._dispatch(batch)
+        final = {
+            "status": status,
+            "records": self.records,
+            "batches": self.batches,
+            "rejected": self.rejected,
+            "accepted_through_line": self.last_line,
+        }
+        if status == 'throttled':
+            final["retry_after"] = settings.INGEST_RETRY_AFTER_SECONDS
+        logger.info(
+            f"Ingest from user {self.user}: {self.records} records in {self.batches} batches, "
+            f"{self.rejected} rejected ({status})"
+        )
+        yield final
+
+    def _add(self, line_number, record):
+        """
+        Route a record to its batch buffer
+
+        Returns:
+            tuple: (the batch it completed or None, error message or None)
+        """
+        source_type = record["source_type"] or self.source_type
+        requested = record["session_id"] or self.session_id
+        try:
+            session_id = self._session_for(source_type, requested)
+        except (AnalysisSession.DoesNotExist, TypeError, ValueError):
+            return None, f"Unknown session {requested}"
+        self.records += 1
+        return self.batcher.add((source_type, session_id), line_number, record["text"]), None
+
+    def _session_for(self, source_type, session_id):
+        """The user's session for a record, created once per stream and source type when none is given"""
+        key = session_id or ('new', source_type)
+        if key not in self._sessions:
+            if session_id:
+                self._sessions[key] = AnalysisSession.objects.get(id=int(session_id), user=self.user).id
+            else:
+                self._sessions[key] = AnalysisSession.objects.create(
+                    user=self.user,
+                    session_type='text',
+                    # Conversations stay open for the messages of later streams
+                    status='active' if source_type == 'chat' else 'processing',
+                    metadata={'ingest': {'source_type': source_type}}
+                ).id
+        return self._sessions[key]
+
+    def _dispatch(self, batch):
+        task = dispatch_batch(batch, self.user.id)
+        self.batches += 1
+        depth, level = self.monitor.check()
+        return {
+            "batch": self.batches,
+            "task_id": task.id,
+            "source_type": batch.source_type,
+            "session_id": batch.session_id,
+            "records": len(batch.texts),
+            "first_line": batch.lines[0],
+            "last_line": batch.lines[-1],
+            "queue_depth": depth,
+            "backpressure": level,
+        }
@@ -0,0 +1,308 @@
+import re
+import json
+import logging
+import threading
+from itertools import count
+from collections import OrderedDict
+from django.conf import settings
+
+logger = logging.getLogger('rt_cta')
+
+WILDCARD = '<*>'
+
+# Variable parts masked inside each token before matching, most specific first
+MASKS = [
+    (re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.IGNORECASE), '<UUID>'),
+    (re.compile(r'\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?'), '<IP>'),
+    (re.compile(r'0x[0-9a-f]+|\b[0-9a-f]{12,}\b', re.IGNORECASE), '<HEX>'),
+    (re.compile(r'\d+'), '<NUM>'),
+]
+
+# Indicator-shaped values (URLs, IPv4 addresses, MD5/SHA-1/SHA-256 hashes). A template's
+# verdict is only reused for lines whose indicators were part of an earlier prompt for it
+IOC_PATTERN = re.compile(
+    r'[a-z][a-z0-9+.-]*://[^\s"\'<>]+'
+    r'|\b\d{1,3}(?:\.\d{1,3}){3}\b'
+    r'|\b(?:[0-9a-f]{64}|[0-9a-f]{40}|[0-9a-f]{32})\b',
+    re.IGNORECASE
+)
+
+# Indicators listed in one template prompt, and remembered per template
+PROMPT_IOCS = 20
+MAX_VETTED_IOCS = 1000
+
+def mask_token(token):
+    """Replace IPs, UUIDs, hex ids and numbers inside a token with placeholders"""
+    for pattern, placeholder in MASKS:
+        token = pattern.sub(placeholder, token)
+    return token
+
+class LogCluster:
+    """A log template: constant tokens with <*> where lines differ"""
+
+    def __init__(self, cluster_id, tokens, leaf):
+        self.id = cluster_id
+        self.tokens = tokens
+        self.leaf = leaf
+        self.size = 0
+        self.verdict = None
+        self.vetted_iocs = set()
+
+    @property
+    def template(self):
+        return ' '.join(self.tokens)
+
+class TemplateGroup:
+    """The lines of one text that share a template"""
+
+    def __init__(self, cluster, seen_before):
+        self.cluster = cluster
+        self.seen_before = seen_before
+        self.spans = []
+        self.params = []
+        self.iocs = []
+
+    @property
+    def needs_llm(self):
+        """New or rare templates, templates without a verdict yet and lines with unseen indicators go to the LLM"""
+        if self.cluster.verdict is None or self.seen_before < settings.LOG_TEMPLATE_RARE_COUNT:
+            return True
+        return not self.cluster.vetted_iocs.issuperset(self.iocs)
+
+    def record_verdict(self, verdict):
+        """Remember the LLM verdict for this group's template and the indicators it covered"""
+        previous = self.cluster.verdict
+        vetted = set(self.iocs[:PROMPT_IOCS])
+        # Indicators cleared before stay cleared only if that verdict was benign too
+        if previous is not None and not previous.get("threat_detected") and not verdict.get("threat_detected"):
+            vetted |= self.cluster.vetted_iocs
+        self.cluster.verdict = verdict
+        self.cluster.vetted_iocs = vetted if len(vetted) <= MAX_VETTED_IOCS else set(self.iocs[:PROMPT_IOCS])
+
+    def prompt_text(self, text):
+        """Compact description of the group to analyze instead of every line"""
+        start, end = self.spans[0]
+        lines = [
+            f"Log template (seen {self.cluster.size} times, {len(self.spans)} in this input): {self.cluster.template}",
+            f"Example: {text[start:end].strip()}",
+        ]
+        samples = [' '.join(params) for params in self.params if params]
+        if samples:
+            lines.append(f"Sample parameters: {' | '.join(samples)}")
+        if self.iocs:
+            lines.append(f"Indicators: {' '.join(self.iocs[:PROMPT_IOCS])}")
+        return '\n'.join(lines)
+
+class TemplateDigest:
+    """A text reduced to its log templates"""
+
+    def __init__(self, text, groups, line_count):
+        self.text = text
+        self.groups = groups
+        self.line_count = line_count
+
+    @property
+    def pending(self):
+        return [group for group in self.groups if group.needs_llm]
+
+    @property
+    def is_repetitive(self):
+        """Whether lines share templates enough for template-level analysis to pay off"""
+        return len(self.groups) <= self.line_count * settings.LOG_TEMPLATE_MAX_RATIO
+
+    def metadata(self, max_templates=20):
+        """Cheap template statistics for TextSource.metadata"""
+        top = sorted(self.groups, key=lambda group: len(group.spans), reverse=True)[:max_templates]
+        return {
+            "lines": self.line_count,
+            "templates": len(self.groups),
+            "new_templates": sum(1 for group in self.groups if group.seen_before == 0),
+            "sent_to_llm": len(self.pending),
+            "template_counts": [
+                {"template": group.cluster.template, "count": len(group.spans), "total": group.cluster.size}
+                for group in top
+            ],
+        }
+
+class LogTemplateMiner:
+    """
+    Streaming log template miner using Drain's fixed-depth parse tree.
+
+    Lines are tokenized, variable-looking parts masked, and routed by token
+    count and their first tokens to a leaf holding candidate templates. A
+    line joins the most similar template above the similarity threshold
+    (differing positions become <*>) or starts a new one. Templates remember
+    the last verdict they got, so frequent templates need not be re-analyzed.
+    The number of templates is bounded; the least recently seen are evicted.
+    """
+
+    def __init__(self, depth=None, similarity=None, max_children=None, max_clusters=None):
+        self.depth = max(3, depth if depth is not None else settings.LOG_TEMPLATE_DEPTH)
+        self.similarity = similarity if similarity is not None else settings.LOG_TEMPLATE_SIMILARITY
+        self.max_children = max_children if max_children is not None else settings.LOG_TEMPLATE_MAX_CHILDREN
+        self.max_clusters = max_clusters if max_clusters is not None else settings.LOG_TEMPLATE_MAX_CLUSTERS
+        self._root = {}
+        self._clusters = OrderedDict()
+        self._ids = count(1)
+        self._lock = threading.Lock()
+
+    def digest(self, text):
+        """
+        Mine every line of a text and group the lines by template
+
+        Args:
+            text (str): Log text, one record per line
+
+        Returns:
+            TemplateDigest: Template groups in order of first appearance
+        """
+        groups = OrderedDict()
+        line_count = 0
+        position = 0
+        with self._lock:
+            for line in text.splitlines(keepends=True):
+                start, position = position, position + len(line)
+                tokens = line.split()
+                if not tokens:
+                    continue
+                line_count += 1
+                cluster = self._add(tokens)
+                group = groups.get(cluster.id)
+                if group is None:
+                    group = groups[cluster.id] = TemplateGroup(cluster, cluster.size - 1)
+                group.spans.append((start, position))
+                for ioc in IOC_PATTERN.findall(line):
+                    if ioc not in group.iocs:
+                        group.iocs.append(ioc)
+                if len(group.params) < settings.LOG_TEMPLATE_PARAM_SAMPLES:
+                    group.params.append(tokens)
+
+        # Parameters are the tokens in variable positions of the final templates
+        for group in groups.values():
+            template = group.cluster.tokens
+            group.params = [
+                [token for token, constant in zip(tokens, template) if constant != token]
+                for tokens in group.params
+            ]
+        return TemplateDigest(text, list(groups.values()), line_count)
+
+    def stats(self):
+        with self._lock:
+            return {"templates": len(self._clusters), "lines": sum(c.size for c in self._clusters.values())}
+
+    def _add(self, tokens):
+        masked = [mask_token(token) for token in tokens]
+        leaf = self._leaf(masked)
+        cluster = self._match(leaf, masked)
+        if cluster is None:
+            cluster = LogCluster(next(self._ids), masked, leaf)
+            leaf.append(cluster)
+            self._clusters[cluster.id] = cluster
+            if len(self._clusters) > self.max_clusters:
+                _, evicted = self._clusters.popitem(last=False)
+                evicted.leaf.remove(evicted)
+        else:
+            cluster.tokens = [
+                constant if constant == token else WILDCARD
+                for constant, token in zip(cluster.tokens, masked)
+            ]
+            self._clusters.move_to_end(cluster.id)
+        cluster.size += 1
+        return cluster
+
+    def _leaf(self, tokens):
+        """
+        Walk (and grow) the parse tree: token count, then depth-2 routing tokens
+
+        Routing uses the first tokens without variable parts, so shared
+        timestamp/host/pid prefixes do not send every line down one branch.
+        """
+        node = self._root.setdefault(len(tokens), {})
+        routing = [token for token in tokens if '<' not in token][:self.depth - 2]
+        routing += [WILDCARD] * (self.depth - 2 - len(routing))
+        for token in routing:
+            if token not in node:
+                if len(node) >= self.max_children:
+                    token = WILDCARD
+                node = node.setdefault(token, {})
+            else:
+                node = node[token]
+        return node.setdefault(None, [])
+
+    def _match(self, leaf, tokens):
+        best, best_score = None, (-1.0, -1)
+        for cluster in leaf:
+            same = sum(1 for constant, token in zip(cluster.tokens, tokens) if constant == token)
+            wildcards = cluster.tokens.count(WILDCARD)
+            # Wildcards never equal a token, so only constant positions count; ties prefer more general templates
+            score = (same / len(tokens), wildcards)
+            if score > best_score:
+                best, best_score = cluster, score
+        if best is not None and best_score[0] >= self.similarity:
+            return best
+        return None
+
+def analyze_digests(digests, analyze_batch):
+    """
+    Analyze the new or rare templates of several digests in one batch
+
+    Templates seen often enough reuse their last verdict instead.
+
+    Args:
+        digests (list[TemplateDigest]): Mined texts
+        analyze_batch (callable): Takes a list of texts and returns one verdict per text
+
+    Returns:
+        list: For each digest, a list of (TemplateGroup, verdict dict) pairs
+    """
+    pending = [(digest, group) for digest in digests for group in digest.pending]
+    verdicts = {}
+    if pending:
+        logger.info(f"Sending {len(pending)} new or rare log templates to the LLM")
+        results = analyze_batch([group.prompt_text(digest.text) for digest, group in pending])
+        for (_, group), result in zip(pending, results):
+            verdict = json.loads(result) if isinstance(result, str) else result
+            group.record_verdict(verdict)
+            verdicts[id(group)] = verdict
+
+    analyzed = []
+    for digest in digests:
+        pairs = []
+        for group in digest.groups:
+            verdict = verdicts.get(id(group))
+            if verdict is None:
+                verdict = dict(group.cluster.verdict, analysis_tier="template")
+            pairs.append((group, verdict))
+        analyzed.append(pairs)
+    return analyzed
+
+def mine_repetitive(miner, text):
+    """
+    Digest a text for template-level analysis if it is a repetitive log
+
+    Args:
+        miner (LogTemplateMiner): The template miner, or None when mining is disabled
+        text (str): The text to analyze
+
+    Returns:
+        TemplateDigest: The digest, or None for short texts and prose (emails,
+        chat transcripts), which are analyzed as a whole
+    """
+    if miner is None or len(text.splitlines()) < settings.LOG_TEMPLATE_MIN_LINES:
+        return None
+    # Dry run on a scratch miner first, so prose leaves no templates behind in the shared one
+    scratch = LogTemplateMiner(miner.depth, miner.similarity, miner.max_children, miner.max_clusters)
+    if not scratch.digest(text).is_repetitive:
+        return None
+    return miner.digest(text)
+
+_miner = None
+
+def get_log_template_miner():
+    """Return the process-wide log template miner, or None when template mining is disabled"""
+    global _miner
+    if not settings.LOG_TEMPLATES_ENABLED:
+        return None
+    if _miner is None:
+        _miner = LogTemplateMiner()
+    return _miner
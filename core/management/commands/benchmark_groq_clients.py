@@ -0,0 +1,118 @@
+import time
+import uuid
+import asyncio
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from core.groq_utils import GroqClient
+from core.async_groq_utils import AsyncGroqClient, close_async_http_client
+from core.rate_limit import RateLimitScheduler
+from core.circuit_breaker import CircuitBreaker
+from core.management.commands.fake_groq_server import FakeGroqServer
+
+# The benchmark measures client overhead, not Groq quotas
+UNLIMITED = {'default': {'rpm': 10 ** 9, 'tpm': 10 ** 12}}
+
+class Command(BaseCommand):
+    help = 'Compare throughput, latency and sockets used by the sync and async Groq clients against a local stub'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300, help='Analyses to run per client')
+        parser.add_argument('--concurrency', type=int, default=100, help='Concurrent analyses (threads for sync, tasks for async)')
+        parser.add_argument('--latency', type=float, default=0.05, help='Simulated latency of the built-in stub in seconds')
+        parser.add_argument('--base-url', help='Use an already running stub (e.g. fake_groq_server) instead of the built-in one')
+        parser.add_argument('--model', default='llama3-70b-8192', help='Model name sent to the stub')
+
+    def handle(self, *args, **options):
+        server = None
+        base_url = options['base_url']
+        if not base_url:
+            server = FakeGroqServer(('127.0.0.1', 0), rpm_limit=0, latency=options['latency'],
+                                    stream_delay=0.0, fail_rate=0.0, verbose=False)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+        self.stdout.write(self.style.WARNING(
+            f"Benchmarking {options['requests']} analyses at concurrency {options['concurrency']} against {base_url}"
+        ))
+        try:
+            rows = [
+                self._measure('sync', server, lambda: self._run_sync(base_url, options)),
+                self._measure('async', server, lambda: asyncio.run(self._run_async(base_url, options))),
+            ]
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        self.stdout.write(
+            f"\n{'client':<8}{'seconds':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+            f"{'cpu ms/req':>12}{'sockets':>10}"
+        )
+        for row in rows:
+            self.stdout.write(
+                f"{row['client']:<8}{row['seconds']:>10.2f}{row['throughput']:>10.1f}"
+                f"{row['p50']:>10.1f}{row['p95']:>10.1f}{row['p99']:>10.1f}{row['cpu']:>12.2f}{row['sockets']:>10}"
+            )
+
+    def _measure(self, name, server, run):
+        connections_before = server.connections_opened if server else 0
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        latencies = run()
+        elapsed = time.perf_counter() - started
+        # Includes the built-in stub's threads when it runs in this process
+        cpu = time.process_time() - cpu_started
+        quantiles = statistics.quantiles(latencies, n=100)
+        return {
+            'client': name,
+            'seconds': elapsed,
+            'throughput': len(latencies) / elapsed,
+            'p50': quantiles[49] * 1000,
+            'p95': quantiles[94] * 1000,
+            'p99': quantiles[98] * 1000,
+            'cpu': cpu / len(latencies) * 1000,
+            'sockets': server.connections_opened - connections_before if server else 'n/a',
+        }
+
+    @staticmethod
+    def _texts(count):
+        # Unique texts so neither the verdict cache nor single-flight short-circuits requests
+        run = uuid.uuid4().hex
+        return [f'benchmark {run} message {i}' for i in range(count)]
+
+    @staticmethod
+    def _client(base_url):
+        return GroqClient(
+            api_key='benchmark',
+            base_url=base_url,
+            scheduler=RateLimitScheduler(limits=UNLIMITED, max_retries=0),
+            breaker=CircuitBreaker(),
+        )
+
+    def _run_sync(self, base_url, options):
+        client = self._client(base_url)
+
+        def timed(text):
+            started = time.perf_counter()
+            client.analyze_text(text, model=options['model'])
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            return list(executor.map(timed, self._texts(options['requests'])))
+
+    async def _run_async(self, base_url, options):
+        client = AsyncGroqClient(self._client(base_url))
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def timed(text):
+            async with semaphore:
+                started = time.perf_counter()
+                await client.analyze_text(text, model=options['model'])
+                return time.perf_counter() - started
+
+        try:
+            return await asyncio.gather(*(timed(text) for text in self._texts(options['requests'])))
+        finally:
+            await close_async_http_client()
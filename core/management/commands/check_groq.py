@@ -2,7 +2,7 @@ import os
 import json
 from django.core.management.base import BaseCommand
 from django.conf import settings
-from core.groq_utils import GroqClient
+from core.groq_utils import get_groq_client
 
 class Command(BaseCommand):
     help = 'Check Groq API threat detection for text, image, and audio inputs'
@@ -30,9 +30,8 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
-        api_key = settings.GROQ_API_KEY
-        if not api_key:
-            self.stderr.write(self.style.ERROR('GROQ_API_KEY not set in environment variables'))
+        if not any(settings.GROQ_API_KEYS):
+            self.stderr.write(self.style.ERROR('GROQ_API_KEY (or GROQ_API_KEYS) not set in environment variables'))
             return
 
         model = options['model']
@@ -43,7 +42,7 @@ class Command(BaseCommand):
         self.stdout.write(self.style.WARNING(f'Testing Groq threat detection with model: {model}'))
         
         try:
-            client = GroqClient(api_key=api_key)
+            client = get_groq_client()
             
             # Test text analysis
             self.stdout.write(self.style.WARNING('\n1. Testing text threat detection:'))
@@ -0,0 +1,260 @@
+import re
+import json
+import time
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+
+BENIGN_VERDICT = {
+    "threat_detected": False,
+    "threat_level": "LOW",
+    "confidence_score": 0.95,
+    "threat_type": "none",
+    "description": "No threats detected (fake Groq endpoint)",
+    "indicators": []
+}
+
+THREAT_VERDICT = {
+    "threat_detected": True,
+    "threat_level": "HIGH",
+    "confidence_score": 0.9,
+    "threat_type": "phishing",
+    "description": "Suspicious content detected (fake Groq endpoint)",
+    "indicators": ["fake-indicator"]
+}
+
+CRITICAL_VERDICT = {
+    "threat_detected": True,
+    "threat_level": "CRITICAL",
+    "confidence_score": 0.97,
+    "threat_type": "ransomware",
+    "description": "Ransomware activity detected (fake Groq endpoint)",
+    "indicators": ["fake-ransomware-indicator"]
+}
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible chat completions endpoint with Groq-style 429s"""
+
+    server_version = "FakeGroq/1.0"
+    # HTTP/1.1 so clients can reuse keep-alive connections
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; avoid Nagle/delayed-ACK stalls on reused connections
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.count_connection()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_POST(self):
+        if not self.path.endswith('/chat/completions'):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+
+        retry_after = self.server.take_slot()
+        if retry_after is not None:
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "tokens"}},
+                            headers={'retry-after': f'{retry_after:.2f}'})
+            return
+
+        if self.server.fail_rate and self.server.next_random() < self.server.fail_rate:
+            self._send_json(503, {"error": {"message": "Service unavailable"}})
+            return
+
+        time.sleep(self.server.latency)
+        content = self._verdict_content(payload.get('messages', []))
+        self.server.count_request()
+
+        if payload.get('stream'):
+            self._send_stream(payload.get('model', ''), content)
+        else:
+            self._send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get('model', ''),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop"
+                }],
+                "usage": self._usage(payload.get('messages', []), content)
+            })
+
+    @staticmethod
+    def _usage(messages, content):
+        # Same ~4 characters per token approximation the client uses
+        prompt_tokens = sum(len(message.get('content') or '') for message in messages) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def _verdict_content(self, messages):
+        prompt = messages[-1].get('content', '') if messages else ''
+        # The compact prompt describes its short-key schema in the system message
+        compact = len(messages) > 1 and '"t":' in (messages[0].get('content') or '')
+        conversation = re.search(r'^\s*New(?: messages)?:\s*\n(.*?)(?:\n\s*Assess the conversation|\Z)',
+                                 prompt, re.MULTILINE | re.DOTALL)
+        if conversation:
+            return self._conversation_content(prompt, conversation.group(1), compact)
+        numbered = re.findall(r'^\s*\[(\d+)\]\s*(.*)$', prompt, re.MULTILINE)
+        if numbered:
+            if compact:
+                return json.dumps([dict(self._compact(self._verdict_for(text)), n=int(number)) for number, text in numbered],
+                                  separators=(',', ':'))
+            return json.dumps([dict(self._verdict_for(text), id=int(number)) for number, text in numbered])
+        if compact:
+            return json.dumps(self._compact(self._verdict_for(prompt)), separators=(',', ':'))
+        analyzed = re.search(r'^\s*Text:\s*(.*?)\n\s*Provide your analysis', prompt, re.MULTILINE | re.DOTALL)
+        return json.dumps(self._verdict_for(analyzed.group(1) if analyzed else prompt))
+
+    def _conversation_content(self, prompt, new, compact):
+        # The summary carries earlier messages, so a threat seen once keeps the conversation flagged
+        previous = re.search(r'^\s*(?:Summary|Conversation summary so far):\s*(.*)$', prompt, re.MULTILINE)
+        previous = previous.group(1) if previous and not previous.group(1).startswith('(') else ''
+        lines = [line.strip() for line in new.splitlines() if line.strip()]
+        summary = ' '.join(f"{previous} {' / '.join(lines)}".split()[-80:])
+        verdict = self._verdict_for(f"{previous}\n{new}")
+        if compact:
+            return json.dumps(dict(self._compact(verdict), s=summary), separators=(',', ':'))
+        return json.dumps(dict(verdict, summary=summary))
+
+    @staticmethod
+    def _compact(verdict):
+        return {
+            "t": int(verdict["threat_detected"]),
+            "l": verdict["threat_level"][0],
+            "c": verdict["confidence_score"],
+            "y": verdict["threat_type"],
+            "d": verdict["description"],
+            "i": verdict["indicators"],
+        }
+
+    @staticmethod
+    def _verdict_for(text):
+        lowered = text.lower()
+        if 'ransomware' in lowered:
+            return CRITICAL_VERDICT
+        if any(word in lowered for word in ('phish', 'password', 'malware', 'http://')):
+            return THREAT_VERDICT
+        return BENIGN_VERDICT
+
+    def _send_json(self, status_code, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, model, content):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        # The event stream has no length, so its end is marked by closing the connection
+        self.send_header('Connection', 'close')
+        self.close_connection = True
+        self.end_headers()
+        for start in range(0, len(content), 16):
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": content[start:start + 16]}, "finish_reason": None}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(self.server.stream_delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+class FakeGroqServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for bursts of concurrent connects from benchmark clients
+    request_queue_size = 256
+
+    def __init__(self, address, rpm_limit, latency, stream_delay, fail_rate, verbose):
+        super().__init__(address, FakeGroqHandler)
+        self.rpm_limit = rpm_limit
+        self.latency = latency
+        self.stream_delay = stream_delay
+        self.fail_rate = fail_rate
+        self.verbose = verbose
+        self.requests_served = 0
+        self.connections_opened = 0
+        self._window = deque()
+        self._lock = threading.Lock()
+        self._seed = 12345
+
+    def take_slot(self):
+        """Return None if the request is within the limit, else the seconds to retry after"""
+        if not self.rpm_limit:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            while self._window and self._window[0] <= now - 60:
+                self._window.popleft()
+            if len(self._window) >= self.rpm_limit:
+                return self._window[0] + 60 - now
+            self._window.append(now)
+            return None
+
+    def count_request(self):
+        with self._lock:
+            self.requests_served += 1
+
+    def count_connection(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    def next_random(self):
+        # Deterministic so test runs are reproducible
+        with self._lock:
+            self._seed = (self._seed * 1103515245 + 12345) % (2 ** 31)
+            return self._seed / (2 ** 31)
+
+class Command(BaseCommand):
+    help = 'Run a local fake Groq chat completions endpoint for testing rate limiting and failover'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Interface to bind')
+        parser.add_argument('--port', type=int, default=8099, help='Port to listen on')
+        parser.add_argument('--rpm-limit', type=int, default=0,
+                            help='Requests per minute before answering 429 with retry-after (0 = unlimited)')
+        parser.add_argument('--latency', type=float, default=0.1, help='Simulated latency per request in seconds')
+        parser.add_argument('--stream-delay', type=float, default=0.01, help='Delay between streamed chunks in seconds')
+        parser.add_argument('--fail-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+        parser.add_argument('--verbose', action='store_true', help='Log every request')
+
+    def handle(self, *args, **options):
+        server = FakeGroqServer(
+            (options['host'], options['port']),
+            rpm_limit=options['rpm_limit'],
+            latency=options['latency'],
+            stream_delay=options['stream_delay'],
+            fail_rate=options['fail_rate'],
+            verbose=options['verbose'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Fake Groq endpoint listening on http://{options['host']}:{options['port']}\n"
+            f"Set GROQ_BASE_URL=http://{options['host']}:{options['port']} to use it"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING(
+                f'\nStopped after serving {server.requests_served} requests '
+                f'over {server.connections_opened} connections'
+            ))
+        finally:
+            server.server_close()
@@ -0,0 +1,91 @@
+import json
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.groq_utils import GroqClient
+from core.prompts import PROMPT_FORMATS
+from core.token_usage import get_token_usage
+from core.verdict_cache import VerdictCache
+
+# Representative inputs: a phishing email, chat, and noisy terminal/log output
+SAMPLE_TEXTS = [
+    "Dear customer,\n\nYour account has been    suspended due to unusual activity.\n"
+    "Please verify your password within 24 hours at http://secure-login.example.net/verify\n\n"
+    "Thank you,\nThe Security Team",
+    "hey, are we still on for lunch tomorrow? the usual place at noon works for me",
+    "Can you send me the admin credentials for the VPN? I'm the new IT contractor and my manager said it's fine",
+    "\x1b[32m[INFO]\x1b[0m  worker-1   heartbeat ok\n" * 12
+    + "\x1b[31m[WARN]\x1b[0m  sshd   Failed password for root from 203.0.113.7 port 52211\n" * 8
+    + "\x1b[32m[INFO]\x1b[0m  worker-1   heartbeat ok\n" * 5,
+    "Invoice attached. Enable macros to view the document content. Payment is overdue.",
+]
+
+class Command(BaseCommand):
+    help = 'Show Groq token and latency usage per prompt mode, or compare the modes on sample inputs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compare', action='store_true',
+                            help='Analyze sample texts with every prompt mode and report the reduction')
+        parser.add_argument('--rounds', type=int, default=1, help='Times to analyze each sample per mode')
+        parser.add_argument('--model', default=None, help='Model to use for --compare (defaults to GROQ_LARGE_MODEL)')
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after displaying them')
+
+    def handle(self, *args, **options):
+        usage = get_token_usage()
+        if options['compare']:
+            self._compare(options)
+            return
+
+        stats = usage.stats()
+        if 'shared' not in stats:
+            self.stdout.write(self.style.WARNING(
+                'No Redis tier configured; counters only cover this process. '
+                'Set GROQ_USAGE_REDIS_URL to aggregate across workers.'
+            ))
+        self.stdout.write(json.dumps(stats, indent=2))
+        self._report(stats.get('shared') or stats['process'])
+
+        if options['reset']:
+            usage.reset()
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
+
+    def _compare(self, options):
+        model = options['model'] or settings.GROQ_LARGE_MODEL
+        usage = get_token_usage()
+        usage.reset()
+        for prompt_format in PROMPT_FORMATS.values():
+            # A throwaway cache so every mode really calls Groq
+            client = GroqClient(cache=VerdictCache(max_entries=1, redis_url=''), prompt_format=prompt_format)
+            for _ in range(options['rounds']):
+                for text in SAMPLE_TEXTS:
+                    client.cache.clear()
+                    started = time.monotonic()
+                    verdict = json.loads(client.analyze_text(text, model=model))
+                    self.stdout.write(
+                        f"{prompt_format.mode:<8} {verdict['threat_level']:<9} "
+                        f"{(time.monotonic() - started) * 1000:7.1f} ms  {text[:50]!r}"
+                    )
+        self._report(usage.stats()['process'])
+
+    def _report(self, summary):
+        self.stdout.write(
+            f"\n{'mode':<10}{'kind':<8}{'calls':>7}{'prompt':>10}{'completion':>12}{'latency ms':>12}"
+        )
+        for mode, kinds in sorted(summary.items()):
+            for kind, totals in sorted(kinds.items()):
+                self.stdout.write(
+                    f"{mode:<10}{kind:<8}{totals['calls']:>7}{totals['avg_prompt_tokens']:>10.1f}"
+                    f"{totals['avg_completion_tokens']:>12.1f}{totals['avg_latency_ms']:>12.1f}"
+                )
+
+        full, compact = summary.get('full', {}), summary.get('compact', {})
+        for kind in sorted(set(full) & set(compact)):
+            before, after = full[kind], compact[kind]
+            before_tokens = before['avg_prompt_tokens'] + before['avg_completion_tokens']
+            after_tokens = after['avg_prompt_tokens'] + after['avg_completion_tokens']
+            if before_tokens:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{kind}: {before_tokens:.0f} -> {after_tokens:.0f} tokens per call "
+                    f"({(1 - after_tokens / before_tokens) * 100:.0f}% fewer), "
+                    f"latency {before['avg_latency_ms']:.0f} -> {after['avg_latency_ms']:.0f} ms"
+                ))
@@ -0,0 +1,21 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core.blob_store import get_blob_store
+from visual.models import VisualCapture
+from audio.models import AudioCapture
+
+class Command(BaseCommand):
+    help = 'Delete uploaded media blobs older than a number of days from the claim-check blob store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=7, help='Delete blobs last written more than this many days ago')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # Captures from the binary upload endpoints may reference their blob in place
+        keep = set()
+        for model in (VisualCapture, AudioCapture):
+            keep.update(model.objects.exclude(metadata__blob_key=None).values_list('metadata__blob_key', flat=True))
+        deleted = get_blob_store().prune(cutoff, keep=keep)
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} blobs older than {options['days']} days"))
@@ -12,6 +12,7 @@ from visual.models import VisualCapture, VisualThreatDetection
 from audio.models import AudioCapture, AudioThreatDetection
 from text_analysis.models import TextSource, TextThreatDetection
 from asgiref.sync import async_to_sync
+from core.consumers import ThreatNotificationConsumer
 from channels.layers import get_channel_layer
 from django.conf import settings
 from PIL import Image, ImageDraw
@@ -387,13 +388,7 @@ class Command(BaseCommand):
         if event['event'] == 'visual' and 'bounding_box' in event:
             notification_data['bounding_box'] = event['bounding_box']
         
-        async_to_sync(channel_layer.group_send)(
-            f"user_{user.id}_notifications",
-            {
-                'type': 'threat_notification',
-                'data': notification_data
-            }
-        )
+        async_to_sync(ThreatNotificationConsumer.notify_user)(user.id, 'threat_notification', notification_data)
     
     def _send_visual_update(self, channel_layer, user, capture, event):
         """Send visual feed update via WebSocket"""
@@ -124,13 +124,7 @@ class Command(BaseCommand):
                         'confidence': threat.confidence_score
                     }
                     
-                    async_to_sync(channel_layer.group_send)(
-                        f"user_{user.id}_notifications",
-                        {
-                            'type': 'threat_notification',
-                            'data': notification_data
-                        }
-                    )
+                    async_to_sync(ThreatNotificationConsumer.notify_user)(user.id, 'threat_notification', notification_data)
                     
                     # For text threats, actually process the text using the task
                     if threat_type == 'text':
@@ -4,11 +4,15 @@ from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
 from django.utils import timezone
 from core.models import ThreatDetection, AnalysisSession
-from core.groq_utils import GroqClient
+from core.groq_utils import get_groq_client
+from core.triage import get_triage_engine
+from core.log_templates import get_log_template_miner, mine_repetitive, analyze_digests
+from core.chunking import merge_verdicts
 from text_analysis.models import TextSource, TextThreatDetection
 from visual.models import VisualCapture, VisualThreatDetection
 from audio.models import AudioCapture, AudioThreatDetection
 from asgiref.sync import async_to_sync
+from core.consumers import ThreatNotificationConsumer
 from channels.layers import get_channel_layer
 import logging
 
@@ -61,8 +65,10 @@ class Command(BaseCommand):
             f'Interval: {interval} seconds, Duration: {"indefinite" if duration == 0 else f"{duration} seconds"}'
         ))
         
-        # Initialize the Groq client
-        groq_client = GroqClient()
+        # Initialize the Groq client and the local triage rules
+        groq_client = get_groq_client()
+        triage_engine = get_triage_engine()
+        template_miner = get_log_template_miner()
         
         # Create a multimodal analysis session
         session = AnalysisSession.objects.create(
@@ -88,20 +94,44 @@ class Command(BaseCommand):
                 self.stdout.write(f'Iteration {iteration}: {current_time:.1f}s elapsed')
                 
                 # Collect system data for real threat detection
-                # 1. System logs analysis
-                system_logs = self._collect_system_logs()
-                if system_logs:
-                    self._analyze_text(groq_client, system_logs, user, session, channel_layer, "system_logs")
+                # 1. System logs, 2. Network traffic, 3. Process monitoring
+                collected = [
+                    ("system_logs", self._collect_system_logs()),
+                    ("network_traffic", self._collect_network_data()),
+                    ("process_data", self._collect_process_data()),
+                ]
+                collected = [(source_type, text) for source_type, text in collected if text]
                 
-                # 2. Network traffic analysis
-                network_data = self._collect_network_data()
-                if network_data:
-                    self._analyze_text(groq_client, network_data, user, session, channel_layer, "network_traffic")
-                
-                # 3. Process monitoring
-                process_data = self._collect_process_data()
-                if process_data:
-                    self._analyze_text(groq_client, process_data, user, session, channel_layer, "process_data")
+                # Local triage settles what it can; the rest goes to Groq in one batched request.
+                # For repetitive logs only new or rare templates reach Groq.
+                if collected:
+                    results = [self._triage(triage_engine, text) for _, text in collected]
+                    metadata = [{} for _ in collected]
+                    pending = [index for index, result in enumerate(results) if result is None]
+                    if pending:
+                        try:
+                            digests = {}
+                            for index in pending:
+                                digest = mine_repetitive(template_miner, collected[index][1])
+                                if digest is not None:
+                                    digests[index] = digest
+                            if digests:
+                                analyzed = analyze_digests(list(digests.values()), groq_client.analyze_text_batch)
+                                for (index, digest), pairs in zip(digests.items(), analyzed):
+                                    results[index] = merge_verdicts([verdict for _, verdict in pairs])
+                                    metadata[index] = {'log_templates': digest.metadata()}
+                            whole = [index for index in pending if index not in digests]
+                            if whole:
+                                batch_results = groq_client.analyze_text_batch([collected[index][1] for index in whole])
+                                for index, result in zip(whole, batch_results):
+                                    results[index] = result
+                        except Exception as e:
+                            self.stderr.write(self.style.ERROR(f'Error in batched analysis: {str(e)}'))
+                            logger.exception("Error in batched text analysis")
+                    
+                    for (source_type, text), result, text_metadata in zip(collected, results, metadata):
+                        self._analyze_text(groq_client, text, user, session, channel_layer, source_type,
+                                           analysis_result=result, metadata=text_metadata)
                 
                 # Wait for the next interval
                 time.sleep(interval)
@@ -124,6 +154,15 @@ class Command(BaseCommand):
                 f'Iterations: {iteration}\n'
                 f'Threats detected: {total_threats}'
             ))
+            if template_miner:
+                template_stats = template_miner.stats()
+                self.stdout.write(f"Log templates: {template_stats['lines']} lines in {template_stats['templates']} templates")
+            if triage_engine:
+                triage_stats = triage_engine.stats()
+                self.stdout.write(
+                    f"Triage: {triage_stats['total']} inputs, "
+                    f"LLM bypass rate {triage_stats['llm_bypass_rate']:.0%}"
+                )
             
         except KeyboardInterrupt:
             self.stdout.write(self.style.WARNING('\nDetection interrupted by user'))
@@ -157,25 +196,41 @@ class Command(BaseCommand):
         # For this example, we'll return sample process data
         return "chrome.exe, python.exe, explorer.exe"
     
-    def _analyze_text(self, groq_client, text, user, session, channel_layer, source_type="system"):
-        """Analyze text content using Groq API"""
+    def _triage(self, triage_engine, text):
+        """Return a local verdict when the triage rules are conclusive, or None if the LLM is needed"""
+        if triage_engine is None:
+            return None
+        triage = triage_engine.classify(text)
+        if not triage.needs_llm:
+            self.stdout.write(f"Triage: {triage.decision.replace('_', ' ')}, skipping LLM")
+        return triage.verdict
+    
+    def _analyze_text(self, groq_client, text, user, session, channel_layer, source_type="system",
+                      analysis_result=None, metadata=None):
+        """Analyze text content using Groq API, unless a batched result is passed in"""
         self.stdout.write(f"Analyzing {source_type}: {text[:50]}...")
         
         # Store text source
         text_source = TextSource.objects.create(
             session=session,
             content=text,
-            source_type=source_type
+            source_type=source_type,
+            metadata=metadata or {}
         )
         
-        # Analyze with Groq
+        # Analyze with local triage rules, then Groq
         try:
-            analysis_result = groq_client.analyze_text(text)
+            if analysis_result is None:
+                analysis_result = self._triage(get_triage_engine(), text)
+            if analysis_result is None:
+                analysis_result = groq_client.analyze_text(text)
             if not analysis_result:
                 return
             
             # Parse JSON response
             result = analysis_result
+            if isinstance(result, str):
+                result = json.loads(result)
             
             # If threat detected, create a threat detection record
             if result.get('threat_detected', False):
@@ -184,7 +239,8 @@ class Command(BaseCommand):
                     threat_level=result.get('threat_level', 'LOW'),
                     description=result.get('description', 'Unknown threat'),
                     source_type='text',
-                    confidence_score=result.get('confidence_score', 0.5)
+                    confidence_score=result.get('confidence_score', 0.5),
+                    analysis_tier=result.get('analysis_tier', '')
                 )
                 
                 # Create text-specific threat detection directly
@@ -194,6 +250,7 @@ class Command(BaseCommand):
                     description=result.get('description', 'Unknown threat'),
                     source_type='text',
                     confidence_score=result.get('confidence_score', 0.5),
+                    analysis_tier=result.get('analysis_tier', ''),
                     source=text_source,
                     start_index=0,
                     end_index=len(text),
@@ -212,13 +269,7 @@ class Command(BaseCommand):
                     'confidence': text_threat.confidence_score
                 }
                 
-                async_to_sync(channel_layer.group_send)(
-                    f"user_{user.id}_notifications",
-                    {
-                        'type': 'threat_notification',
-                        'data': notification_data
-                    }
-                )
+                async_to_sync(ThreatNotificationConsumer.notify_user)(user.id, 'threat_notification', notification_data)
                 
                 self.stdout.write(self.style.WARNING(
                     f'Detected {threat.threat_level} threat in {source_type}!'
@@ -0,0 +1,36 @@
+import json
+from django.core.management.base import BaseCommand
+from core.verdict_cache import get_verdict_cache
+
+class Command(BaseCommand):
+    help = 'Show verdict cache hit/miss counters and the number of Groq calls saved'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Reset the shared counters after displaying them'
+        )
+
+    def handle(self, *args, **options):
+        cache = get_verdict_cache()
+        if cache is None:
+            self.stderr.write(self.style.WARNING('Verdict cache is disabled (VERDICT_CACHE_ENABLED=False)'))
+            return
+
+        stats = cache.stats()
+        if 'shared' not in stats:
+            self.stdout.write(self.style.WARNING(
+                'No Redis tier configured; counters only cover this process. '
+                'Set VERDICT_CACHE_REDIS_URL to aggregate across workers.'
+            ))
+        self.stdout.write(json.dumps(stats, indent=2))
+
+        shared = stats.get('shared', {})
+        self.stdout.write(self.style.SUCCESS(
+            f"LLM calls saved across workers: {shared.get('llm_calls_saved', 0)}"
+        ))
+
+        if options['reset'] and cache.redis is not None:
+            cache.redis.delete(cache.STATS_KEY)
+            self.stdout.write(self.style.SUCCESS('Shared counters reset'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-16 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="threatdetection",
+            name="analysis_tier",
+            field=models.CharField(blank=True, default="", max_length=20),
+        ),
+    ]
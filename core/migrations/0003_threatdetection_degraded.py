@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-16 23:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0002_threatdetection_analysis_tier"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="threatdetection",
+            name="degraded",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -21,6 +21,8 @@ class ThreatDetection(BaseModel):
     description = models.TextField()
     source_type = models.CharField(max_length=50)  # visual, audio, text, or multimodal
     confidence_score = models.FloatField()
+    analysis_tier = models.CharField(max_length=20, blank=True, default='')  # triage, heuristic, small or large model
+    degraded = models.BooleanField(default=False)  # Local heuristic verdict issued while Groq was unavailable
     is_false_positive = models.BooleanField(default=False)
     reviewed_at = models.DateTimeField(null=True, blank=True)
     reviewed_by = models.ForeignKey(
@@ -0,0 +1,214 @@
+import re
+import json
+import hashlib
+import logging
+import threading
+from itertools import count
+from collections import OrderedDict
+import numpy as np
+from django.conf import settings
+from .log_templates import mask_token, IOC_PATTERN
+from .chunking import merge_verdicts
+
+logger = logging.getLogger('rt_cta')
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+DOMAIN_PATTERN = re.compile(r'\b(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}\b', re.IGNORECASE)
+
+# Tiers of verdicts not made by a full model analysis; they are never reused for other texts
+LOCAL_TIERS = ("triage", "near_duplicate", "template", "heuristic")
+
+def reusable(verdict):
+    """Whether a verdict comes from a completed full model analysis and may be reused for similar texts"""
+    return (not verdict.get("degraded") and "error" not in verdict
+            and verdict.get("analysis_tier") not in LOCAL_TIERS)
+
+def indicators(text):
+    """The URLs, domains, IP addresses and hashes in a text, which must match exactly for a verdict to be reused"""
+    return frozenset(match.lower() for pattern in (IOC_PATTERN, DOMAIN_PATTERN) for match in pattern.findall(text))
+
+def _features(text):
+    """Word unigrams and bigrams of the normalized text, with numbers, ids and IPs masked"""
+    tokens = [mask_token(token.strip('.,;:!?()"\'')) for token in text.lower().split()]
+    tokens = [token for token in tokens if token]
+    return set(tokens) | {f'{a} {b}' for a, b in zip(tokens, tokens[1:])}
+
+class MinHashIndex:
+    """
+    Bounded in-memory MinHash LSH index of verdicts.
+
+    Each text is reduced to a MinHash signature whose agreement with another
+    signature estimates the Jaccard similarity of their word sets. Signatures
+    are split into bands with one lookup table each; only texts sharing a band
+    are compared, and the best match at or above the similarity threshold is
+    returned. Texts that differ only by a recipient name or tracking id stay
+    well above the threshold, but a match must contain exactly the same
+    URLs, domains, IP addresses and hashes. Entries belong to a user and are
+    only found by that user's texts. Entries are evicted least recently used
+    beyond max_entries.
+    """
+
+    def __init__(self, threshold=None, num_perm=None, bands=None, max_entries=None, min_tokens=None):
+        self.threshold = threshold if threshold is not None else settings.NEAR_DUP_MIN_SIMILARITY
+        self.num_perm = num_perm if num_perm is not None else settings.NEAR_DUP_NUM_PERM
+        self.bands = bands if bands is not None else settings.NEAR_DUP_BANDS
+        self.max_entries = max_entries if max_entries is not None else settings.NEAR_DUP_MAX_ENTRIES
+        self.min_tokens = min_tokens if min_tokens is not None else settings.NEAR_DUP_MIN_TOKENS
+        self.rows = self.num_perm // self.bands
+        # Fixed seed so signatures are comparable across processes
+        generator = np.random.RandomState(1)
+        self._a = generator.randint(1, MERSENNE_PRIME, size=self.num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, MERSENNE_PRIME, size=self.num_perm, dtype=np.uint64)
+        self._tables = [{} for _ in range(self.bands)]
+        self._entries = OrderedDict()
+        self._ids = count(1)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def indexable(self, text):
+        """Very short texts have unstable signatures; the exact-match cache covers them"""
+        return len(text.split()) >= self.min_tokens
+
+    def signature(self, text):
+        """MinHash signature of a text's word set"""
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=4).digest(), 'big')
+             for feature in _features(text)],
+            dtype=np.uint64,
+        )
+        permuted = np.bitwise_and((np.outer(self._a, hashes) + self._b[:, None]) % MERSENNE_PRIME, MAX_HASH)
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature, user_id):
+        return [hash((user_id, signature[i * self.rows:(i + 1) * self.rows].tobytes())) for i in range(self.bands)]
+
+    def add(self, text, verdict, user_id):
+        """
+        Index a text's verdict
+
+        Args:
+            text (str): The analyzed text
+            verdict (dict or str): Its verdict
+            user_id (int): The user the text belongs to
+        """
+        if not self.indexable(text):
+            return
+        signature = self.signature(text)
+        keys = self._band_keys(signature, user_id)
+        if not isinstance(verdict, str):
+            verdict = json.dumps(verdict)
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (signature, keys, verdict, indicators(text))
+            for table, key in zip(self._tables, keys):
+                table.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                evicted_id, (_, evicted_keys, _, _) = self._entries.popitem(last=False)
+                for table, key in zip(self._tables, evicted_keys):
+                    bucket = table[key]
+                    bucket.discard(evicted_id)
+                    if not bucket:
+                        del table[key]
+
+    def find(self, text, user_id):
+        """
+        Find the verdict of the most similar text indexed for a user
+
+        Args:
+            text (str): The text to analyze
+            user_id (int): The user the text belongs to
+
+        Returns:
+            tuple: (verdict dict, estimated Jaccard similarity), or None if nothing is similar enough
+        """
+        if not self.indexable(text):
+            return None
+        signature = self.signature(text)
+        keys = self._band_keys(signature, user_id)
+        text_indicators = indicators(text)
+        with self._lock:
+            candidates = set()
+            for table, key in zip(self._tables, keys):
+                candidates |= table.get(key, set())
+            best, best_similarity = None, self.threshold
+            for entry_id in candidates:
+                entry_signature, _, _, entry_indicators = self._entries[entry_id]
+                if entry_indicators != text_indicators:
+                    continue
+                similarity = float(np.mean(entry_signature == signature))
+                if similarity >= best_similarity:
+                    best, best_similarity = entry_id, similarity
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best)
+            return json.loads(self._entries[best][2]), best_similarity
+
+    def warm(self, limit=None):
+        """
+        Index the most recent TextSource contents with the verdicts they received
+
+        Only sources stored with a reusable full model verdict in a completed
+        session are indexed. Those without surviving detections count as
+        benign; detections reviewed as false positives are ignored.
+        """
+        from text_analysis.models import TextSource
+        limit = limit if limit is not None else settings.NEAR_DUP_WARMUP_SOURCES
+        # Chat verdicts describe the whole conversation, not the stored messages
+        sources = (TextSource.objects.filter(metadata__reusable=True, session__status='completed')
+                   .exclude(source_type='chat').select_related('session').order_by('-timestamp')
+                   .prefetch_related('textthreatdetection_set')[:limit])
+        indexed = 0
+        for source in reversed(list(sources)):
+            if not self.indexable(source.content):
+                continue
+            detections = list(source.textthreatdetection_set.all())
+            if any(detection.degraded for detection in detections):
+                continue
+            verdicts = [{
+                "threat_detected": True,
+                "threat_level": detection.threat_level,
+                "confidence_score": detection.confidence_score,
+                "threat_type": "unknown",
+                "description": detection.description,
+                "indicators": detection.entities if isinstance(detection.entities, list) else [],
+            } for detection in detections if not detection.is_false_positive]
+            if verdicts:
+                verdict = merge_verdicts(verdicts)
+            else:
+                verdict = {
+                    "threat_detected": False,
+                    "threat_level": "LOW",
+                    "confidence_score": 0.8,
+                    "threat_type": "none",
+                    "description": "No threats detected in a previously analyzed similar text",
+                    "indicators": [],
+                }
+            self.add(source.content, verdict, source.session.user_id)
+            indexed += 1
+        logger.info(f"Near-duplicate index warmed with {indexed} historical text sources")
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_near_duplicate_index():
+    """Return the process-wide near-duplicate index, warmed from history on first use, or None when disabled"""
+    global _index
+    if not settings.NEAR_DUP_ENABLED:
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = MinHashIndex()
+            try:
+                _index.warm()
+            except Exception as e:
+                logger.error(f"Could not warm near-duplicate index: {str(e)}")
+    return _index
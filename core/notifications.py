@@ -0,0 +1,252 @@
+import asyncio
+import inspect
+import logging
+import threading
+from asgiref.sync import async_to_sync
+from celery import states
+from celery.signals import task_postrun
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .consumers import ThreatNotificationConsumer
+from .dashboard import SESSION_TYPES, merge_delta, threat_delta
+from .models import ThreatDetection, AnalysisSession
+from .triage import LEVEL_ORDER
+
+logger = logging.getLogger('rt_cta')
+
+# Tasks whose outcome is pushed to the user when they finish, and the source type they report
+ANALYSIS_TASKS = {
+    'core.tasks.process_visual_analysis': 'visual',
+    'core.tasks.process_audio_analysis': 'audio',
+    'core.tasks.process_text_analysis': 'text',
+    'core.tasks.process_text_analysis_batch': 'text',
+}
+
+class NotificationOutbox:
+    """
+    WebSocket notifications held until the transaction that produced them commits
+
+    publish() registers the message with transaction.on_commit, so a client
+    never hears about a verdict that was rolled back or is not readable yet.
+    Committed messages are sent in batches, concurrently on one event loop
+    hop, once NOTIFY_BATCH_SIZE are waiting or when flush() is called (after
+    every Celery task).
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.NOTIFY_BATCH_SIZE
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def publish(self, user_id, notification_type, data):
+        """
+        Queue a notification for when the current transaction commits (now, outside one)
+
+        Args:
+            user_id (int): The ID of the user to notify
+            notification_type (str): threat_notification, analysis_update or dashboard_delta
+            data (dict): The data to send
+        """
+        transaction.on_commit(lambda: self._enqueue((user_id, notification_type, data)))
+
+    def _enqueue(self, message):
+        with self._lock:
+            self._pending.append(message)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Send every committed notification
+
+        Returns:
+            int: Number of notifications sent
+        """
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+        try:
+            async_to_sync(self._send)(batch)
+        except Exception as e:
+            logger.error(f"Could not send {len(batch)} notifications: {str(e)}")
+            return 0
+        logger.debug(f"Sent {len(batch)} notifications")
+        return len(batch)
+
+    @staticmethod
+    async def _send(batch):
+        # A user's threats travel as one threat_batch group message per severity, and their
+        # dashboard changes as one delta; the consumer coalesces them either way
+        messages, threats, deltas = [], {}, {}
+        for user_id, notification_type, data in batch:
+            if notification_type == 'threat_notification':
+                threats.setdefault(user_id, []).append(data)
+            elif notification_type == 'dashboard_delta':
+                merge_delta(deltas.setdefault(user_id, {}), data)
+            else:
+                messages.append((user_id, notification_type, data))
+        messages.extend((user_id, 'dashboard_delta', delta) for user_id, delta in deltas.items())
+        for user_id, items in threats.items():
+            if len(items) == 1:
+                messages.append((user_id, 'threat_notification', items[0]))
+            else:
+                messages.append((user_id, 'threat_batch', {'items': items}))
+        results = await asyncio.gather(
+            *(ThreatNotificationConsumer.notify_user(*message) for message in messages),
+            return_exceptions=True
+        )
+        for error in results:
+            if isinstance(error, Exception):
+                logger.error(f"Could not send a notification: {str(error)}")
+
+_outbox = None
+
+def get_notification_outbox():
+    """Return the process-wide notification outbox"""
+    global _outbox
+    if _outbox is None:
+        _outbox = NotificationOutbox()
+    return _outbox
+
+def summarize_outcome(state, result):
+    """
+    The status and verdict summary of a finished (or running) analysis task
+
+    Shared by the WebSocket push and the task status endpoint so both report
+    the same shape.
+
+    Args:
+        state (str): Celery task state
+        result: The task's return value (a verdict, a list of verdicts, or {"error": ...})
+
+    Returns:
+        dict: {"state", "status", ...verdict fields when finished}
+    """
+    summary = {"state": state}
+    if state not in states.READY_STATES:
+        summary["status"] = 'processing'
+        return summary
+    if state != states.SUCCESS or (isinstance(result, dict) and "error" in result):
+        summary["status"] = 'failed'
+        # Our tasks return {"error": ...}; a raised exception is stored as exc_type/exc_message
+        summary["error"] = str(result.get("error", result.get("exc_message"))) if isinstance(result, dict) else str(result)
+        return summary
+
+    verdicts = result if isinstance(result, list) else [result]
+    threats = [verdict for verdict in verdicts if verdict.get("threat_detected")]
+    summary["status"] = 'degraded' if any(verdict.get("degraded") for verdict in verdicts) else 'completed'
+    summary["threat_detected"] = bool(threats)
+    if isinstance(result, list):
+        summary["items"] = len(verdicts)
+        summary["threats"] = len(threats)
+        levels = [verdict.get("threat_level", "LOW") for verdict in threats] or ["LOW"]
+        summary["threat_level"] = max(levels, key=_level_rank)
+    else:
+        summary["threat_level"] = result.get("threat_level", "LOW")
+        summary["confidence_score"] = result.get("confidence_score")
+        summary["threat_type"] = result.get("threat_type")
+    return summary
+
+def _level_rank(level):
+    return LEVEL_ORDER.index(level) if level in LEVEL_ORDER else 0
+
+@task_postrun.connect
+def publish_task_outcome(sender=None, task_id=None, task=None, args=None, kwargs=None, retval=None, state=None,
+                         **extra):
+    """Push a finished analysis task's outcome (and any threats it found) to its user, then flush the outbox"""
+    outbox = get_notification_outbox()
+    try:
+        source_type = ANALYSIS_TASKS.get(getattr(task, 'name', None))
+        if source_type is None:
+            return
+        arguments = inspect.signature(task.run).bind_partial(*(args or ()), **(kwargs or {})).arguments
+        user_id = arguments.get('user_id')
+        if user_id is None:
+            return
+        if arguments.get('finalize_session') is False:
+            # Part of a multimodal chord; its callback sends the one notification
+            return
+
+        summary = summarize_outcome(state, retval)
+        timestamp = timezone.now().isoformat()
+        outbox.publish(user_id, 'analysis_update', dict(
+            summary,
+            type='task_complete',
+            task_id=task_id,
+            task=task.name.rsplit('.', 1)[-1],
+            session_id=arguments.get('session_id'),
+            source_type=source_type,
+            timestamp=timestamp,
+        ))
+        if summary["status"] in ('completed', 'degraded'):
+            for verdict in retval if isinstance(retval, list) else [retval]:
+                if not verdict.get("threat_detected"):
+                    continue
+                threat_ids = verdict.get("threat_ids") or []
+                outbox.publish(user_id, 'threat_notification', {
+                    # The stored ThreatDetection, as in the dashboard's threat list; a chunked
+                    # or mined text can have several, listed in threat_ids
+                    'id': threat_ids[0] if len(threat_ids) == 1 else None,
+                    'threat_ids': threat_ids,
+                    'level': verdict.get("threat_level"),
+                    'description': verdict.get("description", ""),
+                    'source_type': source_type,
+                    'task_id': task_id,
+                    'session_id': arguments.get('session_id'),
+                    'degraded': verdict.get("degraded", False),
+                    'timestamp': timestamp,
+                    'confidence': verdict.get("confidence_score", 0.0),
+                })
+    except Exception as e:
+        logger.error(f"Could not publish the outcome of task {task_id}: {str(e)}")
+    finally:
+        outbox.flush()
+
+def publish_dashboard_delta(user_id, delta):
+    """
+    Send a dashboard change to the user's open dashboards
+
+    The outbox is flushed as soon as the transaction commits, in Celery
+    tasks too, so the change is numbered at commit time: a dashboard
+    snapshot reads the sequence number before its queries and must not
+    include rows whose delta is numbered after it.
+    """
+    outbox = get_notification_outbox()
+    outbox.publish(user_id, 'dashboard_delta', delta)
+    transaction.on_commit(outbox.flush)
+
+def publish_threat_saved(sender, instance, created, **kwargs):
+    """Count a new threat (of any detection model) on its user's dashboard"""
+    if created:
+        publish_dashboard_delta(instance.user_id, threat_delta([instance]))
+
+def connect_threat_receivers():
+    """
+    Connect publish_threat_saved to ThreatDetection and each detection model inheriting from it
+
+    Saving a subclass row sends post_save for the subclass only. Called once
+    every app's models are loaded.
+    """
+    for model in [ThreatDetection] + ThreatDetection.__subclasses__():
+        post_save.connect(publish_threat_saved, sender=model, dispatch_uid=f'publish_threat_saved:{model._meta.label}')
+
+@receiver(post_delete, sender=ThreatDetection)
+def publish_threat_deleted(sender, instance, **kwargs):
+    """Take a deleted threat off its user's dashboard"""
+    # Deleting a subclass row deletes its ThreatDetection parent too, so this sees every threat exactly once
+    publish_dashboard_delta(instance.user_id, threat_delta([instance], removed=True))
+
+@receiver(post_save, sender=AnalysisSession)
+def publish_session_status(sender, instance, update_fields=None, **kwargs):
+    """Show a session's status on the dashboard; its start time lets the dashboard keep the latest session's"""
+    if instance.session_type not in SESSION_TYPES or (update_fields is not None and 'status' not in update_fields):
+        return
+    publish_dashboard_delta(instance.user_id, {
+        'session_status': {instance.session_type: instance.status},
+        'session_started': {instance.session_type: instance.start_time.timestamp()},
+    })
@@ -0,0 +1,375 @@
+import re
+import json
+import logging
+from collections import Counter
+from django.conf import settings
+
+logger = logging.getLogger('rt_cta')
+
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-?]*[ -/]*[@-~]|\x1b\][^\x07]*(?:\x07|\x1b\\)|\x1b[@-Z\\-_]')
+HORIZONTAL_SPACE = re.compile(r'[ \t\f\v]+')
+
+SYSTEM_MESSAGE = "You are a cybersecurity threat detection AI."
+
+COMPACT_INSTRUCTIONS = """You are a cybersecurity threat detection system. Analyze the user's input for security threats such as phishing, social engineering, malware indications or suspicious instructions.
+Reply with compact JSON only, no other text:
+{"t":1|0,"l":"L"|"M"|"H"|"C","c":0.0-1.0,"y":"threat type","d":"one short sentence","i":["indicator"]}
+t=threat detected, l=threat level (low/medium/high/critical), c=confidence, y=threat type ("none" if t=0), d=description, i=indicators (empty if t=0)."""
+
+COMPACT_BATCH_INSTRUCTIONS = """You are a cybersecurity threat detection system. The user sends numbered texts, one per line as [n] text. Analyze each independently for security threats such as phishing, social engineering, malware indications or suspicious instructions.
+Reply with a compact JSON array only, one object per text, no other text:
+[{"n":1,"t":1|0,"l":"L"|"M"|"H"|"C","c":0.0-1.0,"y":"threat type","d":"one short sentence","i":["indicator"]}]
+n=text number, t=threat detected, l=threat level (low/medium/high/critical), c=confidence, y=threat type ("none" if t=0), d=description, i=indicators (empty if t=0)."""
+
+COMPACT_CONVERSATION_INSTRUCTIONS = """You are a cybersecurity threat detection system monitoring an ongoing chat for social engineering, phishing, fraud or malware delivery, which often builds up over many messages. The user sends the conversation summary so far, the current risk, recent messages for context and the new messages.
+Assess the whole conversation given the new messages. Reply with compact JSON only, no other text:
+{"t":1|0,"l":"L"|"M"|"H"|"C","c":0.0-1.0,"y":"threat type","d":"one short sentence","i":["indicator"],"s":"updated summary"}
+t=threat detected, l=threat level (low/medium/high/critical), c=confidence, y=threat type ("none" if t=0), d=description, i=indicators (empty if t=0), s=summary of the whole conversation in at most {max_words} words keeping every security-relevant detail (requests for credentials, money, links, urgency, claimed identities)."""
+
+LEVELS = {'L': 'LOW', 'M': 'MEDIUM', 'H': 'HIGH', 'C': 'CRITICAL'}
+
+def clean_input(text):
+    """
+    Drop what costs tokens without carrying signal
+
+    Strips ANSI escape sequences, collapses runs of spaces and tabs, drops
+    blank lines and replaces repeated lines with their first occurrence
+    plus a repeat count, so a burst of identical lines stays visible.
+    """
+    lines = []
+    for line in ANSI_ESCAPE.sub('', str(text)).splitlines():
+        line = HORIZONTAL_SPACE.sub(' ', line).strip()
+        if line:
+            lines.append(line)
+    counts = Counter(lines)
+    cleaned = []
+    for line in lines:
+        count = counts.get(line)
+        if count is None:
+            continue
+        cleaned.append(f"{line} (repeated {count} times)" if count > 1 else line)
+        del counts[line]
+    return '\n'.join(cleaned)
+
+def expand_verdict(item):
+    """
+    Expand a short-key verdict to the full analysis shape
+
+    Replies already in the full shape are returned unchanged.
+    """
+    if 'threat_detected' in item:
+        return item
+    detected = item.get('t') in (1, True, '1', 'true')
+    try:
+        confidence = float(item.get('c', 0.5))
+    except (TypeError, ValueError):
+        confidence = 0.5
+    verdict = {
+        "threat_detected": detected,
+        "threat_level": LEVELS.get(str(item.get('l') or 'L')[:1].upper(), 'LOW'),
+        "confidence_score": confidence,
+        "threat_type": item.get('y') or ('unknown' if detected else 'none'),
+        "description": item.get('d', ''),
+        "indicators": list(item.get('i') or []),
+    }
+    if 'n' in item:
+        verdict['id'] = item['n']
+    if 's' in item:
+        verdict['summary'] = item['s']
+    return verdict
+
+class StreamingVerdictParser:
+    """
+    Incremental parser for a streamed JSON verdict.
+
+    Scalar top-level fields are extracted as soon as their value is complete
+    in the stream, without waiting for the closing brace. With compact=True
+    the short-key schema is read and fields are reported under their full
+    names.
+    """
+
+    EARLY_FIELDS = ("threat_detected", "threat_level")
+
+    _FIELD_PATTERNS = {
+        "threat_detected": (re.compile(r'"threat_detected"\s*:\s*(true|false)'), lambda v: v == "true"),
+        "threat_level": (re.compile(r'"threat_level"\s*:\s*"(LOW|MEDIUM|HIGH|CRITICAL)"'), str),
+        "confidence_score": (re.compile(r'"confidence_score"\s*:\s*([0-9.]+)\s*[,}]'), float),
+        "threat_type": (re.compile(r'"threat_type"\s*:\s*"((?:[^"\\]|\\.)*)"'), str),
+    }
+
+    _COMPACT_FIELD_PATTERNS = {
+        "threat_detected": (re.compile(r'"t"\s*:\s*(1|0|true|false)'), lambda v: v in ("1", "true")),
+        "threat_level": (re.compile(r'"l"\s*:\s*"([LMHC])[A-Z]*"'), LEVELS.get),
+        "confidence_score": (re.compile(r'"c"\s*:\s*([0-9.]+)\s*[,}]'), float),
+        "threat_type": (re.compile(r'"y"\s*:\s*"((?:[^"\\]|\\.)*)"'), str),
+    }
+
+    def __init__(self, compact=False):
+        self._patterns = self._COMPACT_FIELD_PATTERNS if compact else self._FIELD_PATTERNS
+        self._chunks = []
+        self._buffer = ""
+        self.fields = {}
+
+    def feed(self, delta):
+        """
+        Add a streamed chunk
+
+        Args:
+            delta (str): The next piece of streamed content
+
+        Returns:
+            dict: All fields extracted so far
+        """
+        self._chunks.append(delta)
+        self._buffer += delta
+        for name, (pattern, convert) in self._patterns.items():
+            if name in self.fields:
+                continue
+            match = pattern.search(self._buffer)
+            if match:
+                self.fields[name] = convert(match.group(1))
+        return dict(self.fields)
+
+    @property
+    def early_fields_ready(self):
+        """Whether every early field has been seen, or the reply already says no threat"""
+        if self.fields.get("threat_detected") is False:
+            return True
+        return all(name in self.fields for name in self.EARLY_FIELDS)
+
+    @property
+    def content(self):
+        return "".join(self._chunks)
+
+class PromptFormat:
+    """
+    The original prompt: instructions and JSON template in every user message.
+
+    Subclasses change what is sent and how replies are read back; every
+    format returns verdicts in the same full dict shape.
+    """
+
+    mode = 'full'
+    # Part of verdict cache keys; bump whenever a format's prompt changes
+    version = 'v1'
+    text_max_tokens = 1000
+
+    def batch_max_tokens(self, count):
+        return min(8000, 200 * count + 200)
+
+    def text_messages(self, text):
+        """Build the chat messages for a single text analysis"""
+        prompt = f"""
+            You are a cybersecurity threat detection system. 
+            Analyze the following text for potential security threats such as phishing attempts, 
+            social engineering, malware indications, or suspicious instructions.
+            
+            Text: {text}
+            
+            Provide your analysis in the following JSON format:
+            {{
+                "threat_detected": true/false,
+                "threat_level": "LOW"/"MEDIUM"/"HIGH"/"CRITICAL",
+                "confidence_score": 0.0-1.0,
+                "threat_type": "string",
+                "description": "string",
+                "indicators": ["string", "string"]
+            }}
+            
+            Only provide the JSON output, nothing else.
+            """
+        return [
+            {"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ]
+
+    def batch_messages(self, texts, indices):
+        """Build the chat messages for one numbered batch analysis"""
+        numbered = "\n".join(
+            f"[{number}] {' '.join(texts[index].split())}"
+            for number, index in enumerate(indices, start=1)
+        )
+        prompt = f"""
+            You are a cybersecurity threat detection system.
+            Analyze each of the following numbered texts independently for potential security threats
+            such as phishing attempts, social engineering, malware indications, or suspicious instructions.
+
+            Texts:
+            {numbered}
+
+            Provide your analysis as a JSON array with exactly one object per numbered text:
+            [
+                {{
+                    "id": <number of the text>,
+                    "threat_detected": true/false,
+                    "threat_level": "LOW"/"MEDIUM"/"HIGH"/"CRITICAL",
+                    "confidence_score": 0.0-1.0,
+                    "threat_type": "string",
+                    "description": "string",
+                    "indicators": ["string", "string"]
+                }}
+            ]
+
+            Only provide the JSON output, nothing else.
+            """
+        return [
+            {"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ]
+
+    def conversation_messages(self, summary, risk_level, recent, new):
+        """
+        Build the chat messages for one incremental conversation analysis
+
+        Args:
+            summary (str): Rolling summary of the conversation so far
+            risk_level (str): Current conversation risk level
+            recent (list[str]): Last already-analyzed messages, for context
+            new (list[str]): Messages not analyzed yet
+        """
+        prompt = f"""
+            You are a cybersecurity threat detection system monitoring an ongoing chat conversation
+            for social engineering, phishing, fraud or malware delivery, which often builds up over many messages.
+
+            Conversation summary so far: {summary or "(the conversation just started)"}
+            Current conversation risk: {risk_level}
+
+            Recent messages (already analyzed):
+            {chr(10).join(recent) or "(none)"}
+
+            New messages:
+            {chr(10).join(new)}
+
+            Assess the conversation as a whole given the new messages and provide your analysis in the following JSON format:
+            {{
+                "threat_detected": true/false,
+                "threat_level": "LOW"/"MEDIUM"/"HIGH"/"CRITICAL",
+                "confidence_score": 0.0-1.0,
+                "threat_type": "string",
+                "description": "string",
+                "indicators": ["string", "string"],
+                "summary": "updated summary of the whole conversation in at most {settings.CHAT_SUMMARY_MAX_WORDS} words, keeping every security-relevant detail"
+            }}
+
+            Only provide the JSON output, nothing else.
+            """
+        return [
+            {"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ]
+
+    def parse_text(self, content):
+        """Return a single-text reply as JSON in the full verdict shape"""
+        return content
+
+    def parse_batch(self, content, expected):
+        """
+        Split a numbered batch reply into per-item verdicts
+
+        Returns:
+            dict: Mapping of item number (1-based) to verdict dict; items that
+            could not be parsed are omitted
+        """
+        content = content.strip()
+        start, end = content.find('['), content.rfind(']')
+        if start == -1 or end <= start:
+            logger.warning("Batch response did not contain a JSON array")
+            return {}
+        try:
+            items = json.loads(content[start:end + 1])
+        except json.JSONDecodeError as e:
+            logger.warning(f"Could not parse batch response: {str(e)}")
+            return {}
+
+        verdicts = {}
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            item = self._expand(item)
+            if 'threat_detected' not in item:
+                continue
+            try:
+                number = int(item.pop('id'))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if 1 <= number <= expected:
+                verdicts[number] = item
+        return verdicts
+
+    def _expand(self, item):
+        return item
+
+    def stream_parser(self):
+        return StreamingVerdictParser()
+
+class CompactPromptFormat(PromptFormat):
+    """
+    Token-lean prompt: static instructions in the system message, cleaned
+    input as the whole user message and a short-key reply schema.
+    """
+
+    mode = 'compact'
+    version = 'c1'
+
+    @property
+    def text_max_tokens(self):
+        return settings.GROQ_COMPACT_MAX_TOKENS
+
+    def batch_max_tokens(self, count):
+        return min(8000, settings.GROQ_COMPACT_BATCH_ITEM_TOKENS * count + 50)
+
+    def text_messages(self, text):
+        return [
+            {"role": "system", "content": COMPACT_INSTRUCTIONS},
+            {"role": "user", "content": clean_input(text)}
+        ]
+
+    def batch_messages(self, texts, indices):
+        numbered = "\n".join(
+            f"[{number}] {' '.join(clean_input(texts[index]).split())}"
+            for number, index in enumerate(indices, start=1)
+        )
+        return [
+            {"role": "system", "content": COMPACT_BATCH_INSTRUCTIONS},
+            {"role": "user", "content": numbered}
+        ]
+
+    def conversation_messages(self, summary, risk_level, recent, new):
+        sections = [
+            f"Summary: {summary or '(conversation just started)'}",
+            f"Risk: {risk_level}",
+        ]
+        if recent:
+            sections.append("Recent:\n" + "\n".join(clean_input(message) for message in recent))
+        sections.append("New:\n" + "\n".join(clean_input(message) for message in new))
+        return [
+            {"role": "system", "content": COMPACT_CONVERSATION_INSTRUCTIONS.replace('{max_words}', str(settings.CHAT_SUMMARY_MAX_WORDS))},
+            {"role": "user", "content": "\n".join(sections)}
+        ]
+
+    def parse_text(self, content):
+        start, end = content.find('{'), content.rfind('}')
+        try:
+            item = json.loads(content[start:end + 1])
+        except ValueError:
+            # Left for the caller's JSON handling, as with the full format
+            logger.warning("Compact response did not contain a JSON object")
+            return content
+        if not isinstance(item, dict):
+            return content
+        return json.dumps(expand_verdict(item))
+
+    def _expand(self, item):
+        return expand_verdict(item)
+
+    def stream_parser(self):
+        return StreamingVerdictParser(compact=True)
+
+PROMPT_FORMATS = {fmt.mode: fmt for fmt in (PromptFormat(), CompactPromptFormat())}
+
+def get_prompt_format(mode=None):
+    """Return the prompt format for a mode, defaulting to GROQ_PROMPT_MODE"""
+    mode = mode or settings.GROQ_PROMPT_MODE
+    if mode not in PROMPT_FORMATS:
+        raise ValueError(f"Unknown Groq prompt mode: {mode}")
+    return PROMPT_FORMATS[mode]
@@ -0,0 +1,273 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+import groq
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger('rt_cta')
+
+def estimate_tokens(messages, max_tokens=0):
+    """
+    Roughly estimate the tokens a chat completion will consume
+
+    Uses the common ~4 characters per token heuristic for the prompt and
+    assumes the full completion budget is used.
+
+    Args:
+        messages (list): Chat messages to be sent
+        max_tokens (int): Completion token budget of the request
+
+    Returns:
+        int: Estimated total tokens
+    """
+    prompt_chars = sum(len(message.get("content") or "") for message in messages)
+    return prompt_chars // 4 + 4 * len(messages) + (max_tokens or 0)
+
+async def off_loop(shared, fn, *args):
+    """
+    Call fn from a coroutine without blocking the event loop on Redis
+
+    Args:
+        shared (bool): Whether fn talks to Redis; only then does it run in a
+            worker thread, in-process state is cheap enough to use inline
+        fn (callable): The blocking function
+
+    Returns:
+        The result of fn
+    """
+    if not shared:
+        return fn(*args)
+    return await sync_to_async(fn, thread_sensitive=False)(*args)
+
+def parse_retry_after(error):
+    """Return the server-requested delay in seconds from a Groq error, if any"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        pass
+    return None
+
+class RateLimitScheduler:
+    """
+    Keeps Groq traffic under requests-per-minute and tokens-per-minute budgets.
+
+    Budgets are tracked per model. Without Redis a sliding 60 second window
+    is kept in-process; with Redis, fixed one-minute windows are shared by
+    every worker. A 429 with retry-after pauses all workers for that long.
+    Retryable failures are retried with full-jitter exponential backoff.
+    """
+
+    WINDOW = 60
+    KEY_PREFIX = 'rt_cta:groq_rate'
+    RETRYABLE_ERRORS = (groq.RateLimitError, groq.InternalServerError, groq.APIConnectionError)
+
+    def __init__(self, limits=None, redis_client=None, namespace='default',
+                 max_retries=None, base_delay=None, max_delay=None):
+        self.limits = limits if limits is not None else settings.GROQ_RATE_LIMITS
+        self.redis = redis_client
+        self.namespace = namespace
+        self.max_retries = max_retries if max_retries is not None else settings.GROQ_MAX_RETRIES
+        self.base_delay = base_delay if base_delay is not None else settings.GROQ_RETRY_BASE_DELAY
+        self.max_delay = max_delay if max_delay is not None else settings.GROQ_RETRY_MAX_DELAY
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._blocked_until = 0.0
+
+    def _limits_for(self, model):
+        return self.limits.get(model, self.limits['default'])
+
+    def call(self, fn, tokens, model):
+        """
+        Run a Groq request within budget, retrying rate limits and transient errors
+
+        Args:
+            fn (callable): Zero-argument function performing the request
+            tokens (int): Estimated tokens the request consumes
+            model (str): Model the request is sent to
+
+        Returns:
+            The result of fn
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(tokens, model)
+            try:
+                return fn()
+            except self.RETRYABLE_ERRORS as e:
+                error = e
+                delay = self._retry_delay(e, attempt)
+
+            if attempt == self.max_retries:
+                raise error
+            logger.warning(f"Groq request failed ({type(error).__name__}), retry {attempt + 1} in {delay:.1f}s")
+            time.sleep(delay)
+
+    async def acall(self, fn, tokens, model):
+        """
+        Async variant of call for use on an event loop
+
+        Args:
+            fn (callable): Zero-argument function returning an awaitable request
+            tokens (int): Estimated tokens the request consumes
+            model (str): Model the request is sent to
+
+        Returns:
+            The awaited result of fn
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.aacquire(tokens, model)
+            try:
+                return await fn()
+            except self.RETRYABLE_ERRORS as e:
+                error = e
+
+            # A 429 shares its retry-after through Redis
+            delay = await off_loop(self.redis is not None, self._retry_delay, error, attempt)
+            if attempt == self.max_retries:
+                raise error
+            logger.warning(f"Groq request failed ({type(error).__name__}), retry {attempt + 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def _retry_delay(self, error, attempt):
+        """Honor retry-after on 429s (pausing everyone), else back off"""
+        if isinstance(error, groq.RateLimitError):
+            delay = parse_retry_after(error)
+            if delay is not None:
+                self.block(delay)
+                return delay
+        return self._backoff(attempt)
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def acquire(self, tokens, model):
+        """Block until the request fits in the model's budgets, then reserve it"""
+        while True:
+            wait = self.try_acquire(tokens, model)
+            if wait <= 0:
+                return
+            logger.debug(f"Groq budget for {model} exhausted, waiting {wait:.2f}s")
+            time.sleep(min(wait, self.WINDOW))
+
+    async def aacquire(self, tokens, model):
+        """Wait without blocking the event loop until the request fits, then reserve it"""
+        while True:
+            wait = await self.atry_acquire(tokens, model)
+            if wait <= 0:
+                return
+            logger.debug(f"Groq budget for {model} exhausted, waiting {wait:.2f}s")
+            await asyncio.sleep(min(wait, self.WINDOW))
+
+    async def atry_acquire(self, tokens, model):
+        """try_acquire for event loops; shared budgets are reserved from a worker thread"""
+        return await off_loop(self.redis is not None, self.try_acquire, tokens, model)
+
+    def try_acquire(self, tokens, model):
+        """
+        Reserve budget for a request without blocking
+
+        Returns:
+            float: 0 if the request was reserved, else the seconds to wait
+        """
+        limits = self._limits_for(model)
+        # A single oversized request can never fit; let it through rather than wait forever
+        tokens = min(tokens, limits['tpm'])
+        wait = self._blocked_for()
+        if wait > 0:
+            return wait
+        return self._reserve(tokens, model, limits)
+
+    def block(self, seconds):
+        """Pause all requests (across workers with Redis) for the given time"""
+        until = time.time() + seconds
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, until)
+        if self.redis is not None:
+            try:
+                self.redis.set(f'{self.KEY_PREFIX}:{self.namespace}:blocked', until, px=max(1, int(seconds * 1000)))
+            except Exception as e:
+                logger.error(f"Could not share Groq retry-after block: {str(e)}")
+
+    def _blocked_for(self):
+        until = self._blocked_until
+        if self.redis is not None:
+            try:
+                shared = self.redis.get(f'{self.KEY_PREFIX}:{self.namespace}:blocked')
+                if shared is not None:
+                    until = max(until, float(shared))
+            except Exception as e:
+                logger.error(f"Could not read shared Groq retry-after block: {str(e)}")
+        return until - time.time()
+
+    def _reserve(self, tokens, model, limits):
+        """Try to reserve budget; return 0 on success or the seconds to wait"""
+        if self.redis is not None:
+            try:
+                return self._reserve_shared(tokens, model, limits)
+            except Exception as e:
+                logger.error(f"Shared Groq budget unavailable, using local budget: {str(e)}")
+        return self._reserve_local(tokens, model, limits)
+
+    def _reserve_local(self, tokens, model, limits):
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.setdefault(model, deque())
+            while window and window[0][0] <= now - self.WINDOW:
+                window.popleft()
+            used_tokens = sum(t for _, t in window)
+            if len(window) < limits['rpm'] and used_tokens + tokens <= limits['tpm']:
+                window.append((now, tokens))
+                return 0
+            # Wait until enough of the oldest requests leave the window
+            freed = 0
+            for expired, (timestamp, spent) in enumerate(window, start=1):
+                freed += spent
+                if len(window) - expired < limits['rpm'] and used_tokens - freed + tokens <= limits['tpm']:
+                    return timestamp + self.WINDOW - now
+            return self.WINDOW
+
+    def _reserve_shared(self, tokens, model, limits):
+        now = time.time()
+        minute = int(now // self.WINDOW)
+        base = f'{self.KEY_PREFIX}:{self.namespace}:{model}:{minute}'
+        pipe = self.redis.pipeline()
+        pipe.incr(f'{base}:requests')
+        pipe.incrby(f'{base}:tokens', tokens)
+        pipe.expire(f'{base}:requests', self.WINDOW * 2)
+        pipe.expire(f'{base}:tokens', self.WINDOW * 2)
+        requests, used_tokens, _, _ = pipe.execute()
+        if requests <= limits['rpm'] and used_tokens <= limits['tpm']:
+            return 0
+        # Over budget: give the reservation back and wait for the next window
+        pipe = self.redis.pipeline()
+        pipe.decr(f'{base}:requests')
+        pipe.decrby(f'{base}:tokens', tokens)
+        pipe.execute()
+        return (minute + 1) * self.WINDOW - now
+
+_scheduler = None
+
+def get_rate_limit_redis():
+    """Return a Redis client for shared budgets, or None when budgets are per-process"""
+    if not settings.GROQ_RATE_LIMIT_REDIS_URL:
+        return None
+    import redis
+    return redis.Redis.from_url(settings.GROQ_RATE_LIMIT_REDIS_URL)
+
+def get_rate_limit_scheduler():
+    """Return the process-wide Groq rate-limit scheduler"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RateLimitScheduler(redis_client=get_rate_limit_redis())
+    return _scheduler
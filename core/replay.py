@@ -0,0 +1,124 @@
+import json
+import logging
+from django.conf import settings
+
+logger = logging.getLogger('rt_cta')
+
+class ReplayBuffer:
+    """
+    Per-user ring buffer of the last WebSocket notifications sent
+
+    Every notification gets the next sequence number of its user and is kept
+    (up to NOTIFY_REPLAY_BUFFER per user) so a client that reconnects with
+    the last sequence number it saw receives only what it missed. Numbers
+    and buffer live in Redis (NOTIFY_REPLAY_REDIS_URL), shared by the web
+    and worker processes that send notifications; without it notifications
+    are not numbered and a reconnecting client gets a fresh snapshot, since
+    per-process counters would interleave unrelated sequences.
+    """
+
+    KEY_PREFIX = 'rt_cta:notify_replay:'
+
+    # Numbers a notification and pushes it in one step, so the buffer is
+    # always in sequence order and never misses a number that was handed out
+    APPEND_SCRIPT = """
+    local seq = redis.call('INCR', KEYS[1])
+    redis.call('RPUSH', KEYS[2], '{"seq": ' .. seq .. ', "event": ' .. ARGV[1] .. '}')
+    redis.call('LTRIM', KEYS[2], -tonumber(ARGV[2]), -1)
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return seq
+    """
+
+    def __init__(self, size=None, ttl=None, redis_url=None):
+        self.size = size or settings.NOTIFY_REPLAY_BUFFER
+        self.ttl = ttl or settings.NOTIFY_REPLAY_TTL
+
+        self.redis = None
+        redis_url = redis_url if redis_url is not None else settings.NOTIFY_REPLAY_REDIS_URL
+        if redis_url:
+            try:
+                import redis
+                self.redis = redis.Redis.from_url(redis_url)
+                self._append = self.redis.register_script(self.APPEND_SCRIPT)
+            except Exception as e:
+                logger.error(f"Could not connect the notification replay buffer to Redis: {str(e)}")
+
+    def append(self, user_id, notification_type, data):
+        """
+        Number a notification and keep it for replay
+
+        Args:
+            user_id (int): The user notified
+            notification_type (str): threat_notification, analysis_update or dashboard_delta
+            data (dict): The notification data
+
+        Returns:
+            dict: A copy of data with its "seq", or data unchanged if it could not be recorded
+        """
+        if self.redis is None:
+            return data
+        try:
+            seq = self._append(keys=[self._key(user_id, 'seq'), self._key(user_id, 'events')],
+                               args=[json.dumps({'type': notification_type, 'data': data}), self.size, self.ttl])
+            return dict(data, seq=seq)
+        except Exception as e:
+            logger.error(f"Could not record a notification for replay: {str(e)}")
+            return data
+
+    def since(self, user_id, last_seq):
+        """
+        The notifications a client missed after last_seq
+
+        Returns:
+            tuple: (events in sequence order, the user's current sequence
+            number or None if unknown, whether nothing was missed beyond what
+            the buffer still holds)
+        """
+        if self.redis is None:
+            return [], None, False
+        try:
+            pipe = self.redis.pipeline()
+            pipe.get(self._key(user_id, 'seq'))
+            pipe.lrange(self._key(user_id, 'events'), 0, -1)
+            current, raw = pipe.execute()
+        except Exception as e:
+            logger.error(f"Could not read the notification replay buffer: {str(e)}")
+            return [], None, False
+        current = int(current or 0)
+        events = [self._event(json.loads(entry)) for entry in raw]
+
+        if last_seq > current:
+            # The counter started over (restart or expiry); the client's position means nothing now
+            return [], current, False
+        oldest = events[0]['data']['seq'] if events else current + 1
+        missed = [event for event in events if event['data']['seq'] > last_seq]
+        return missed, current, last_seq >= oldest - 1
+
+    def current(self, user_id):
+        """The sequence number of the user's last notification (0 before the first, None if unknown)"""
+        if self.redis is None:
+            return None
+        try:
+            return int(self.redis.get(self._key(user_id, 'seq')) or 0)
+        except Exception as e:
+            logger.error(f"Could not read the notification sequence number: {str(e)}")
+            return None
+
+    @staticmethod
+    def _event(entry):
+        event = entry['event']
+        event['data']['seq'] = entry['seq']
+        return event
+
+    def _key(self, user_id, name):
+        return f"{self.KEY_PREFIX}{user_id}:{name}"
+
+_replay_buffer = None
+
+def get_replay_buffer():
+    """Return the process-wide notification replay buffer"""
+    global _replay_buffer
+    if _replay_buffer is None:
+        _replay_buffer = ReplayBuffer()
+    return _replay_buffer
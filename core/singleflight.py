@@ -0,0 +1,170 @@
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import Future
+from django.conf import settings
+
+logger = logging.getLogger('rt_cta')
+
+class SingleFlight:
+    """
+    Coalesce identical in-flight calls within one process.
+
+    The first caller for a key runs the function; concurrent callers with the
+    same key block on a shared future and receive the same result (or error).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """
+        Run fn once per key among concurrent callers
+
+        Args:
+            key (str): Content key identifying the call
+            fn (callable): Zero-argument function producing the result
+
+        Returns:
+            The result of the single upstream call
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            logger.debug(f"Joining in-flight call for key {key[:12]}")
+            return future.result()
+
+        try:
+            result = self._run(key, fn)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def _run(self, key, fn):
+        return fn()
+
+class RedisSingleFlight(SingleFlight):
+    """
+    Single-flight coalescing across Celery workers using a Redis lock.
+
+    Threads in the same process are coalesced locally first. The process that
+    wins the Redis lock calls upstream and publishes the result; other workers
+    wait for that result instead of issuing their own request. The holder
+    extends the lock every third of lock_timeout while its call runs, however
+    long the scheduler retries, so the lock only expires when the holder dies
+    without publishing; a waiter then takes over.
+    """
+
+    LOCK_PREFIX = 'rt_cta:inflight:lock:'
+    RESULT_PREFIX = 'rt_cta:inflight:result:'
+
+    def __init__(self, redis_client, lock_timeout=None, wait_timeout=None, result_ttl=60, poll_interval=0.05):
+        super().__init__()
+        self.redis = redis_client
+        self.lock_timeout = lock_timeout if lock_timeout is not None else settings.GROQ_SINGLE_FLIGHT_LOCK_TIMEOUT
+        self.wait_timeout = wait_timeout if wait_timeout is not None else settings.GROQ_SINGLE_FLIGHT_WAIT_TIMEOUT
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+
+    def _run(self, key, fn):
+        lock_key = self.LOCK_PREFIX + key
+        result_key = self.RESULT_PREFIX + key
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+
+        while True:
+            try:
+                acquired = self.redis.set(lock_key, token, nx=True, ex=self.lock_timeout)
+            except Exception as e:
+                logger.error(f"Single-flight Redis lock failed, calling upstream directly: {str(e)}")
+                return fn()
+
+            if acquired:
+                stop = threading.Event()
+                threading.Thread(target=self._hold, args=(lock_key, token, stop), daemon=True).start()
+                try:
+                    result = fn()
+                    self.redis.set(result_key, json.dumps(result), ex=self.result_ttl)
+                    return result
+                finally:
+                    stop.set()
+                    self._release(lock_key, token)
+
+            # Another worker is already calling upstream; wait for its result
+            while time.monotonic() < deadline:
+                try:
+                    raw = self.redis.get(result_key)
+                    held = raw is None and self.redis.exists(lock_key)
+                except Exception as e:
+                    logger.error(f"Single-flight Redis wait failed, calling upstream directly: {str(e)}")
+                    return fn()
+                if raw is not None:
+                    self.coalesced += 1
+                    logger.debug(f"Reused result of another worker for key {key[:12]}")
+                    return json.loads(raw)
+                if not held:
+                    # Holder finished without a result (failed or died); try to take over
+                    break
+                time.sleep(self.poll_interval)
+            else:
+                logger.warning(f"Timed out waiting for in-flight call {key[:12]}, calling upstream directly")
+                return fn()
+
+    def _hold(self, lock_key, token, stop):
+        """Extend the lock while this process owns it, until stop is set"""
+        while not stop.wait(self.lock_timeout / 3):
+            try:
+                with self.redis.pipeline() as pipe:
+                    pipe.watch(lock_key)
+                    if pipe.get(lock_key) != token.encode():
+                        pipe.unwatch()
+                        return
+                    pipe.multi()
+                    pipe.expire(lock_key, self.lock_timeout)
+                    pipe.execute()
+            except Exception as e:
+                logger.debug(f"Could not extend single-flight lock: {str(e)}")
+
+    def _release(self, lock_key, token):
+        """Delete the lock only if this process still owns it"""
+        try:
+            with self.redis.pipeline() as pipe:
+                pipe.watch(lock_key)
+                if pipe.get(lock_key) == token.encode():
+                    pipe.multi()
+                    pipe.delete(lock_key)
+                    pipe.execute()
+                else:
+                    pipe.unwatch()
+        except Exception as e:
+            logger.debug(f"Could not release single-flight lock: {str(e)}")
+
+_single_flight = None
+
+def get_single_flight():
+    """Return the process-wide single-flight coordinator"""
+    global _single_flight
+    if _single_flight is None:
+        redis_url = settings.GROQ_SINGLE_FLIGHT_REDIS_URL
+        if redis_url:
+            import redis
+            _single_flight = RedisSingleFlight(redis.Redis.from_url(redis_url))
+        else:
+            _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,90 @@
+import logging
+import threading
+from collections import OrderedDict
+from celery.backends.base import KeyValueStoreBackend
+
+logger = logging.getLogger('rt_cta')
+
+class TaskOwners:
+    """
+    Which user enqueued each analysis task
+
+    The task status endpoint takes task ids from the client, so it only
+    reports tasks recorded here for the caller. Owners are stored in the
+    Celery result backend next to the results, and expire with them, when it
+    is a key-value store (Redis, cache); with other backends the last
+    MAX_LOCAL owners are kept in this process.
+    """
+
+    KEY_PREFIX = 'rt-cta-task-owner-'
+    MAX_LOCAL = 10000
+
+    def __init__(self, backend=None):
+        if backend is None:
+            from rt_cta.celery import app
+            backend = app.backend
+        self.backend = backend if isinstance(backend, KeyValueStoreBackend) else None
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, task_ids, user_id):
+        """
+        Remember the user who enqueued tasks
+
+        Args:
+            task_ids (list): Ids of the tasks enqueued
+            user_id (int): The user they belong to
+        """
+        if self.backend is not None:
+            try:
+                for task_id in task_ids:
+                    self.backend.set(self._key(task_id), str(user_id))
+                return
+            except Exception as e:
+                logger.error(f"Could not record task owners in the result backend: {str(e)}")
+
+        with self._lock:
+            for task_id in task_ids:
+                self._local[task_id] = user_id
+                self._local.move_to_end(task_id)
+            while len(self._local) > self.MAX_LOCAL:
+                self._local.popitem(last=False)
+
+    def owned(self, task_ids, user_id):
+        """
+        The tasks among task_ids that user_id enqueued
+
+        Returns:
+            set: Task ids owned by the user
+        """
+        owners = {}
+        if self.backend is not None:
+            try:
+                keys = [self._key(task_id) for task_id in task_ids]
+                values = self.backend.mget(keys)
+                if hasattr(values, 'items'):
+                    values = [values.get(key) for key in keys]
+                owners = dict(zip(task_ids, values))
+            except Exception as e:
+                logger.error(f"Could not read task owners from the result backend: {str(e)}")
+        with self._lock:
+            for task_id in task_ids:
+                if owners.get(task_id) is None:
+                    owners[task_id] = self._local.get(task_id)
+
+        return {
+            task_id for task_id, owner in owners.items()
+            if owner is not None and int(owner) == user_id
+        }
+
+    def _key(self, task_id):
+        return f"{self.KEY_PREFIX}{task_id}"
+
+_task_owners = None
+
+def get_task_owners():
+    """Return the process-wide task owner registry"""
+    global _task_owners
+    if _task_owners is None:
+        _task_owners = TaskOwners()
+    return _task_owners
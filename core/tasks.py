@@ -1,9 +1,24 @@
 import json
+import time
+import inspect
 import logging
 from celery import shared_task
-from .groq_utils import GroqClient
+from .groq_utils import get_groq_client
+from .triage import get_triage_engine, heuristic_verdict, normalize_level
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .chunking import needs_chunking, chunk_text, analyze_chunks, reduce_verdicts, merge_verdicts, verdict_confidence
+from .log_templates import get_log_template_miner, mine_repetitive, analyze_digests
+from .near_duplicate import get_near_duplicate_index, reusable
+from .conversation import format_message, update_conversation
+from .blob_store import get_blob_store, is_blob_key
+from .notifications import get_notification_outbox, publish_dashboard_delta
+from .dashboard import threat_delta
 from .models import ThreatDetection, AnalysisSession, ThreatLevel
+from text_analysis.models import TextSource, TextThreatDetection
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
 import base64
 import io
 from PIL import Image
@@ -11,17 +26,22 @@ import cv2
 import numpy as np
 
 logger = logging.getLogger('rt_cta')
-groq_client = GroqClient()
+groq_client = get_groq_client()
+
+# Failures that mean Groq itself is unavailable and the task should degrade
+GROQ_UNAVAILABLE = (CircuitOpenError,) + CircuitBreaker.OUTAGE_ERRORS
 
 @shared_task
-def process_visual_analysis(image_data, user_id, session_id=None):
+def process_visual_analysis(image_data, user_id, session_id=None, finalize_session=True):
     """
     Process visual data for threat analysis
     
     Args:
-        image_data (str): Base64 encoded image data
+        image_data (str): Blob store key of the image, or base64 encoded image data
         user_id (int): User ID who initiated the analysis
         session_id (int, optional): Analysis session ID
+        finalize_session (bool): Whether this task sets the session status;
+            off when a multimodal chord callback finalizes the session
         
     Returns:
         dict: Analysis results
@@ -44,8 +64,7 @@ def process_visual_analysis(image_data, user_id, session_id=None):
             )
         
         # Process image data
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes))
+        image = _load_image(image_data)
         
         # Convert to OpenCV format
         cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
@@ -65,6 +84,7 @@ def process_visual_analysis(image_data, user_id, session_id=None):
         }
         
         # If a threat is detected, save it
+        threat = None
         if analysis_result["threat_detected"]:
             threat = ThreatDetection.objects.create(
                 user=user,
@@ -75,28 +95,33 @@ def process_visual_analysis(image_data, user_id, session_id=None):
             )
         
         # Update session status
-        session.status = 'completed'
-        session.save()
+        _set_session_status(session, 'completed', finalize_session)
         
-        return analysis_result
+        return _with_threat_ids(analysis_result, [threat])
     
     except Exception as e:
         logger.error(f"Error in visual analysis task: {str(e)}")
         if session:
-            session.status = 'failed'
-            session.save()
+            _set_session_status(session, 'failed', finalize_session)
         return {"error": str(e)}
 
 @shared_task
-def process_audio_analysis(audio_data, transcription, user_id, session_id=None):
+def process_audio_analysis(audio_data, transcription, user_id, session_id=None, degraded_threat_ids=None,
+                           finalize_session=True, requeues=0):
     """
     Process audio data for threat analysis
     
     Args:
-        audio_data (str): Base64 encoded audio data
+        audio_data (str): Blob store key of the audio, or base64 encoded audio data
         transcription (str): Transcribed text from audio
         user_id (int): User ID who initiated the analysis
         session_id (int, optional): Analysis session ID
+        degraded_threat_ids (list, optional): Degraded verdicts from an earlier
+            run while Groq was unavailable, replaced by this full analysis
+        finalize_session (bool): Whether this task sets the session status;
+            off when a multimodal chord callback finalizes the session
+        requeues (int): How often this analysis was already put off while
+            Groq was unavailable
         
     Returns:
         dict: Analysis results
@@ -118,49 +143,73 @@ def process_audio_analysis(audio_data, transcription, user_id, session_id=None):
                 status='processing'
             )
         
-        # Use Groq for analysis of the transcription
-        analysis_result = groq_client.analyze_audio(transcription)
+        # Use local triage rules, then Groq for analysis of the transcription
+        analysis_result = _triage(transcription)
+        if analysis_result is None:
+            try:
+                analysis_result = groq_client.analyze_audio(transcription)
+            except GROQ_UNAVAILABLE:
+                # Groq is unavailable: answer with a local verdict now, analyze fully later
+                analysis_result = heuristic_verdict(transcription)
+                if degraded_threat_ids is None:
+                    threat = _save_verdict(user, analysis_result, "audio")
+                    degraded_threat_ids = [threat.id] if threat else []
+                _requeue_degraded(
+                    process_audio_analysis,
+                    (audio_data, transcription, user_id, session.id),
+                    {'degraded_threat_ids': degraded_threat_ids, 'finalize_session': finalize_session},
+                    requeues
+                )
+                _set_session_status(session, 'degraded', finalize_session)
+                return dict(analysis_result, threat_ids=degraded_threat_ids)
         
         # Parse the JSON result
         if isinstance(analysis_result, str):
             analysis_result = json.loads(analysis_result)
         
+        # A full verdict supersedes the degraded one from an earlier run
+        _discard_degraded(degraded_threat_ids)
+        
         # If a threat is detected, save it
-        if analysis_result.get("threat_detected", False):
-            threat = ThreatDetection.objects.create(
-                user=user,
-                threat_level=analysis_result["threat_level"],
-                description=analysis_result["description"],
-                source_type="audio",
-                confidence_score=analysis_result["confidence_score"]
-            )
+        threat = _save_verdict(user, analysis_result, "audio")
         
         # Update session status
-        session.status = 'completed'
-        session.save()
+        _set_session_status(session, 'completed', finalize_session)
         
-        return analysis_result
+        return _with_threat_ids(analysis_result, [threat])
     
     except Exception as e:
         logger.error(f"Error in audio analysis task: {str(e)}")
         if session:
-            session.status = 'failed'
-            session.save()
+            _set_session_status(session, 'failed', finalize_session)
         return {"error": str(e)}
 
 @shared_task
-def process_text_analysis(text, user_id, session_id=None):
+def process_text_analysis(text, user_id, session_id=None, degraded_threat_ids=None, source_type=None,
+                          finalize_session=True, requeues=0):
     """
     Process text data for threat analysis
     
     Args:
-        text (str): Text to analyze
+        text (str or list): Text to analyze, or a list of short texts (log
+            lines, chat messages) to analyze together in batched requests
         user_id (int): User ID who initiated the analysis
         session_id (int, optional): Analysis session ID
+        degraded_threat_ids (list, optional): Degraded verdicts from an earlier
+            run while Groq was unavailable, replaced by this full analysis
+        source_type (str, optional): Kind of text (chat, log, email). Chat
+            messages are analyzed incrementally against the conversation
+            state kept on the session
+        finalize_session (bool): Whether this task sets the session status;
+            off when a multimodal chord callback finalizes the session
+        requeues (int): How often this analysis was already put off while
+            Groq was unavailable
         
     Returns:
-        dict: Analysis results
+        dict: Analysis results (a list of results when a list of texts is
+        given, except for chat messages which get one conversation verdict)
     """
+    session = None
     try:
         logger.info(f"Processing text analysis for user {user_id}")
         
@@ -168,9 +217,8 @@ def process_text_analysis(text, user_id, session_id=None):
         user = User.objects.get(id=user_id)
         
         # Create or get session
-        session = None
         if session_id:
-            session = AnalysisSession.objects.get(id=session_id)
+            session = AnalysisSession.objects.get(id=session_id, user=user)
         else:
             session = AnalysisSession.objects.create(
                 user=user,
@@ -178,32 +226,744 @@ def process_text_analysis(text, user_id, session_id=None):
                 status='processing'
             )
         
-        # Use Groq for analysis
-        analysis_result = groq_client.analyze_text(text)
+        chunk_results = None
+        template_results = None
+        incremental_chat = source_type == 'chat' and settings.CHAT_INCREMENTAL_ENABLED
+        try:
+            if incremental_chat:
+                # Only the new messages and the session's rolling summary are sent, not the whole conversation
+                messages = text if isinstance(text, (list, tuple)) else [text]
+                analysis_result = update_conversation(session, messages, groq_client.analyze_conversation)
+            # Many short texts share batched requests instead of one call each
+            elif isinstance(text, (list, tuple)):
+                analysis_results = [_triage(item) or _near_duplicate(item, user.id) for item in text]
+                pending = [index for index, result in enumerate(analysis_results) if result is None]
+                if pending:
+                    batch_results = groq_client.analyze_text_batch([text[index] for index in pending])
+                    for index, result in zip(pending, batch_results):
+                        analysis_results[index] = result
+            else:
+                # Use local triage rules, then Groq for analysis
+                analysis_result = _triage(text)
+                digest = None
+                if analysis_result is None:
+                    digest = mine_repetitive(get_log_template_miner(), text)
+                if analysis_result is None and digest is None:
+                    # A close match of an earlier text reuses its verdict
+                    analysis_result = _near_duplicate(text, user.id)
+                if digest is not None:
+                    # Repetitive logs: only new or rare templates are sent to Groq
+                    [template_results] = analyze_digests([digest], groq_client.analyze_text_batch)
+                    analysis_result = merge_verdicts([verdict for _, verdict in template_results])
+                    analysis_result["log_templates"] = {
+                        "lines": digest.line_count,
+                        "templates": len(digest.groups),
+                        "sent_to_llm": len(digest.pending),
+                    }
+                elif analysis_result is None and needs_chunking(text):
+                    # Long dumps are split into chunks analyzed concurrently, then reduced
+                    chunks = chunk_text(text)
+                    chunk_results, stopped_early = analyze_chunks(chunks, _analyze_chunk)
+                    analysis_result = reduce_verdicts(chunk_results, len(chunks), stopped_early)
+                elif analysis_result is None and settings.GROQ_STREAMING_ENABLED:
+                    # Stream the completion so the threat level reaches the client before the full description
+                    analysis_result = groq_client.analyze_text_stream(
+                        text,
+                        on_update=lambda fields: _push_early_update(user.id, session.id, "text", fields)
+                    )
+                elif analysis_result is None:
+                    analysis_result = groq_client.analyze_text(text)
+        except GROQ_UNAVAILABLE:
+            # Groq is unavailable: answer with local verdicts now, analyze fully later
+            items = text if isinstance(text, (list, tuple)) else [text]
+            degraded_results = [heuristic_verdict(item) for item in items]
+            if degraded_threat_ids is None:
+                threats = [_save_verdict(user, result, "text") for result in degraded_results]
+                degraded_threat_ids = [threat.id for threat in threats if threat]
+            _requeue_degraded(
+                process_text_analysis,
+                (text, user_id, session.id),
+                {'degraded_threat_ids': degraded_threat_ids, 'source_type': source_type,
+                 'finalize_session': finalize_session},
+                requeues
+            )
+            _set_session_status(session, 'degraded', finalize_session)
+            if incremental_chat:
+                return dict(merge_verdicts(degraded_results), threat_ids=degraded_threat_ids)
+            degraded_results = _with_degraded_threat_ids(degraded_results, degraded_threat_ids)
+            return degraded_results if isinstance(text, (list, tuple)) else degraded_results[0]
         
-        # Parse the JSON result
-        if isinstance(analysis_result, str):
-            analysis_result = json.loads(analysis_result)
+        # A full verdict supersedes the degraded one from an earlier run
+        _discard_degraded(degraded_threat_ids)
         
-        # If a threat is detected, save it
-        if analysis_result.get("threat_detected", False):
-            threat = ThreatDetection.objects.create(
+        if incremental_chat:
+            threat = _save_chat_verdict(user, session, messages, analysis_result)
+            # The conversation goes on; later messages continue this session
+            _set_session_status(session, 'active', finalize_session)
+            return _with_threat_ids(analysis_result, [threat])
+        
+        if isinstance(text, (list, tuple)):
+            saved = [
+                _save_text_verdict(user, session, item, result, source_type or 'text')
+                for item, result in zip(text, analysis_results)
+            ]
+            for item, (result, _) in zip(text, saved):
+                _index_verdict(item, result, user.id)
+            _set_session_status(session, 'completed', finalize_session)
+            return [_with_threat_ids(result, [threat]) for result, threat in saved]
+        
+        if template_results is not None:
+            threats = _save_template_verdicts(user, session, digest, template_results)
+        elif chunk_results is not None:
+            threats = _save_chunk_verdicts(user, session, text, chunk_results, source_type or 'text',
+                                           {'reusable': reusable(analysis_result)})
+            _index_verdict(text, analysis_result, user.id)
+        else:
+            analysis_result, threat = _save_text_verdict(user, session, text, analysis_result, source_type or 'text')
+            threats = [threat]
+            _index_verdict(text, analysis_result, user.id)
+        
+        # Update session status
+        _set_session_status(session, 'completed', finalize_session)
+        
+        return _with_threat_ids(analysis_result, threats)
+    
+    except Exception as e:
+        logger.error(f"Error in text analysis task: {str(e)}")
+        if session:
+            _set_session_status(session, 'failed', finalize_session)
+        return {"error": str(e)}
+
+# Task of each modality a multimodal chord can include
+MODALITY_TASKS = {
+    'text': process_text_analysis,
+    'visual': process_visual_analysis,
+    'audio': process_audio_analysis,
+}
+
+@shared_task
+def process_text_analysis_batch(texts, user_id, session_id=None, source_type=None, degraded_source_ids=None,
+                                requeues=0):
+    """
+    Analyze many independent texts in one task and store them in bulk
+
+    Texts go through local triage and near-duplicate reuse, then the rest
+    share packed Groq requests (several in flight at once). All sources and
+    threats are written with bulk_create in a single transaction.
+
+    Args:
+        texts (list[str]): Texts to analyze, each judged on its own
+        user_id (int): User ID who initiated the analysis
+        session_id (int, optional): Analysis session ID
+        source_type (str, optional): Kind of text (chat, log, email) stored on the sources
+        degraded_source_ids (list, optional): Sources stored with degraded
+            verdicts by an earlier run while Groq was unavailable, replaced by
+            this full analysis
+        requeues (int): How often this analysis was already put off while
+            Groq was unavailable
+
+    Returns:
+        list: One analysis result per text, in input order
+    """
+    session = None
+    try:
+        logger.info(f"Processing batch text analysis of {len(texts)} texts for user {user_id}")
+        
+        user = User.objects.get(id=user_id)
+        if session_id:
+            session = AnalysisSession.objects.get(id=session_id, user=user)
+        else:
+            session = AnalysisSession.objects.create(
                 user=user,
-                threat_level=analysis_result["threat_level"],
-                description=analysis_result["description"],
-                source_type="text",
-                confidence_score=analysis_result["confidence_score"]
+                session_type='text',
+                status='processing'
             )
         
-        # Update session status
-        session.status = 'completed'
+        analysis_results = [_triage(text) or _near_duplicate(text, user.id) for text in texts]
+        pending = [index for index, result in enumerate(analysis_results) if result is None]
+        degraded = False
+        if pending:
+            try:
+                batch_results = groq_client.analyze_text_batch([texts[index] for index in pending])
+            except GROQ_UNAVAILABLE:
+                # Groq is unavailable: local verdicts now, the texts that needed Groq are analyzed fully later
+                batch_results = [heuristic_verdict(texts[index]) for index in pending]
+                degraded = True
+            for index, result in zip(pending, batch_results):
+                analysis_results[index] = json.loads(result) if isinstance(result, str) else result
+        
+        with transaction.atomic():
+            if degraded_source_ids:
+                # Sources and their (degraded) threats from the earlier run are superseded
+                TextSource.objects.filter(id__in=degraded_source_ids, session=session).delete()
+            sources, threats = _bulk_save_text_verdicts(user, session, texts, analysis_results, source_type or 'text')
+        
+        if degraded:
+            _requeue_degraded(
+                process_text_analysis_batch,
+                ([texts[index] for index in pending], user_id, session.id),
+                {'source_type': source_type, 'degraded_source_ids': [sources[index].id for index in pending]},
+                requeues
+            )
+            session.status = 'degraded'
+        else:
+            for text, result in zip(texts, analysis_results):
+                _index_verdict(text, result, user.id)
+            session.status = 'completed'
         session.save()
         
-        return analysis_result
+        threat_ids = {threat.source_id: threat.id for threat in threats}
+        return [
+            dict(result, threat_ids=[threat_ids[source.id]] if source.id in threat_ids else [])
+            for source, result in zip(sources, analysis_results)
+        ]
     
     except Exception as e:
-        logger.error(f"Error in text analysis task: {str(e)}")
+        logger.error(f"Error in batch text analysis task: {str(e)}")
         if session:
             session.status = 'failed'
             session.save()
-        return {"error": str(e)} 
\ No newline at end of file
+        return {"error": str(e)}
+
+@shared_task
+def analyze_modality(modality, args, dispatched_at=None):
+    """
+    Chord member of a multimodal analysis: run one modality's task inline
+
+    The session is left for finalize_multimodal_analysis to finalize.
+
+    Args:
+        modality (str): 'text', 'visual' or 'audio'
+        args (list): Positional arguments of that modality's task
+        dispatched_at (float, optional): Epoch time the chord was sent, to measure queueing
+
+    Returns:
+        dict: {"modality", "result", "queue_ms", "latency_ms"}
+    """
+    started = time.time()
+    try:
+        result = MODALITY_TASKS[modality](*args, finalize_session=False)
+    except Exception as e:
+        logger.error(f"Error in {modality} part of multimodal analysis: {str(e)}")
+        result = {"error": str(e)}
+    return {
+        "modality": modality,
+        "result": result,
+        "queue_ms": int((started - dispatched_at) * 1000) if dispatched_at else None,
+        "latency_ms": int((time.time() - started) * 1000),
+    }
+
+@shared_task
+def finalize_multimodal_analysis(parts, user_id, session_id):
+    """
+    Chord callback: fuse the per-modality verdicts and finalize the session once
+
+    Stores one multimodal ThreatDetection for the fused verdict, records the
+    per-modality verdicts and latencies in the session metadata and sends a
+    single WebSocket notification. A part degraded while Groq was unavailable
+    is analyzed again by reanalyze_modality, which fuses the session again.
+
+    Args:
+        parts (list): Results of analyze_modality, one per modality
+        user_id (int): User ID who initiated the analysis
+        session_id (int): The multimodal analysis session
+
+    Returns:
+        dict: The fused verdict
+    """
+    with transaction.atomic():
+        session = AnalysisSession.objects.select_for_update().get(id=session_id)
+        if 'multimodal' in session.metadata:
+            # A redelivered callback must not store or notify twice
+            logger.warning(f"Multimodal session {session_id} was already finalized")
+            return session.metadata['multimodal']['verdict']
+        # Full verdicts of degraded parts that were analyzed again before this callback ran
+        reanalyzed = session.metadata.get('multimodal_reanalyzed', {})
+        verdicts = {part["modality"]: reanalyzed.get(part["modality"]) or _part_verdict(part["result"])
+                    for part in parts}
+        fused, status = _fuse_verdicts(verdicts)
+        threat = _save_verdict(session.user, fused, "multimodal") if status != 'failed' else None
+        session.status = status
+        session.end_time = timezone.now()
+        session.metadata = dict(session.metadata, multimodal={
+            "verdict": fused,
+            "modalities": {
+                part["modality"]: dict(
+                    _modality_summary(verdicts[part["modality"]]),
+                    queue_ms=part["queue_ms"],
+                    latency_ms=part["latency_ms"],
+                )
+                for part in parts
+            },
+            "threat_id": threat.id if threat else None,
+        })
+        session.save()
+        _notify_multimodal(user_id, session, fused, threat)
+
+    logger.info(
+        f"Multimodal session {session_id} {status}: {fused['threat_level']} from "
+        + ", ".join(f"{part['modality']} {part['latency_ms']}ms" for part in parts)
+    )
+    return fused
+
+@shared_task
+def reanalyze_modality(modality, args, kwargs):
+    """
+    Requeued part of a multimodal analysis: analyze it again, then refresh the session
+
+    The chord callback fuses whatever verdict each part returned, so a part
+    degraded while Groq was unavailable is analyzed again here and its full
+    verdict replaces the degraded one in the session's fused verdict.
+
+    Args:
+        modality (str): 'text', 'visual' or 'audio'
+        args (list): Positional arguments of that modality's task
+        kwargs (dict): Keyword arguments of that modality's task
+
+    Returns:
+        dict: The modality's verdict
+    """
+    task = MODALITY_TASKS[modality]
+    verdict = _part_verdict(task(*args, **kwargs))
+    if "error" in verdict or verdict.get("degraded"):
+        # Failed, or still degraded and requeued again
+        return verdict
+    session_id = inspect.signature(task.run).bind(*args, **kwargs).arguments['session_id']
+    refinalize_multimodal_analysis(session_id, modality, verdict)
+    return verdict
+
+def refinalize_multimodal_analysis(session_id, modality, verdict):
+    """
+    Replace one modality's verdict in a multimodal session and fuse again
+
+    Before the chord callback has run the verdict is only recorded for it to
+    use; afterwards the fused verdict, its multimodal ThreatDetection and the
+    session status are updated and the user is notified again.
+
+    Args:
+        session_id (int): The multimodal analysis session
+        modality (str): The modality analyzed again
+        verdict (dict): Its full verdict
+    """
+    with transaction.atomic():
+        session = AnalysisSession.objects.select_for_update().get(id=session_id)
+        multimodal = session.metadata.get('multimodal')
+        if multimodal is None:
+            reanalyzed = dict(session.metadata.get('multimodal_reanalyzed', {}), **{modality: verdict})
+            session.metadata = dict(session.metadata, multimodal_reanalyzed=reanalyzed)
+            session.save()
+            return
+
+        summaries = dict(multimodal["modalities"])
+        summaries[modality] = dict(summaries.get(modality, {}), **_modality_summary(verdict))
+        # Sessions finalized before full verdicts were kept only have the summary
+        verdicts = {name: summary.get("verdict") or summary for name, summary in summaries.items()}
+        fused, status = _fuse_verdicts(verdicts)
+
+        if multimodal.get("threat_id"):
+            ThreatDetection.objects.filter(id=multimodal["threat_id"]).delete()
+        threat = _save_verdict(session.user, fused, "multimodal") if status != 'failed' else None
+        session.status = status
+        session.metadata = dict(session.metadata, multimodal=dict(
+            multimodal, verdict=fused, modalities=summaries, threat_id=threat.id if threat else None
+        ))
+        session.save()
+        _notify_multimodal(session.user_id, session, fused, threat)
+
+    logger.info(f"Multimodal session {session_id} refinalized with the full {modality} verdict: {fused['threat_level']}")
+
+def _part_verdict(result):
+    """One verdict from a modality task's result (a JSON string or a list of verdicts for texts)"""
+    if isinstance(result, str):
+        result = json.loads(result)
+    if isinstance(result, list):
+        result = merge_verdicts(result)
+    return result
+
+def _fuse_verdicts(verdicts):
+    """
+    Fuse the per-modality verdicts of a multimodal session
+
+    Returns:
+        tuple: (fused verdict, session status)
+    """
+    usable = [verdict for verdict in verdicts.values() if "error" not in verdict]
+    fused = merge_verdicts(usable)
+    fused["modalities"] = sorted(verdicts)
+    fused["degraded"] = any(verdict.get("degraded") for verdict in usable)
+
+    if not usable:
+        status = 'failed'
+    elif fused["degraded"]:
+        status = 'degraded'
+    else:
+        status = 'completed'
+    return fused, status
+
+def _modality_summary(verdict):
+    """What the session metadata keeps of one modality's verdict"""
+    return {
+        "threat_level": verdict.get("threat_level"),
+        "threat_detected": verdict.get("threat_detected", False),
+        "error": verdict.get("error"),
+        "verdict": verdict,
+    }
+
+def _notify_multimodal(user_id, session, fused, threat):
+    """One WebSocket message for a finalized multimodal session (sent on commit): the threat, or the session outcome"""
+    outbox = get_notification_outbox()
+    if threat is not None:
+        outbox.publish(user_id, 'threat_notification', {
+            'id': threat.id,
+            'level': threat.threat_level,
+            'description': threat.description,
+            'source_type': 'multimodal',
+            'session_id': session.id,
+            'modalities': fused["modalities"],
+            'timestamp': timezone.now().isoformat(),
+            'confidence': threat.confidence_score,
+        })
+    else:
+        outbox.publish(user_id, 'analysis_update', {
+            'type': 'session_update',
+            'session_id': session.id,
+            'source_type': 'multimodal',
+            'status': session.status,
+            'threat_detected': fused["threat_detected"],
+            'threat_level': fused["threat_level"],
+            'timestamp': timezone.now().isoformat(),
+        })
+
+def _load_image(image_data):
+    """Decode an image from a memory-mapped blob, or from inline base64 data"""
+    if not is_blob_key(image_data):
+        return Image.open(io.BytesIO(base64.b64decode(image_data)))
+    with get_blob_store().mmap(image_data) as buffer:
+        image = Image.open(io.BytesIO(buffer) if isinstance(buffer, bytes) else buffer)
+        # Decode now; the mapping is closed on return
+        image.load()
+    return image
+
+def _triage(text):
+    """Return a local verdict when the triage rules are conclusive, or None if the LLM is needed"""
+    engine = get_triage_engine()
+    if engine is None:
+        return None
+    return engine.classify(text).verdict
+
+def _near_duplicate(text, user_id):
+    """Return the verdict of a near-identical earlier text of the user, or None if the text is new"""
+    index = get_near_duplicate_index()
+    if index is None:
+        return None
+    match = index.find(text, user_id)
+    if match is None:
+        return None
+    verdict, similarity = match
+    logger.info(f"Reusing verdict of a near-duplicate text (similarity {similarity:.2f})")
+    return dict(verdict, analysis_tier="near_duplicate", near_duplicate_similarity=round(similarity, 3))
+
+def _index_verdict(text, analysis_result, user_id):
+    """Make a fresh LLM verdict available for near-duplicate reuse by the same user"""
+    index = get_near_duplicate_index()
+    if index is None or not reusable(analysis_result):
+        return
+    index.add(text, analysis_result, user_id)
+
+def _analyze_chunk(chunk):
+    """Map step for one chunk of a long text: local triage, then Groq"""
+    return _triage(chunk) or groq_client.analyze_text(chunk)
+
+def _save_chunk_verdicts(user, session, text, chunk_results, source_type, metadata):
+    """Store a chunked text and one TextThreatDetection per chunk that reported a threat, returning the threats"""
+    source = TextSource.objects.create(session=session, content=text, source_type=source_type, metadata=metadata)
+    threats = []
+    for chunk, verdict in chunk_results:
+        if not verdict.get("threat_detected", False):
+            continue
+        threats.append(TextThreatDetection.objects.create(
+            user=user,
+            threat_level=normalize_level(verdict.get("threat_level")),
+            description=verdict.get("description", ""),
+            source_type="text",
+            confidence_score=verdict_confidence(verdict, 0.5),
+            analysis_tier=verdict.get("analysis_tier", ""),
+            source=source,
+            start_index=chunk.start_index,
+            end_index=chunk.end_index,
+            context=chunk.text,
+            entities=verdict.get("indicators", []),
+        ))
+    return threats
+
+def _save_template_verdicts(user, session, digest, template_results):
+    """Store a mined log text with its template counts and a TextThreatDetection per flagged template; return the threats"""
+    source = TextSource.objects.create(
+        session=session,
+        content=digest.text,
+        source_type='log',
+        metadata={'log_templates': digest.metadata()}
+    )
+    threats = []
+    for group, verdict in template_results:
+        if not verdict.get("threat_detected", False):
+            continue
+        start_index, end_index = group.spans[0]
+        threats.append(TextThreatDetection.objects.create(
+            user=user,
+            threat_level=normalize_level(verdict.get("threat_level")),
+            description=verdict.get("description", ""),
+            source_type="text",
+            confidence_score=verdict_confidence(verdict, 0.5),
+            analysis_tier=verdict.get("analysis_tier", ""),
+            source=source,
+            start_index=start_index,
+            end_index=end_index,
+            context=group.prompt_text(digest.text),
+            entities=verdict.get("indicators", []),
+        ))
+    return threats
+
+def _save_chat_verdict(user, session, messages, analysis_result):
+    """
+    Store new chat messages with the conversation risk, and a TextThreatDetection if the conversation is a threat
+
+    Returns:
+        TextThreatDetection: The threat stored, or None
+    """
+    content = "\n".join(format_message(message) for message in messages)
+    source = TextSource.objects.create(
+        session=session,
+        content=content,
+        source_type='chat',
+        metadata={'conversation': analysis_result["conversation"]}
+    )
+    if not analysis_result.get("threat_detected", False):
+        return None
+    return TextThreatDetection.objects.create(
+        user=user,
+        threat_level=normalize_level(analysis_result.get("threat_level")),
+        description=analysis_result.get("description", ""),
+        source_type="text",
+        confidence_score=verdict_confidence(analysis_result, 0.5),
+        analysis_tier=analysis_result.get("analysis_tier", ""),
+        source=source,
+        start_index=0,
+        end_index=len(content),
+        context=content,
+        entities=analysis_result.get("indicators", []),
+    )
+
+def _bulk_save_text_verdicts(user, session, texts, verdicts, source_type):
+    """
+    Store texts and the threats found in them with one bulk INSERT per table
+    (row by row on databases that cannot return ids from bulk INSERTs)
+
+    Returns:
+        tuple: The created TextSource rows, in input order, and the
+        TextThreatDetection rows
+    """
+    sources = [
+        TextSource(
+            session=session,
+            content=text,
+            source_type=source_type,
+            metadata={'analysis_tier': verdict.get("analysis_tier", ""), 'reusable': reusable(verdict)}
+        )
+        for text, verdict in zip(texts, verdicts)
+    ]
+    if _bulk_returns_ids(TextSource):
+        TextSource.objects.bulk_create(sources)
+    else:
+        for source in sources:
+            source.save(force_insert=True)
+    detections = [
+        TextThreatDetection(
+            user=user,
+            threat_level=normalize_level(verdict.get("threat_level")),
+            description=verdict.get("description", ""),
+            source_type="text",
+            confidence_score=verdict_confidence(verdict, 0.5),
+            analysis_tier=verdict.get("analysis_tier", ""),
+            degraded=verdict.get("degraded", False),
+            source=source,
+            start_index=0,
+            end_index=len(source.content),
+            context=source.content,
+            entities=verdict.get("indicators", []),
+        )
+        for source, verdict in zip(sources, verdicts)
+        if verdict.get("threat_detected", False)
+    ]
+    # bulk inserts send no post_save, so the dashboard gets the whole batch as one change
+    if detections and _bulk_create_inherited(TextThreatDetection, detections):
+        publish_dashboard_delta(user.id, threat_delta(detections))
+    logger.info(f"Stored {len(sources)} texts and {len(detections)} threats in session {session.id}")
+    return sources, detections
+
+def _bulk_returns_ids(model):
+    """Whether bulk_create sets the primary keys of a model's new rows on its database"""
+    return connections[router.db_for_write(model)].features.can_return_rows_from_bulk_insert
+
+def _bulk_create_inherited(model, objs):
+    """
+    bulk_create for a model with multi-table inheritance, which Django refuses
+
+    Django only refuses because it cannot get the parent ids back on every
+    database. Where it can, the parent rows are bulk-created first, then the
+    child rows, with their parent pointers set, go through the same batched
+    INSERT that bulk_create uses. Databases that cannot return ids from a
+    bulk INSERT (SQLite before 3.35, MySQL) save the rows one by one instead.
+
+    Returns:
+        bool: True if the rows were inserted in bulk, without post_save
+        signals; False if they were saved one by one and the signals sent
+    """
+    if not _bulk_returns_ids(model):
+        for obj in objs:
+            obj.save(force_insert=True)
+        return False
+
+    alias = router.db_for_write(model)
+    parent = model._meta.pk.remote_field.model
+    parents = parent.objects.using(alias).bulk_create([
+        parent(**{field.attname: getattr(obj, field.attname) for field in parent._meta.concrete_fields})
+        for obj in objs
+    ])
+    for obj, parent_obj in zip(objs, parents):
+        for field in parent._meta.concrete_fields:
+            setattr(obj, field.attname, getattr(parent_obj, field.attname))
+        setattr(obj, model._meta.pk.attname, parent_obj.pk)
+
+    model._base_manager.using(alias)._batched_insert(objs, model._meta.local_concrete_fields, None)
+    for obj in objs:
+        obj._state.adding = False
+        obj._state.db = alias
+    return True
+
+def _push_early_update(user_id, session_id, source_type, fields):
+    """Send the fields extracted so far from a streamed analysis over the user's WebSocket"""
+    outbox = get_notification_outbox()
+    outbox.publish(user_id, 'analysis_update', {
+        'session_id': session_id,
+        'source_type': source_type,
+        'status': 'partial',
+        'threat_detected': fields.get('threat_detected'),
+        'threat_level': fields.get('threat_level'),
+        'confidence': fields.get('confidence_score'),
+        'timestamp': timezone.now().isoformat(),
+    })
+    # Early fields are only worth sending while the rest of the reply streams in,
+    # not at the end of the task
+    transaction.on_commit(outbox.flush)
+
+def _save_text_verdict(user, session, text, analysis_result, source_type):
+    """
+    Parse a text verdict, store the text and a TextThreatDetection if a threat was found
+
+    The source is marked reusable like those of chunked and batched texts, so
+    the near-duplicate index can be warmed from single-text analyses too.
+
+    Returns:
+        tuple: The parsed verdict and the TextThreatDetection stored, or None
+    """
+    # Parse the JSON result
+    if isinstance(analysis_result, str):
+        analysis_result = json.loads(analysis_result)
+    
+    source = TextSource.objects.create(
+        session=session,
+        content=text,
+        source_type=source_type,
+        metadata={'analysis_tier': analysis_result.get("analysis_tier", ""), 'reusable': reusable(analysis_result)}
+    )
+    
+    # If a threat is detected, save it
+    threat = None
+    if analysis_result.get("threat_detected", False):
+        threat = TextThreatDetection.objects.create(
+            user=user,
+            threat_level=normalize_level(analysis_result.get("threat_level")),
+            description=analysis_result.get("description", ""),
+            source_type="text",
+            confidence_score=verdict_confidence(analysis_result, 0.5),
+            analysis_tier=analysis_result.get("analysis_tier", ""),
+            degraded=analysis_result.get("degraded", False),
+            source=source,
+            start_index=0,
+            end_index=len(text),
+            context=text,
+            entities=analysis_result.get("indicators", []),
+        )
+    
+    return analysis_result, threat
+
+def _save_verdict(user, analysis_result, source_type):
+    """Save a ThreatDetection for a parsed verdict if a threat was found"""
+    if not analysis_result.get("threat_detected", False):
+        return None
+    return ThreatDetection.objects.create(
+        user=user,
+        threat_level=analysis_result["threat_level"],
+        description=analysis_result["description"],
+        source_type=source_type,
+        confidence_score=analysis_result["confidence_score"],
+        analysis_tier=analysis_result.get("analysis_tier", ""),
+        degraded=analysis_result.get("degraded", False)
+    )
+
+def _with_threat_ids(verdict, threats):
+    """A verdict as a task returns it: with the ids of the threats stored for it, for the WebSocket push"""
+    return dict(verdict, threat_ids=[threat.id for threat in threats if threat is not None])
+
+def _with_degraded_threat_ids(verdicts, threat_ids):
+    """
+    Degraded verdicts with the ids of their threats
+
+    The threats were stored one per verdict reporting one, in input order;
+    heuristic verdicts are deterministic, so this also holds on a requeued run.
+    """
+    ids = iter(threat_ids)
+    results = []
+    for verdict in verdicts:
+        threat_id = next(ids, None) if verdict.get("threat_detected") else None
+        results.append(dict(verdict, threat_ids=[threat_id] if threat_id is not None else []))
+    return results
+
+def _set_session_status(session, status, finalize_session=True):
+    """Record a task's outcome on its session, unless a chord callback finalizes the session"""
+    if finalize_session:
+        session.status = status
+        session.save()
+
+def _requeue_delay():
+    """Seconds to wait before re-running a degraded analysis, i.e. until the circuit may close"""
+    return (groq_client.circuit_retry_after() or settings.GROQ_BREAKER_OPEN_SECONDS) + 1
+
+def _requeue_degraded(task, args, kwargs, requeues):
+    """
+    Re-run a degraded analysis once the circuit may have closed
+
+    The circuit state is per worker process, so another worker may still see
+    it open; after GROQ_DEGRADED_MAX_REQUEUES attempts the degraded verdict is
+    kept as final instead of requeuing forever.
+
+    Returns:
+        bool: Whether the analysis was requeued
+    """
+    if requeues >= settings.GROQ_DEGRADED_MAX_REQUEUES:
+        logger.warning(f"{task.name}: Groq still unavailable after {requeues} requeues, keeping the degraded verdict")
+        return False
+    kwargs = dict(kwargs, requeues=requeues + 1)
+    if kwargs.get('finalize_session', True):
+        task.apply_async(args, kwargs, countdown=_requeue_delay())
+    else:
+        # Part of a multimodal chord whose callback does not wait for this run
+        modality = next(name for name, member in MODALITY_TASKS.items() if member.name == task.name)
+        reanalyze_modality.apply_async((modality, list(args), kwargs), countdown=_requeue_delay())
+    return True
+
+def _discard_degraded(degraded_threat_ids):
+    """Remove degraded placeholder verdicts once a full analysis is available"""
+    if degraded_threat_ids:
+        ThreatDetection.objects.filter(id__in=degraded_threat_ids, degraded=True).delete()
@@ -1,3 +1,1213 @@
-from django.test import TestCase
+import io
+import os
+import re
+import asyncio
+import json
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+import fakeredis
+import groq
+import httpx
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from celery import states
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from text_analysis.models import TextSource, TextThreatDetection
+from .async_groq_utils import AsyncGroqClient
+from .blob_store import BlobTooLarge, FileSystemBlobStore, MediaBlobStore, blob_key
+from .chunking import analyze_chunks, chunk_text, merge_verdicts, reduce_verdicts
+from .conversation import update_conversation
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+from .consumers import NotificationCoalescer, Subscription, ThreatNotificationConsumer
+from .dashboard import dashboard_snapshot, merge_delta
+from .groq_utils import GroqClient, GroqClientPool, GroqPoolMember
+from .ingest import MicroBatcher, iter_records
+from .log_templates import LogTemplateMiner, analyze_digests, mine_repetitive
+from .models import ThreatDetection, AnalysisSession
+from .near_duplicate import MinHashIndex, reusable
+from .notifications import NotificationOutbox, summarize_outcome
+from .prompts import CompactPromptFormat, StreamingVerdictParser, clean_input
+from .rate_limit import RateLimitScheduler
+from .replay import ReplayBuffer
+from .singleflight import SingleFlight
+from .tasks import (
+    finalize_multimodal_analysis, process_text_analysis, process_text_analysis_batch, refinalize_multimodal_analysis
+)
+from .triage import CLEARLY_BENIGN, CLEARLY_MALICIOUS, NEEDS_LLM, TriageEngine
+from .verdict_cache import VerdictCache
 
-# Create your tests here.
+VERDICT = {"threat_detected": True, "threat_level": "HIGH", "confidence_score": 0.9, "description": "phishing"}
+
+class FakeClock:
+    """A time.monotonic stand-in the test moves forward"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def completion(content):
+    """A chat completion as the Groq SDK returns it"""
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+def streamed(content, size=8):
+    """A streamed chat completion, in chunks of size characters"""
+    return [
+        SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content[start:start + size]))])
+        for start in range(0, len(content), size)
+    ]
+
+def verdict(level='LOW', confidence=0.95, **fields):
+    return dict({"threat_detected": level != 'LOW', "threat_level": level, "confidence_score": confidence,
+                 "threat_type": "none" if level == 'LOW' else "phishing", "description": "d", "indicators": []},
+                **fields)
+
+class FakeCompletions:
+    """Stands in for a groq.Client, answering every chat completion with reply(request)"""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.requests = []
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, **request):
+        self.requests.append(request)
+        return self.reply(request)
+
+def user_message(request):
+    return request['messages'][-1]['content']
+
+def numbered(request):
+    """The (number, text) items of a batched request"""
+    return re.findall(r'^\s*\[(\d+)\] (.*)$', user_message(request), re.MULTILINE)
+
+def rate_limit_error(retry_after=None):
+    headers = {'retry-after': str(retry_after)} if retry_after is not None else {}
+    response = httpx.Response(429, headers=headers, request=httpx.Request('POST', 'https://groq.test'))
+    return groq.RateLimitError("rate limited", response=response, body=None)
+
+def fake_groq_client(reply, **kwargs):
+    """A GroqClient with its own cache, scheduler and breaker, answering with reply(request)"""
+    client = GroqClient(api_key='test', cache=VerdictCache(redis_url=''), single_flight=SingleFlight(),
+                        scheduler=RateLimitScheduler(limits={'default': {'rpm': 1000, 'tpm': 10 ** 7}}),
+                        breaker=CircuitBreaker(), **kwargs)
+    client.client = FakeCompletions(reply)
+    return client
+
+def fake_replay_buffer(size=500):
+    with mock.patch('redis.Redis.from_url', return_value=fakeredis.FakeRedis()):
+        return ReplayBuffer(size=size, ttl=60, redis_url='redis://replay')
+
+class VerdictCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('core.verdict_cache.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = VerdictCache(max_entries=2, ttl=60, redis_url='')
+
+    def test_miss_then_hit(self):
+        key = VerdictCache.make_key("Verify your  password", "llama3-70b-8192", "v1")
+        self.assertIsNone(self.cache.get(key))
+        self.assertTrue(self.cache.set(key, VERDICT))
+        self.assertEqual(self.cache.get(key), VERDICT)
+        stats = self.cache.stats()['process']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_key_ignores_whitespace_but_not_model(self):
+        key = VerdictCache.make_key("Verify your  password", "llama3-70b-8192", "v1")
+        self.assertEqual(key, VerdictCache.make_key(" Verify your password\n", "llama3-70b-8192", "v1"))
+        self.assertNotEqual(key, VerdictCache.make_key("Verify your password", "llama3-8b-8192", "v1"))
+
+    def test_entries_expire_after_ttl(self):
+        self.cache.set('key', VERDICT)
+        self.clock.now += 59
+        self.assertEqual(self.cache.get('key'), VERDICT)
+        self.clock.now += 2
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.set('a', VERDICT)
+        self.cache.set('b', VERDICT)
+        self.cache.get('a')
+        self.cache.set('c', VERDICT)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), VERDICT)
+
+    def test_replies_that_are_not_verdicts_are_not_cached(self):
+        self.assertFalse(self.cache.set('key', "not json"))
+        self.assertFalse(self.cache.set('key', {"threat_detected": True}))
+        self.assertIsNone(self.cache.get('key'))
+
+class GroqBatchTests(SimpleTestCase):
+    def batch_reply(self, skip=()):
+        def reply(request):
+            items = numbered(request)
+            if not items:
+                return completion(json.dumps(verdict('MEDIUM')))
+            return completion(json.dumps([dict(verdict('HIGH' if 'invoice' in text else 'LOW'), id=int(number))
+                                          for number, text in items if int(number) not in skip]))
+        return reply
+
+    def test_texts_share_one_request_and_come_back_in_order(self):
+        client = fake_groq_client(self.batch_reply())
+        results = client.analyze_text_batch(["hello", "pay this invoice now", "lunch?"])
+        self.assertEqual(len(client.client.requests), 1)
+        self.assertEqual([json.loads(result)["threat_level"] for result in results], ['LOW', 'HIGH', 'LOW'])
+
+    def test_unanswered_items_fall_back_to_single_analysis(self):
+        client = fake_groq_client(self.batch_reply(skip={2}))
+        results = client.analyze_text_batch(["hello", "pay this invoice now", "lunch?"])
+        self.assertEqual(len(client.client.requests), 2)
+        self.assertEqual(json.loads(results[1])["threat_level"], 'MEDIUM')
+
+    @override_settings(GROQ_BATCH_MAX_ITEMS=2)
+    def test_large_batches_are_split(self):
+        client = fake_groq_client(self.batch_reply())
+        results = client.analyze_text_batch([f"message {index}" for index in range(5)])
+        self.assertEqual(len(client.client.requests), 3)
+        self.assertEqual(len(results), 5)
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def fn():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return VERDICT
+
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', fn)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flight.do('key', fn))) for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        while flight.coalesced < 3:
+            pass
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [VERDICT] * 4)
+
+    def test_error_reaches_every_caller_and_key_is_released(self):
+        flight = SingleFlight()
+        with self.assertRaises(ValueError):
+            flight.do('key', mock.Mock(side_effect=ValueError("boom")))
+        self.assertEqual(flight.do('key', lambda: VERDICT), VERDICT)
+
+TRIAGE_RULES = {
+    "malicious_keywords": {"mimikatz": "CRITICAL", "xmrig": "HIGH"},
+    "malicious_patterns": [{"name": "pipe_to_shell", "pattern": "curl\\s+\\S+\\s*\\|\\s*sh",
+                            "threat_level": "HIGH", "threat_type": "malware"}],
+    "suspicious_keywords": ["password"],
+    "suspicious_patterns": ["https?://"],
+    "benign_items": ["chrome.exe", "explorer.exe"],
+    "benign_patterns": ["Last login: .*"],
+}
+
+def triage_rules_file(rules=TRIAGE_RULES):
+    handle, path = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(handle, 'w') as f:
+        json.dump(rules, f)
+    return path
+
+class TriageEngineTests(SimpleTestCase):
+    def setUp(self):
+        path = triage_rules_file()
+        self.addCleanup(os.remove, path)
+        self.engine = TriageEngine(rules_file=path)
+
+    def test_known_indicators_are_malicious_at_their_worst_level(self):
+        result = self.engine.classify("ran xmrig, then mimikatz.exe")
+        self.assertEqual(result.decision, CLEARLY_MALICIOUS)
+        self.assertEqual(result.verdict["threat_level"], "CRITICAL")
+        self.assertEqual(self.engine.classify("curl http://x.sh | sh").verdict["threat_type"], "malware")
+
+    def test_keywords_match_whole_words_only(self):
+        self.assertEqual(self.engine.classify("notmimikatzing").decision, NEEDS_LLM)
+
+    def test_allow_listed_input_is_benign(self):
+        result = self.engine.classify("chrome.exe, explorer.exe\nLast login: Mon Jan  1 10:00:00 on tty1")
+        self.assertEqual(result.decision, CLEARLY_BENIGN)
+        self.assertFalse(result.verdict["threat_detected"])
+
+    def test_suspicious_or_unknown_input_goes_to_the_llm(self):
+        self.assertEqual(self.engine.classify("chrome.exe, password").decision, NEEDS_LLM)
+        self.assertEqual(self.engine.classify("chrome.exe, unknown.exe").decision, NEEDS_LLM)
+        self.assertEqual(self.engine.stats()['llm_bypass_rate'], 0.0)
+
+class TriageBypassTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('analyst', password='pw')
+        path = triage_rules_file()
+        self.addCleanup(os.remove, path)
+        for target, value in (('core.triage._triage_engine', TriageEngine(rules_file=path)),
+                              ('core.tasks.groq_client', mock.Mock())):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @override_settings(TRIAGE_ENABLED=True)
+    def test_conclusive_triage_skips_groq(self):
+        from . import tasks
+        result = process_text_analysis("dumped creds with mimikatz", self.user.id)
+        self.assertEqual(result["threat_level"], "CRITICAL")
+        self.assertEqual(result["triage"], CLEARLY_MALICIOUS)
+        tasks.groq_client.analyze_text.assert_not_called()
+        self.assertEqual(ThreatDetection.objects.get(user=self.user).threat_level, "CRITICAL")
+
+@override_settings(GROQ_CASCADE_ENABLED=True, GROQ_SMALL_MODEL='small', GROQ_LARGE_MODEL='large')
+class CascadeTests(SimpleTestCase):
+    def cascade_reply(self, small, large=None):
+        def reply(request):
+            answer = small if request['model'] == 'small' else large
+            return completion(json.dumps(answer))
+        return reply
+
+    def test_confident_small_model_verdict_is_final(self):
+        client = fake_groq_client(self.cascade_reply(verdict('LOW', 0.95)))
+        result = json.loads(client.analyze_text("see you at lunch"))
+        self.assertEqual(result["analysis_tier"], "small")
+        self.assertEqual([request['model'] for request in client.client.requests], ['small'])
+
+    def test_uncertain_verdict_escalates_to_the_large_model(self):
+        client = fake_groq_client(self.cascade_reply(verdict('MEDIUM', 0.5), verdict('HIGH', 0.9)))
+        result = json.loads(client.analyze_text("your account is locked, click here"))
+        self.assertEqual((result["threat_level"], result["analysis_tier"]), ("HIGH", "large"))
+        self.assertEqual([request['model'] for request in client.client.requests], ['small', 'large'])
+
+    def test_severe_verdict_escalates_however_confident(self):
+        client = fake_groq_client(self.cascade_reply(verdict('CRITICAL', 0.99), verdict('HIGH', 0.9)))
+        self.assertEqual(json.loads(client.analyze_text("wire the money"))["analysis_tier"], "large")
+
+    def test_escalated_items_of_a_batch_go_to_the_large_model_together(self):
+        def reply(request):
+            level = 'LOW' if request['model'] == 'small' else 'HIGH'
+            items = [dict(verdict(level, 0.5 if 'link' in text else 0.95), id=int(number))
+                     for number, text in numbered(request)]
+            return completion(json.dumps(items))
+        client = fake_groq_client(reply)
+        results = [json.loads(result) for result in client.analyze_text_batch(["hi", "click the link", "a link"])]
+        self.assertEqual([result["analysis_tier"] for result in results], ["small", "large", "large"])
+        self.assertEqual([request['model'] for request in client.client.requests], ['small', 'large'])
+
+@override_settings(GROQ_PROMPT_MODE='full')
+class StreamingTests(SimpleTestCase):
+    def test_threat_level_is_reported_before_the_reply_ends(self):
+        reply = json.dumps(verdict('HIGH', 0.9, description="a long description " * 20))
+        chunks = streamed(reply)
+        seen = []
+
+        def stream():
+            for index, chunk in enumerate(chunks):
+                seen.append(index)
+                yield chunk
+
+        updates = []
+        client = fake_groq_client(lambda request: stream())
+        result = client.analyze_text_stream("urgent: verify your account", on_update=lambda fields: updates.append(
+            (dict(fields), len(seen))))
+
+        self.assertEqual(json.loads(result)["threat_level"], "HIGH")
+        [(fields, chunks_read)] = updates
+        self.assertEqual((fields["threat_detected"], fields["threat_level"]), (True, "HIGH"))
+        self.assertLess(chunks_read, len(chunks) // 2)
+        self.assertTrue(client.client.requests[0]["stream"])
+
+    def test_streamed_verdict_is_cached(self):
+        client = fake_groq_client(lambda request: iter(streamed(json.dumps(verdict('LOW')))))
+        first = client.analyze_text_stream("hello")
+        self.assertEqual(client.analyze_text_stream("hello"), first)
+        self.assertEqual(len(client.client.requests), 1)
+
+    @override_settings(GROQ_CASCADE_ENABLED=True, GROQ_SMALL_MODEL='small', GROQ_LARGE_MODEL='large')
+    def test_only_escalated_texts_are_streamed(self):
+        def reply(request):
+            if request.get('stream'):
+                return iter(streamed(json.dumps(verdict('HIGH'))))
+            return completion(json.dumps(verdict('LOW', 0.95 if 'lunch' in user_message(request) else 0.5)))
+        client = fake_groq_client(reply)
+        self.assertEqual(json.loads(client.analyze_text_stream("lunch at noon?"))["analysis_tier"], "small")
+        self.assertEqual(json.loads(client.analyze_text_stream("verify your account"))["analysis_tier"], "large")
+        self.assertEqual([(request['model'], request.get('stream', False)) for request in client.client.requests],
+                         [('small', False), ('small', False), ('large', True)])
+
+class RateLimitSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('core.rate_limit.time', SimpleNamespace(monotonic=self.clock, time=self.clock,
+                                                                     sleep=self.clock.sleep))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.scheduler = RateLimitScheduler(limits={'default': {'rpm': 2, 'tpm': 100}}, max_retries=2)
+
+    def test_waits_for_the_oldest_request_to_leave_the_window(self):
+        self.scheduler.acquire(10, 'model')
+        self.clock.now += 20
+        self.scheduler.acquire(10, 'model')
+        self.scheduler.acquire(10, 'model')
+        self.assertEqual(self.clock.now, 1060)
+
+    def test_token_budget_is_kept_per_model(self):
+        self.scheduler.acquire(70, 'model')
+        self.scheduler.acquire(40, 'other-model')
+        self.assertEqual(self.clock.now, 1000)
+        self.scheduler.acquire(40, 'model')
+        self.assertEqual(self.clock.now, 1060)
+
+    def test_call_waits_for_budget(self):
+        for _ in range(2):
+            self.scheduler.call(lambda: 'ok', 10, 'model')
+        self.assertEqual(self.scheduler.call(lambda: 'ok', 10, 'model'), 'ok')
+        self.assertEqual(self.clock.now, 1060)
+
+    def test_retry_after_pauses_every_request(self):
+        fn = mock.Mock(side_effect=[rate_limit_error(retry_after=7), 'ok'])
+        self.assertEqual(self.scheduler.call(fn, 10, 'model'), 'ok')
+        self.assertEqual(self.clock.now, 1007)
+        self.scheduler.block(5)
+        self.scheduler.acquire(10, 'other-model')
+        self.assertEqual(self.clock.now, 1012)
+
+    def test_gives_up_after_max_retries(self):
+        fn = mock.Mock(side_effect=rate_limit_error())
+        with self.assertRaises(groq.RateLimitError):
+            self.scheduler.call(fn, 1, 'model')
+        self.assertEqual(fn.call_count, 3)
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('core.circuit_breaker.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failure_rate=0.5, min_calls=4, window=4, slow_call_seconds=10,
+                                      open_seconds=30, half_open_probes=1)
+
+    def fail(self):
+        error = CircuitBreaker.OUTAGE_ERRORS[0](request=mock.Mock())
+        with self.assertRaises(CircuitBreaker.OUTAGE_ERRORS):
+            self.breaker.call(mock.Mock(side_effect=error))
+
+    def open_circuit(self):
+        self.breaker.call(lambda: 'ok')
+        self.breaker.call(lambda: 'ok')
+        self.fail()
+        self.fail()
+
+    def test_opens_once_the_failure_rate_is_reached(self):
+        self.breaker.call(lambda: 'ok')
+        self.fail()
+        self.fail()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.fail()
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.call(lambda: 'ok')
+
+    def test_client_errors_do_not_count(self):
+        for _ in range(4):
+            with self.assertRaises(ValueError):
+                self.breaker.call(mock.Mock(side_effect=ValueError("bad request")))
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_slow_calls_count_as_failures(self):
+        def slow():
+            self.clock.now += 11
+            return 'ok'
+        for _ in range(4):
+            self.breaker.call(slow)
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_half_open_probe_closes_the_circuit(self):
+        self.open_circuit()
+        self.assertEqual(self.breaker.retry_after(), 30)
+        self.clock.now += 30
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertEqual(self.breaker.call(lambda: 'ok'), 'ok')
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_failed_probe_opens_the_circuit_again(self):
+        self.open_circuit()
+        self.clock.now += 30
+        self.fail()
+        self.assertEqual(self.breaker.state, OPEN)
+
+    def test_only_one_probe_at_a_time(self):
+        self.open_circuit()
+        self.clock.now += 30
+
+        def probe():
+            with self.assertRaises(CircuitOpenError):
+                self.breaker.call(lambda: 'second probe')
+            return 'ok'
+        self.assertEqual(self.breaker.call(probe), 'ok')
+
+@override_settings(TRIAGE_ENABLED=False, GROQ_STREAMING_ENABLED=False, GROQ_DEGRADED_MAX_REQUEUES=2)
+class DegradedAnalysisTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('analyst', password='pw')
+        client = mock.Mock()
+        client.analyze_text.side_effect = CircuitOpenError(30)
+        client.circuit_retry_after.return_value = 30
+        for target, value in (('core.tasks.groq_client', client),
+                              ('core.tasks.process_text_analysis.apply_async', mock.Mock())):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_degraded_analysis_is_requeued_a_limited_number_of_times(self):
+        from . import tasks
+        result = process_text_analysis("is this a scam?", self.user.id)
+        self.assertTrue(result["degraded"])
+        (args, kwargs), options = tasks.process_text_analysis.apply_async.call_args
+        self.assertEqual((kwargs["requeues"], options["countdown"]), (1, 31))
+        session = AnalysisSession.objects.get(id=args[2])
+        self.assertEqual(session.status, 'degraded')
+
+        process_text_analysis("is this a scam?", self.user.id, session.id, kwargs["degraded_threat_ids"], requeues=2)
+        self.assertEqual(tasks.process_text_analysis.apply_async.call_count, 1)
+
+@override_settings(GROQ_MAX_RETRIES=1, GROQ_RETRY_BASE_DELAY=0.01)
+class GroqClientPoolTests(SimpleTestCase):
+    def pool(self, replies, strategy='least_loaded', weights=None):
+        members = []
+        for index, reply in enumerate(replies):
+            member = GroqPoolMember(f'key-{index}', weight=(weights or [1.0] * len(replies))[index])
+            member.client = FakeCompletions(reply)
+            members.append(member)
+        return GroqClientPool(members, strategy=strategy, cache=VerdictCache(redis_url=''),
+                              single_flight=SingleFlight())
+
+    def test_rate_limited_member_fails_over_to_the_next(self):
+        def limited(request):
+            raise rate_limit_error(retry_after=30)
+        pool = self.pool([limited, lambda request: completion(json.dumps(verdict('HIGH')))])
+        self.assertEqual(json.loads(pool.analyze_text("hello"))["threat_level"], "HIGH")
+        # The limited member sits out its retry-after
+        self.assertGreater(pool.members[0].scheduler.try_acquire(1, 'model'), 0)
+        self.assertEqual(len(pool.members[1].client.requests), 1)
+
+    def test_every_member_down_raises_the_last_error(self):
+        def down(request):
+            raise groq.InternalServerError("unavailable", body=None, response=httpx.Response(
+                503, request=httpx.Request('POST', 'https://groq.test')))
+        pool = self.pool([down, down])
+        with mock.patch('core.groq_utils.time.sleep'), self.assertRaises(groq.InternalServerError):
+            pool.analyze_text("hello")
+        self.assertEqual([len(member.client.requests) for member in pool.members], [2, 2])
+        self.assertEqual([member['failures'] for member in pool.stats()], [2, 2])
+
+    def test_weighted_round_robin_follows_the_weights(self):
+        reply = lambda request: completion(json.dumps(verdict()))
+        pool = self.pool([reply, reply], strategy='weighted_round_robin', weights=[2.0, 1.0])
+        for index in range(6):
+            pool.analyze_text(f"text {index}")
+        self.assertEqual([len(member.client.requests) for member in pool.members], [4, 2])
+
+def completion_body(content, model='model'):
+    """A chat completion as the Groq API sends it"""
+    return {"id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20}}
+
+class AsyncGroqClientTests(SimpleTestCase):
+    def serve(self, handler):
+        """Route the async client's HTTP pool to handler(request) -> httpx.Response"""
+        self.requests = []
+
+        def record(request):
+            self.requests.append(request)
+            return handler(request)
+
+        patcher = mock.patch('core.async_groq_utils.get_async_http_client',
+                             lambda: http_clients.setdefault(asyncio.get_running_loop(), httpx.AsyncClient(
+                                 transport=httpx.MockTransport(record))))
+        http_clients = {}
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_identical_concurrent_analyses_share_one_request(self):
+        self.serve(lambda request: httpx.Response(200, json=completion_body(json.dumps(verdict('HIGH')))))
+        sync_client = fake_groq_client(None)
+        client = AsyncGroqClient(sync_client)
+
+        async def analyze():
+            return await asyncio.gather(*(client.analyze_text("verify your password") for _ in range(5)))
+
+        results = async_to_sync(analyze)()
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual({json.loads(result)["threat_level"] for result in results}, {"HIGH"})
+        # The wrapped client's cache answers the next call
+        async_to_sync(client.analyze_text)("verify your password")
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(sync_client.client.requests, [])
+
+    def test_requests_are_built_and_parsed_by_the_wrapped_client(self):
+        self.serve(lambda request: httpx.Response(200, json=completion_body('{"t":1,"l":"C","c":0.9}')))
+        client = AsyncGroqClient(fake_groq_client(None))
+        result = json.loads(async_to_sync(client.analyze_text)("\x1b[31mrm -rf /\x1b[0m"))
+        self.assertEqual((result["threat_detected"], result["threat_level"]), (True, "CRITICAL"))
+        sent = json.loads(self.requests[0].content)
+        self.assertEqual(sent["messages"], client.sync._text_request("\x1b[31mrm -rf /\x1b[0m", sent["model"])["messages"])
+
+    @override_settings(GROQ_MAX_RETRIES=0)
+    def test_pool_members_fail_over(self):
+        def handler(request):
+            if request.url.host == 'limited.test':
+                return httpx.Response(429, headers={'retry-after': '30'}, json={"error": {"message": "slow down"}})
+            return httpx.Response(200, json=completion_body(json.dumps(verdict('MEDIUM'))))
+        self.serve(handler)
+        members = [GroqPoolMember('key-1', base_url='https://limited.test'),
+                   GroqPoolMember('key-2', base_url='https://healthy.test')]
+        pool = GroqClientPool(members, cache=VerdictCache(redis_url=''), single_flight=SingleFlight())
+        client = AsyncGroqClient(pool)
+
+        self.assertEqual(json.loads(async_to_sync(client.analyze_text)("hello"))["threat_level"], "MEDIUM")
+        self.assertEqual([request.url.host for request in self.requests], ['limited.test', 'healthy.test'])
+        self.assertGreater(members[0].scheduler.try_acquire(1, 'model'), 0)
+
+    def test_shared_cache_is_read_off_the_event_loop(self):
+        self.serve(lambda request: httpx.Response(200, json=completion_body(json.dumps(verdict()))))
+        sync_client = fake_groq_client(None)
+        sync_client.cache.redis = fakeredis.FakeRedis()
+        client = AsyncGroqClient(sync_client)
+        threads = []
+        get = sync_client.cache.get
+        sync_client.cache.get = lambda key: threads.append(threading.get_ident()) or get(key)
+
+        async def analyze():
+            await client.analyze_text("hello")
+            return threading.get_ident()
+
+        loop_thread = async_to_sync(analyze)()
+        self.assertTrue(threads)
+        self.assertNotIn(loop_thread, threads)
+
+class ChunkingTests(SimpleTestCase):
+    def test_chunks_keep_whole_records_and_offsets(self):
+        text = "line one\n  continued\nline two\nline three\n"
+        chunks = chunk_text(text, max_tokens=6)
+        self.assertEqual([chunk.text for chunk in chunks], ["line one\n  continued\n", "line two\nline three\n"])
+        for chunk in chunks:
+            self.assertEqual(text[chunk.start_index:chunk.end_index], chunk.text)
+
+    def test_critical_chunk_stops_the_map_step(self):
+        chunks = chunk_text("".join(f"record {index}\n" for index in range(20)), max_tokens=3)
+        started = []
+
+        def analyze(text):
+            started.append(text)
+            return json.dumps(verdict('CRITICAL') if len(started) == 1 else verdict())
+
+        chunk_results, stopped_early = analyze_chunks(chunks, analyze, concurrency=1)
+        self.assertTrue(stopped_early)
+        self.assertEqual(len(chunk_results), 1)
+        self.assertLess(len(started), len(chunks))
+
+    def test_reduce_keeps_the_worst_level_and_normalizes_odd_output(self):
+        chunks = chunk_text("aaa\nbbb\nccc\n", max_tokens=1)
+        reduced = reduce_verdicts(list(zip(chunks, [
+            {"threat_detected": True, "threat_level": "high", "confidence_score": "0.8",
+             "description": "first", "indicators": ["a"]},
+            {"threat_detected": True, "threat_level": "none", "confidence_score": "n/a",
+             "description": "second", "indicators": ["a", "b"]},
+            {"threat_detected": False, "threat_level": "LOW", "confidence_score": 0.99},
+        ])), total_chunks=4, stopped_early=True)
+        self.assertEqual((reduced["threat_level"], reduced["confidence_score"]), ("HIGH", 0.8))
+        self.assertEqual(reduced["indicators"], ["a", "b"])
+        self.assertEqual((reduced["chunks_total"], reduced["chunks_analyzed"], reduced["stopped_early"]), (4, 3, True))
+
+class MergeVerdictsTests(SimpleTestCase):
+    def test_keeps_the_worst_level_and_merges_indicators(self):
+        merged = merge_verdicts([
+            {"threat_detected": True, "threat_level": "MEDIUM", "confidence_score": 0.9,
+             "threat_type": "spam", "description": "spam", "indicators": ["a"]},
+            {"threat_detected": True, "threat_level": "CRITICAL", "confidence_score": 0.7,
+             "threat_type": "phishing", "description": "phishing", "indicators": ["a", "b"]},
+            {"threat_detected": False, "threat_level": "LOW", "confidence_score": 0.99},
+        ])
+        self.assertTrue(merged["threat_detected"])
+        self.assertEqual(merged["threat_level"], "CRITICAL")
+        self.assertEqual(merged["threat_type"], "phishing")
+        self.assertEqual(merged["confidence_score"], 0.7)
+        self.assertEqual(merged["indicators"], ["a", "b"])
+        self.assertEqual(merged["description"], "spam phishing")
+
+    def test_normalizes_odd_levels_and_confidences(self):
+        merged = merge_verdicts([
+            {"threat_detected": True, "threat_level": "high", "confidence_score": "0.8"},
+            {"threat_detected": True, "threat_level": "none", "confidence_score": "n/a"},
+        ])
+        self.assertEqual(merged["threat_level"], "HIGH")
+        self.assertEqual(merged["confidence_score"], 0.8)
+
+    def test_no_threats(self):
+        merged = merge_verdicts([
+            {"threat_detected": False, "confidence_score": 0.9, "analysis_tier": "triage"},
+            {"threat_detected": False, "confidence_score": 0.6, "analysis_tier": "triage"},
+        ])
+        self.assertFalse(merged["threat_detected"])
+        self.assertEqual(merged["threat_level"], "LOW")
+        self.assertEqual(merged["confidence_score"], 0.6)
+        self.assertEqual(merged["analysis_tier"], "triage")
+
+class LogTemplateTests(SimpleTestCase):
+    def setUp(self):
+        self.miner = LogTemplateMiner()
+        self.batches = []
+
+    def analyze_batch(self, texts):
+        self.batches.append(texts)
+        return [json.dumps(verdict()) for _ in texts]
+
+    def log(self, first, count, line="worker {n} finished job {job} in {ms} ms"):
+        return "\n".join(line.format(n=n, job=1000 + n, ms=10 * n, ip=f"10.0.0.{n}")
+                         for n in range(first, first + count))
+
+    def test_lines_that_differ_in_values_share_a_template(self):
+        digest = self.miner.digest(self.log(1, 5) + "\ndisk /dev/sda1 is 91% full")
+        self.assertEqual([len(group.spans) for group in digest.groups], [5, 1])
+        self.assertEqual(digest.groups[0].cluster.template, "worker <NUM> finished job <NUM> in <NUM> ms")
+
+    def test_frequent_templates_reuse_their_verdict(self):
+        [pairs] = analyze_digests([mine_repetitive(self.miner, self.log(1, 5))], self.analyze_batch)
+        self.assertEqual(len(self.batches), 1)
+        self.assertNotIn("analysis_tier", pairs[0][1])
+
+        [[(group, reused)]] = analyze_digests([mine_repetitive(self.miner, self.log(6, 5))], self.analyze_batch)
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(reused["analysis_tier"], "template")
+
+    def test_lines_with_unseen_indicators_go_back_to_the_llm(self):
+        line = "connection from {ip} closed after {ms} ms"
+        analyze_digests([mine_repetitive(self.miner, self.log(1, 5, line))], self.analyze_batch)
+        analyze_digests([mine_repetitive(self.miner, self.log(1, 5, line))], self.analyze_batch)
+        self.assertEqual(len(self.batches), 1)
+        analyze_digests([mine_repetitive(self.miner, self.log(6, 5, line))], self.analyze_batch)
+        self.assertEqual(len(self.batches), 2)
+        self.assertIn("10.0.0.6", self.batches[1][0])
+
+    def test_prose_is_analyzed_whole_and_leaves_no_templates(self):
+        prose = "Hi team,\nthe quarterly numbers are in the shared folder.\nPlease review them before Friday.\nThanks!"
+        self.assertIsNone(mine_repetitive(self.miner, prose))
+        self.assertEqual(self.miner.stats()["templates"], 0)
+
+PHISH = ("Dear {name}, your mailbox storage is almost full and incoming messages will be rejected soon. "
+         "Please confirm your account at {url} within 24 hours to keep receiving email from your team.")
+
+class NearDuplicateTests(SimpleTestCase):
+    def setUp(self):
+        self.index = MinHashIndex()
+        self.index.add(PHISH.format(name="Alice", url="https://mail-fix.example/verify"), verdict('HIGH'), 1)
+
+    def test_text_differing_only_in_the_recipient_reuses_the_verdict(self):
+        found, similarity = self.index.find(PHISH.format(name="Bob", url="https://mail-fix.example/verify"), 1)
+        self.assertEqual(found["threat_level"], "HIGH")
+        self.assertGreaterEqual(similarity, 0.8)
+
+    def test_different_indicators_never_match(self):
+        self.assertIsNone(self.index.find(PHISH.format(name="Bob", url="https://other.example/verify"), 1))
+
+    def test_entries_belong_to_their_user(self):
+        self.assertIsNone(self.index.find(PHISH.format(name="Alice", url="https://mail-fix.example/verify"), 2))
+
+    def test_only_full_model_verdicts_are_reusable(self):
+        self.assertTrue(reusable(verdict('HIGH', analysis_tier='large')))
+        self.assertFalse(reusable(verdict('HIGH', analysis_tier='near_duplicate')))
+        self.assertFalse(reusable(verdict('HIGH', degraded=True)))
+
+class CompactPromptTests(SimpleTestCase):
+    def setUp(self):
+        self.prompt = CompactPromptFormat()
+
+    def test_short_keys_are_expanded(self):
+        parsed = json.loads(self.prompt.parse_text('Sure: {"t":1,"l":"H","c":0.8,"y":"phishing","d":"x","i":["a"]}'))
+        self.assertEqual(parsed, {"threat_detected": True, "threat_level": "HIGH", "confidence_score": 0.8,
+                                  "threat_type": "phishing", "description": "x", "indicators": ["a"]})
+        self.assertEqual(self.prompt.parse_text("no json here"), "no json here")
+
+    def test_batch_items_are_matched_by_number(self):
+        parsed = self.prompt.parse_batch('[{"n":2,"t":0,"l":"L","c":0.9},{"n":9,"t":1,"l":"C"},{"t":1}, 3]', 2)
+        self.assertEqual(list(parsed), [2])
+        self.assertFalse(parsed[2]["threat_detected"])
+        self.assertEqual(self.prompt.parse_batch("[not json", 2), {})
+
+    def test_input_is_cleaned(self):
+        text = "\x1b[31mERROR\x1b[0m   disk\tfull\n\nERROR disk full\nok"
+        self.assertEqual(clean_input(text), "ERROR disk full (repeated 2 times)\nok")
+
+    def test_stream_reports_early_fields_under_full_names(self):
+        parser = StreamingVerdictParser(compact=True)
+        parser.feed('{"t":1,"l":"C')
+        self.assertFalse(parser.early_fields_ready)
+        fields = parser.feed('","c":0.9,')
+        self.assertTrue(parser.early_fields_ready)
+        self.assertEqual(fields, {"threat_detected": True, "threat_level": "CRITICAL", "confidence_score": 0.9})
+
+class ConversationTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('analyst', password='pw')
+        self.session = AnalysisSession.objects.create(user=user, session_type='text', status='active')
+        self.calls = []
+
+    def analyze(self, level, summary, during=None):
+        def analyze(summary_so_far, risk_level, recent, new):
+            self.calls.append((summary_so_far, risk_level, list(recent), list(new)))
+            if during:
+                during()
+            return json.dumps(dict(verdict(level), summary=summary))
+        return analyze
+
+    def test_only_new_messages_and_the_summary_are_sent(self):
+        update_conversation(self.session, ["hi", {"sender": "bob", "text": "send the code"}],
+                            self.analyze('MEDIUM', "bob wants a code"))
+        result = update_conversation(self.session, ["it is 1234"], self.analyze('HIGH', "bob got the code"))
+
+        self.assertEqual(self.calls[1], ("bob wants a code", "MEDIUM", ["hi", "bob: send the code"], ["it is 1234"]))
+        self.assertEqual(result["conversation"],
+                         {"risk_level": "HIGH", "peak_level": "HIGH", "messages_analyzed": 3})
+        state = AnalysisSession.objects.get(id=self.session.id).metadata["conversation"]
+        self.assertEqual((state["summary"], state["version"]), ("bob got the code", 2))
+
+    def test_concurrent_batch_keeps_the_higher_risk(self):
+        other = AnalysisSession.objects.get(id=self.session.id)
+        concurrent = lambda: update_conversation(other, ["wire the money"], self.analyze('CRITICAL', "asked for money"))
+        update_conversation(self.session, ["thanks, bye"], self.analyze('LOW', "said bye", during=concurrent))
+
+        state = AnalysisSession.objects.get(id=self.session.id).metadata["conversation"]
+        self.assertEqual((state["risk_level"], state["messages_analyzed"]), ("CRITICAL", 2))
+        self.assertEqual(state["summary"], "asked for money thanks, bye")
+
+class BlobStoreTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.store = FileSystemBlobStore(root)
+
+    def stored_files(self):
+        return [name for _, _, files in os.walk(self.store.root) for name in files]
+
+    def test_same_content_is_stored_once(self):
+        key = self.store.put(b"frame")
+        self.assertEqual(key, blob_key(b"frame"))
+        self.assertEqual(self.store.put(b"frame"), key)
+        self.assertEqual(len(self.stored_files()), 1)
+        self.assertEqual(self.store.read(key), b"frame")
+        with self.store.mmap(key) as buffer:
+            self.assertEqual(bytes(buffer[:5]), b"frame")
+
+    def test_oversized_stream_leaves_nothing_behind(self):
+        writer = self.store.writer(max_bytes=8)
+        writer.write(b"12345")
+        with self.assertRaises(BlobTooLarge):
+            writer.write(b"67890")
+        self.assertEqual(self.stored_files(), [])
+
+    def test_prune_keeps_referenced_blobs(self):
+        kept, stale = self.store.put(b"kept"), self.store.put(b"stale")
+        self.assertEqual(self.store.prune(timezone.now() + timedelta(seconds=1), keep={kept}), 1)
+        self.assertTrue(self.store.exists(kept))
+        self.assertFalse(self.store.exists(stale))
+
+    def test_prune_removes_blobs_unused_since_the_cutoff(self):
+        key = self.store.put(b"stale")
+        self.assertEqual(self.store.prune(timezone.now() - timedelta(hours=1)), 0)
+        self.assertEqual(self.store.prune(timezone.now() + timedelta(seconds=1)), 1)
+        self.assertFalse(self.store.exists(key))
+
+    def test_media_store_refreshes_a_blob_stored_again(self):
+        with override_settings(MEDIA_ROOT=self.store.root):
+            store = MediaBlobStore()
+            key = store.put(b"frame")
+            an_hour_ago = (timezone.now() - timedelta(hours=1)).timestamp()
+            os.utime(store.storage.path(store.name(key)), (an_hour_ago, an_hour_ago))
+            store.put(b"frame")
+            self.assertEqual(store.prune(timezone.now() - timedelta(minutes=1)), 0)
+            self.assertTrue(store.exists(key))
+
+@override_settings(TRIAGE_ENABLED=False, NEAR_DUP_ENABLED=False)
+class BulkSaveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('analyst', password='pw')
+        patcher = mock.patch('core.tasks.groq_client')
+        self.groq = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.groq.analyze_text_batch.return_value = [verdict('HIGH'), verdict('LOW'), verdict('MEDIUM')]
+
+    def analyze(self):
+        with CaptureQueriesContext(connection) as queries:
+            results = process_text_analysis_batch(["a", "b", "c"], self.user.id, source_type='log')
+        sources = TextSource.objects.order_by('id')
+        self.assertEqual([(source.content, source.source_type) for source in sources],
+                         [("a", 'log'), ("b", 'log'), ("c", 'log')])
+        threats = {threat.source_id: threat for threat in TextThreatDetection.objects.all()}
+        self.assertEqual([threats[source.id].threat_level for source in sources if source.id in threats],
+                         ['HIGH', 'MEDIUM'])
+        self.assertEqual([result["threat_ids"] for result in results],
+                         [[threats[sources[0].id].id], [], [threats[sources[2].id].id]])
+        return [query['sql'] for query in queries if query['sql'].startswith('INSERT')]
+
+    def test_sources_and_threats_are_stored_in_bulk(self):
+        # The session, then one INSERT each for the sources, the threats and their text details
+        self.assertEqual(len(self.analyze()), 4)
+
+    def test_without_bulk_ids_rows_are_saved_one_by_one(self):
+        with mock.patch('core.tasks._bulk_returns_ids', return_value=False):
+            self.assertEqual(len(self.analyze()), 1 + 3 + 2 * 2)
+
+class IngestParsingTests(SimpleTestCase):
+    def records(self, body, **kwargs):
+        return list(iter_records(io.BytesIO(body), chunk_size=16, **kwargs))
+
+    def test_parses_objects_strings_and_reports_bad_lines(self):
+        body = (b'{"text": "first"}\n\n"second"\n{"message": "third", "source_type": "chat", "session_id": 4}\n'
+                b'not json\n[1]\n{"text": ""}\n{"text": "no newline"}')
+        records = self.records(body, max_record_bytes=1024)
+        self.assertEqual([line for line, _, _ in records], [1, 3, 4, 5, 6, 7, 8])
+        self.assertEqual(records[0][1], {"text": "first", "source_type": None, "session_id": None})
+        self.assertEqual(records[1][1]["text"], "second")
+        self.assertEqual(records[2][1], {"text": "third", "source_type": "chat", "session_id": 4})
+        self.assertTrue(records[3][2].startswith("Invalid JSON"))
+        self.assertIsNotNone(records[4][2])
+        self.assertIsNotNone(records[5][2])
+        self.assertEqual(records[6][1]["text"], "no newline")
+
+    def test_oversized_records_are_rejected_without_buffering(self):
+        body = b'{"text": "' + b'x' * 100 + b'"}\n{"text": "ok"}\n'
+        records = self.records(body, max_record_bytes=32)
+        self.assertEqual(records[0][:2], (1, None))
+        self.assertIn("exceeds", records[0][2])
+        self.assertEqual(records[1][1]["text"], "ok")
+
+class MicroBatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.batcher = MicroBatcher(max_records=3, max_bytes=20, max_seconds=2, clock=self.clock)
+
+    def test_releases_by_count_per_route(self):
+        self.assertIsNone(self.batcher.add(('log', 1), 1, "a"))
+        self.assertIsNone(self.batcher.add(('chat', 2), 2, "b"))
+        self.assertIsNone(self.batcher.add(('log', 1), 3, "c"))
+        batch = self.batcher.add(('log', 1), 4, "d")
+        self.assertEqual((batch.source_type, batch.session_id, batch.lines, batch.texts),
+                         ('log', 1, [1, 3, 4], ["a", "c", "d"]))
+        self.assertEqual([batch.texts for batch in self.batcher.drain()], [["b"]])
+
+    def test_releases_by_size(self):
+        self.assertIsNone(self.batcher.add(('log', 1), 1, "x" * 10))
+        self.assertEqual(self.batcher.add(('log', 1), 2, "y" * 10).lines, [1, 2])
+
+    def test_releases_by_age(self):
+        self.assertIsNone(self.batcher.next_due())
+        self.batcher.add(('log', 1), 1, "a")
+        self.clock.now += 1
+        self.batcher.add(('chat', 2), 2, "b")
+        self.assertEqual(self.batcher.next_due(), 1)
+        self.assertEqual(self.batcher.due(), [])
+        self.clock.now += 1
+        self.assertEqual([batch.lines for batch in self.batcher.due()], [[1]])
+        self.assertEqual(self.batcher.next_due(), 1)
+
+class MultimodalRefinalizeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('analyst', password='pw')
+        self.session = AnalysisSession.objects.create(user=self.user, session_type='multimodal', status='processing')
+
+    def part(self, modality, result):
+        return {"modality": modality, "result": result, "queue_ms": 1, "latency_ms": 2}
+
+    def finalize(self, text_verdict):
+        return finalize_multimodal_analysis(
+            [self.part('text', json.dumps(text_verdict)), self.part('visual', json.dumps(verdict('MEDIUM')))],
+            self.user.id, self.session.id)
+
+    def multimodal_threats(self):
+        return list(ThreatDetection.objects.filter(source_type='multimodal').values_list('threat_level', flat=True))
+
+    def test_full_verdict_replaces_the_degraded_part(self):
+        fused = self.finalize(verdict('LOW', degraded=True))
+        self.assertTrue(fused["degraded"])
+        self.assertEqual(AnalysisSession.objects.get(id=self.session.id).status, 'degraded')
+
+        refinalize_multimodal_analysis(self.session.id, 'text', verdict('CRITICAL'))
+        session = AnalysisSession.objects.get(id=self.session.id)
+        self.assertEqual(session.status, 'completed')
+        self.assertEqual(session.metadata['multimodal']['verdict']['threat_level'], 'CRITICAL')
+        self.assertEqual(session.metadata['multimodal']['modalities']['visual']['threat_level'], 'MEDIUM')
+        self.assertEqual(self.multimodal_threats(), ['CRITICAL'])
+
+    def test_full_verdict_before_the_callback_is_used_by_it(self):
+        refinalize_multimodal_analysis(self.session.id, 'text', verdict('HIGH'))
+        self.assertEqual(self.multimodal_threats(), [])
+
+        fused = self.finalize(verdict('LOW', degraded=True))
+        self.assertEqual((fused["threat_level"], fused["degraded"]), ('HIGH', False))
+        self.assertEqual(AnalysisSession.objects.get(id=self.session.id).status, 'completed')
+
+    def test_redelivered_callback_stores_nothing_twice(self):
+        self.finalize(verdict('HIGH'))
+        self.finalize(verdict('HIGH'))
+        self.assertEqual(self.multimodal_threats(), ['HIGH'])
+
+class NotificationOutboxTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('core.notifications.ThreatNotificationConsumer.notify_user', new_callable=mock.AsyncMock)
+        self.notify_user = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.outbox = NotificationOutbox(batch_size=10)
+
+    def test_only_committed_notifications_are_sent(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.outbox.publish(1, 'analysis_update', {'session_id': 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.outbox.publish(1, 'analysis_update', {'session_id': 2})
+                transaction.set_rollback(True)
+        self.assertEqual(self.outbox.flush(), 1)
+        self.notify_user.assert_awaited_once_with(1, 'analysis_update', {'session_id': 1})
+
+    def test_full_batch_is_sent_without_flush(self):
+        self.outbox.batch_size = 2
+        with self.captureOnCommitCallbacks(execute=True):
+            self.outbox.publish(1, 'threat_notification', {'id': 1})
+            self.outbox.publish(1, 'threat_notification', {'id': 2})
+        # A user's threats share one group message
+        self.notify_user.assert_awaited_once_with(1, 'threat_batch', {'items': [{'id': 1}, {'id': 2}]})
+        self.assertEqual(self.outbox.flush(), 0)
+
+    def test_outcome_summary(self):
+        self.assertEqual(summarize_outcome(states.STARTED, None), {"state": states.STARTED, "status": 'processing'})
+        summary = summarize_outcome(states.SUCCESS, [verdict('HIGH'), verdict('LOW')])
+        self.assertEqual((summary["status"], summary["items"], summary["threats"], summary["threat_level"]),
+                         ('completed', 2, 1, 'HIGH'))
+        self.assertEqual(summarize_outcome(states.SUCCESS, {"error": "boom"})["status"], 'failed')
+
+def threat(level='HIGH', description='phishing link', **fields):
+    return dict({'id': 1, 'level': level, 'description': description, 'source_type': 'text',
+                 'timestamp': 't'}, **fields)
+
+def consumer():
+    """A ThreatNotificationConsumer as connect() leaves it, recording the frames it sends"""
+    consumer = ThreatNotificationConsumer()
+    consumer.user = SimpleNamespace(id=1)
+    consumer.coalescer = NotificationCoalescer()
+    consumer._flush_task = None
+    consumer.subscription = Subscription()
+    consumer._delta = None
+    consumer._snapshot_seq = None
+    consumer.send = mock.AsyncMock()
+    return consumer
+
+def sent(consumer):
+    return [json.loads(call.kwargs['text_data']) for call in consumer.send.call_args_list]
+
+@override_settings(NOTIFY_COALESCE_MS=20, NOTIFY_QUEUE_MAX=2)
+class CoalescingTests(SimpleTestCase):
+    def deliver(self, consumer, *threats):
+        async def deliver():
+            for data in threats:
+                await consumer.threat_notification({'data': data})
+            await asyncio.sleep(0.1)
+        async_to_sync(deliver)()
+        return sent(consumer)
+
+    def test_identical_alerts_go_out_as_one_batch_item(self):
+        [frame] = self.deliver(consumer(), threat(), threat(timestamp='u'), threat('LOW', 'port scan'))
+        self.assertEqual(frame['type'], 'threat_batch')
+        self.assertEqual([(item['level'], item['count']) for item in frame['data']['items']], [('HIGH', 2), ('LOW', 1)])
+        self.assertEqual(frame['data']['items'][0]['last_timestamp'], 'u')
+        self.assertEqual(frame['data']['total'], 3)
+
+    def test_lone_alert_keeps_the_plain_frame(self):
+        [frame] = self.deliver(consumer(), threat())
+        self.assertEqual(frame, {'type': 'threat_notification', 'data': threat()})
+
+    def test_least_severe_alerts_are_dropped_when_the_queue_is_full(self):
+        [frame] = self.deliver(consumer(), threat('LOW', 'a'), threat('HIGH', 'b'), threat('CRITICAL', 'c'),
+                               threat('LOW', 'd'))
+        self.assertEqual([item['level'] for item in frame['data']['items']], ['HIGH', 'CRITICAL'])
+        self.assertEqual(frame['data']['dropped'], {'LOW': 2})
+
+class SubscriptionTests(SimpleTestCase):
+    def test_filters_are_validated(self):
+        for message in ({'min_level': 'SEVERE'}, {'source_types': 'text'}, {'session_ids': ['1']},
+                        {'session_ids': [True]}):
+            with self.assertRaises(ValueError):
+                Subscription.from_message(message)
+        subscription = Subscription.from_message({'min_level': 'HIGH', 'source_types': ['visual']})
+        self.assertEqual(subscription.levels(), ['HIGH', 'CRITICAL'])
+        self.assertEqual(subscription.as_dict(), {'min_level': 'HIGH', 'source_types': ['visual'], 'session_ids': None})
+
+    def test_matches_only_on_the_fields_a_notification_carries(self):
+        subscription = Subscription('MEDIUM', ['text'], [7])
+        self.assertTrue(subscription.matches(threat('HIGH', session_id=7)))
+        self.assertFalse(subscription.matches(threat('LOW', session_id=7)))
+        self.assertFalse(subscription.matches(threat('HIGH', session_id=8)))
+        self.assertFalse(subscription.matches(threat('HIGH', source_type='audio', session_id=7)))
+        # Updates without a session id, e.g. for a whole batch, are not filtered on it
+        self.assertTrue(subscription.matches({'type': 'batch_update', 'source_type': 'text'}))
+
+    @override_settings(NOTIFY_COALESCE_MS=0)
+    def test_consumer_moves_between_severity_groups(self):
+        connection = consumer()
+        connection.channel_name = 'channel'
+        connection.channel_layer = mock.Mock(group_add=mock.AsyncMock(), group_discard=mock.AsyncMock())
+
+        async def subscribe_and_deliver():
+            await connection.receive(json.dumps({'type': 'subscribe', 'min_level': 'HIGH', 'session_ids': [7]}))
+            await connection.threat_notification({'data': threat('HIGH', session_id=8)})
+            await connection.analysis_update({'data': {'type': 'session_update', 'session_id': 7, 'status': 'done'}})
+        async_to_sync(subscribe_and_deliver)()
+
+        discarded = [call.args[0] for call in connection.channel_layer.group_discard.call_args_list]
+        self.assertEqual(sorted(discarded), ['user_1_threats_LOW', 'user_1_threats_MEDIUM'])
+        self.assertEqual([frame['type'] for frame in sent(connection)], ['subscribed', 'analysis_update'])
+
+class ReplayBufferTests(SimpleTestCase):
+    def test_numbers_notifications_per_user_and_replays_what_was_missed(self):
+        buffer = fake_replay_buffer()
+        first = buffer.append(1, 'threat_notification', {'id': 10})
+        buffer.append(2, 'threat_notification', {'id': 20})
+        second = buffer.append(1, 'dashboard_delta', {'threat_counts': {'HIGH': 1}})
+        self.assertEqual((first['seq'], second['seq']), (1, 2))
+        self.assertEqual(buffer.current(1), 2)
+
+        events, current, complete = buffer.since(1, 1)
+        self.assertEqual([event['data'] for event in events], [second])
+        self.assertEqual([event['type'] for event in events], ['dashboard_delta'])
+        self.assertEqual((current, complete), (2, True))
+        self.assertEqual(buffer.since(1, 2), ([], 2, True))
+
+    def test_resume_beyond_the_buffer_is_truncated(self):
+        buffer = fake_replay_buffer(size=2)
+        for index in range(4):
+            buffer.append(1, 'analysis_update', {'index': index})
+        events, current, complete = buffer.since(1, 1)
+        self.assertEqual([event['data']['seq'] for event in events], [3, 4])
+        self.assertFalse(complete)
+        self.assertTrue(buffer.since(1, 2)[2])
+
+    def test_concurrent_senders_keep_the_buffer_in_order(self):
+        buffer = fake_replay_buffer()
+        senders = [threading.Thread(target=lambda: [buffer.append(1, 'analysis_update', {}) for _ in range(25)])
+                   for _ in range(4)]
+        for sender in senders:
+            sender.start()
+        for sender in senders:
+            sender.join()
+        events, current, complete = buffer.since(1, 0)
+        self.assertEqual([event['data']['seq'] for event in events], list(range(1, 101)))
+        self.assertEqual((current, complete), (100, True))
+
+    def test_resume_after_the_counter_started_over(self):
+        buffer = fake_replay_buffer()
+        buffer.append(1, 'analysis_update', {})
+        self.assertEqual(buffer.since(1, 7), ([], 1, False))
+
+    def test_without_redis_nothing_is_numbered(self):
+        buffer = ReplayBuffer(redis_url='')
+        self.assertEqual(buffer.append(1, 'analysis_update', {'x': 1}), {'x': 1})
+        self.assertIsNone(buffer.current(1))
+        self.assertEqual(buffer.since(1, 0), ([], None, False))
+
+    def test_resume_replays_only_what_the_subscription_matches(self):
+        buffer = fake_replay_buffer()
+        buffer.append(1, 'threat_notification', threat('LOW', 'port scan'))
+        buffer.append(1, 'threat_notification', threat('HIGH'))
+        connection = consumer()
+        connection.subscription = Subscription('HIGH')
+        with mock.patch('core.consumers.get_replay_buffer', return_value=buffer):
+            async_to_sync(connection.receive)(json.dumps({'type': 'resume', 'last_seq': 0}))
+            async_to_sync(connection.receive)(json.dumps({'type': 'resume', 'last_seq': -1}))
+        replay, error = sent(connection)
+        self.assertEqual([event['data']['level'] for event in replay['data']['events']], ['HIGH'])
+        self.assertEqual((replay['data']['last_seq'], replay['data']['truncated']), (2, False))
+        self.assertEqual(error['type'], 'error')
+
+@override_settings(NOTIFY_COALESCE_MS=0)
+class DashboardConsistencyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('analyst', password='pw')
+        self.replay = fake_replay_buffer()
+        patcher = mock.patch('core.replay._replay_buffer', self.replay)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_threat(self, level='HIGH'):
+        return ThreatDetection.objects.create(user=self.user, threat_level=level, description='t',
+                                              source_type='text', confidence_score=0.9)
+
+    def test_delta_is_numbered_when_its_transaction_commits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_threat()
+            self.assertEqual(self.replay.current(self.user.id), 0)
+        self.assertEqual(self.replay.current(self.user.id), 1)
+        [event], _, _ = self.replay.since(self.user.id, 0)
+        self.assertEqual(event['data']['threat_counts'], {'HIGH': 1})
+
+    def test_snapshot_covers_every_delta_up_to_its_seq(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_threat('HIGH')
+        snapshot = async_to_sync(dashboard_snapshot)(self.user)
+        self.assertEqual(snapshot['seq'], 1)
+        self.assertEqual(snapshot['threat_counts']['HIGH'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_threat('LOW')
+        events, _, _ = self.replay.since(self.user.id, 0)
+        self.assertEqual([event['data']['seq'] for event in events], [1, 2])
+
+        consumer = ThreatNotificationConsumer()
+        consumer._snapshot_seq = snapshot['seq']
+        consumer._delta = None
+        consumer.send = mock.AsyncMock()
+        for event in events:
+            async_to_sync(consumer.dashboard_delta)(event)
+        # Only the delta the snapshot does not include reaches the client
+        [call] = consumer.send.call_args_list
+        self.assertEqual(json.loads(call.kwargs['text_data'])['data']['threat_counts'], {'LOW': 1})
+
+    def test_latest_session_status_wins(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            older = AnalysisSession.objects.create(user=self.user, session_type='text', status='processing')
+            AnalysisSession.objects.create(user=self.user, session_type='text', status='processing')
+            older.status = 'completed'
+            older.save()
+        snapshot = async_to_sync(dashboard_snapshot)(self.user)
+        self.assertEqual(snapshot['session_status']['text'], 'processing')
+
+        events, _, _ = self.replay.since(self.user.id, 0)
+        merged = {}
+        for event in events:
+            merge_delta(merged, event['data'])
+        self.assertEqual(merged['session_status']['text'], 'processing')
+
+    def test_truncated_resume_is_followed_by_a_snapshot(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_threat('HIGH')
+        connection = consumer()
+        connection.user = self.user
+        with mock.patch('core.consumers.get_replay_buffer', return_value=self.replay):
+            async_to_sync(connection.receive)(json.dumps({'type': 'resume', 'last_seq': 7}))
+        replay, snapshot = sent(connection)
+        self.assertEqual((replay['type'], replay['data']['truncated']), ('replay', True))
+        self.assertEqual(snapshot['type'], 'dashboard_snapshot')
+        self.assertEqual((snapshot['data']['seq'], connection._snapshot_seq), (1, 1))
@@ -0,0 +1,116 @@
+import logging
+import threading
+from collections import defaultdict
+from django.conf import settings
+from .rate_limit import estimate_tokens
+from .chunking import CHARS_PER_TOKEN
+
+logger = logging.getLogger('rt_cta')
+
+COUNTERS = ('calls', 'prompt_tokens', 'completion_tokens', 'latency_ms')
+
+class TokenUsageStats:
+    """
+    Per prompt mode token and latency counters for Groq calls.
+
+    Counts come from the usage block of each response, or from the local
+    estimate when a response has none (streamed replies). Kept per process
+    and, with Redis, aggregated across workers, so the full and compact
+    prompt modes can be compared on real traffic.
+    """
+
+    STATS_KEY = 'rt_cta:token_usage'
+
+    def __init__(self, redis_url=None):
+        self._counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+        self.redis = None
+        redis_url = redis_url if redis_url is not None else settings.GROQ_USAGE_REDIS_URL
+        if redis_url:
+            try:
+                import redis
+                self.redis = redis.Redis.from_url(redis_url)
+            except Exception as e:
+                logger.error(f"Could not connect token usage stats to Redis: {str(e)}")
+
+    def record(self, mode, kind, messages, response, content, seconds):
+        """
+        Record one completed call
+
+        Args:
+            mode (str): Prompt mode the call used
+            kind (str): 'text', 'stream' or 'batch'
+            messages (list): The chat messages sent
+            response: The SDK response, or None for streams
+            content (str): The reply text
+            seconds (float): Wall-clock latency of the call
+        """
+        usage = getattr(response, 'usage', None)
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or estimate_tokens(messages, 0)
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or len(content or '') // CHARS_PER_TOKEN + 1
+        values = {
+            'calls': 1,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'latency_ms': int(seconds * 1000),
+        }
+        logger.debug(f"Groq {kind} call ({mode} prompt): {prompt_tokens}+{completion_tokens} tokens in {values['latency_ms']}ms")
+
+        with self._lock:
+            for counter, value in values.items():
+                self._counters[f'{mode}:{kind}:{counter}'] += value
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline()
+                for counter, value in values.items():
+                    pipe.hincrby(self.STATS_KEY, f'{mode}:{kind}:{counter}', value)
+                pipe.execute()
+            except Exception as e:
+                logger.debug(f"Could not update shared token usage stats: {str(e)}")
+
+    def stats(self):
+        """
+        Totals and per-call averages by prompt mode and call kind
+
+        Returns:
+            dict: {'process': {mode: {kind: {...}}}} plus 'shared' with Redis
+        """
+        with self._lock:
+            result = {'process': self._summarize(self._counters)}
+        if self.redis is not None:
+            try:
+                raw = {k.decode(): int(v) for k, v in self.redis.hgetall(self.STATS_KEY).items()}
+                result['shared'] = self._summarize(raw)
+            except Exception as e:
+                logger.error(f"Could not read shared token usage stats: {str(e)}")
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+        if self.redis is not None:
+            self.redis.delete(self.STATS_KEY)
+
+    @staticmethod
+    def _summarize(counters):
+        summary = {}
+        for key, value in counters.items():
+            mode, kind, counter = key.split(':')
+            summary.setdefault(mode, {}).setdefault(kind, dict.fromkeys(COUNTERS, 0))[counter] = value
+        for kinds in summary.values():
+            for totals in kinds.values():
+                calls = totals['calls'] or 1
+                totals['avg_prompt_tokens'] = round(totals['prompt_tokens'] / calls, 1)
+                totals['avg_completion_tokens'] = round(totals['completion_tokens'] / calls, 1)
+                totals['avg_latency_ms'] = round(totals['latency_ms'] / calls, 1)
+        return summary
+
+_token_usage = None
+
+def get_token_usage():
+    """Return the process-wide token usage stats"""
+    global _token_usage
+    if _token_usage is None:
+        _token_usage = TokenUsageStats()
+    return _token_usage
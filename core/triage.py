@@ -0,0 +1,299 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from collections import deque
+from django.conf import settings
+
+logger = logging.getLogger('rt_cta')
+
+CLEARLY_BENIGN = 'clearly_benign'
+CLEARLY_MALICIOUS = 'clearly_malicious'
+NEEDS_LLM = 'needs_llm'
+
+LEVEL_ORDER = ['LOW', 'MEDIUM', 'HIGH', 'CRITICAL']
+
+def normalize_level(level):
+    """A threat level from model output as one of LEVEL_ORDER ("high" -> HIGH, unknown levels -> LOW)"""
+    level = str(level or '').strip().upper()
+    return level if level in LEVEL_ORDER else LEVEL_ORDER[0]
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton for matching many keywords in a single pass.
+
+    Matching is case-insensitive and only reports keywords that start and
+    end on word boundaries, so "rat" does not match inside "separate".
+    """
+
+    def __init__(self, keywords):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for keyword in keywords:
+            self._add(keyword.lower())
+        self._build()
+
+    def _add(self, keyword):
+        if not keyword:
+            return
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state].append(keyword)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                if self._fail[next_state] == next_state:
+                    self._fail[next_state] = 0
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def search(self, text):
+        """
+        Find keywords in text
+
+        Args:
+            text (str): The text to scan
+
+        Returns:
+            set: Keywords found on word boundaries
+        """
+        text = text.lower()
+        found = set()
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for keyword in self._output[state]:
+                start = position - len(keyword) + 1
+                end = position + 1
+                before_ok = start == 0 or not text[start - 1].isalnum()
+                after_ok = end == len(text) or not text[end].isalnum()
+                if before_ok and after_ok:
+                    found.add(keyword)
+        return found
+
+class TriageResult:
+    """Outcome of a triage pass: a decision plus a ready-made verdict when the LLM is skipped"""
+
+    def __init__(self, decision, verdict=None, matches=None):
+        self.decision = decision
+        self.verdict = verdict
+        self.matches = matches or []
+
+    @property
+    def needs_llm(self):
+        return self.decision == NEEDS_LLM
+
+class TriageEngine:
+    """
+    Local rule engine that runs before any Groq call.
+
+    Inputs are classified as clearly malicious (known-bad keywords/IOCs or
+    patterns), clearly benign (every item/line is on the allow-list), or
+    needing the LLM. Rules are loaded from a JSON file and reloaded when the
+    file changes.
+    """
+
+    def __init__(self, rules_file=None, reload_interval=2.0):
+        self.rules_file = rules_file or settings.TRIAGE_RULES_FILE
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._last_check = 0.0
+        self._stats = {CLEARLY_BENIGN: 0, CLEARLY_MALICIOUS: 0, NEEDS_LLM: 0}
+        self._load()
+
+    def _load(self):
+        """(Re)compile the rules file"""
+        try:
+            mtime = os.path.getmtime(self.rules_file)
+            with open(self.rules_file) as f:
+                rules = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load triage rules from {self.rules_file}: {str(e)}")
+            if self._mtime is None:
+                rules, mtime = {}, None
+            else:
+                return
+
+        malicious = {k.lower(): v for k, v in rules.get('malicious_keywords', {}).items()}
+        malicious_automaton = KeywordAutomaton(malicious)
+        suspicious_automaton = KeywordAutomaton(rules.get('suspicious_keywords', []))
+        malicious_patterns = [
+            (re.compile(rule['pattern'], re.IGNORECASE), rule)
+            for rule in rules.get('malicious_patterns', [])
+        ]
+        suspicious_patterns = [re.compile(p, re.IGNORECASE) for p in rules.get('suspicious_patterns', [])]
+        benign_items = {item.lower() for item in rules.get('benign_items', [])}
+        benign_patterns = [re.compile(p, re.IGNORECASE) for p in rules.get('benign_patterns', [])]
+
+        with self._lock:
+            self._malicious = malicious
+            self._malicious_automaton = malicious_automaton
+            self._suspicious_automaton = suspicious_automaton
+            self._malicious_patterns = malicious_patterns
+            self._suspicious_patterns = suspicious_patterns
+            self._benign_items = benign_items
+            self._benign_patterns = benign_patterns
+            self._mtime = mtime
+        logger.info(f"Loaded triage rules from {self.rules_file}")
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._last_check < self.reload_interval:
+            return
+        self._last_check = now
+        try:
+            mtime = os.path.getmtime(self.rules_file)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self._load()
+
+    def classify(self, text):
+        """
+        Triage a piece of text
+
+        Args:
+            text (str): The text content to triage
+
+        Returns:
+            TriageResult: The decision, with a verdict dict unless the LLM is needed
+        """
+        self._maybe_reload()
+        result = self._classify(text or '')
+        with self._lock:
+            self._stats[result.decision] += 1
+        return result
+
+    def _classify(self, text):
+        # 1. Known-bad keywords, IOCs and patterns
+        keyword_hits = self._malicious_automaton.search(text)
+        pattern_hits = [rule for regex, rule in self._malicious_patterns if regex.search(text)]
+        if keyword_hits or pattern_hits:
+            levels = [self._malicious[k] for k in keyword_hits] + [r.get('threat_level', 'HIGH') for r in pattern_hits]
+            indicators = sorted(keyword_hits) + [r['name'] for r in pattern_hits]
+            threat_type = pattern_hits[0].get('threat_type', 'malware') if pattern_hits else 'known_ioc'
+            return TriageResult(CLEARLY_MALICIOUS, {
+                "threat_detected": True,
+                "threat_level": max(levels, key=LEVEL_ORDER.index),
+                "confidence_score": 0.9,
+                "threat_type": threat_type,
+                "description": f"Local rules matched known threat indicators: {', '.join(indicators)}",
+                "indicators": indicators,
+                "triage": CLEARLY_MALICIOUS,
+                "analysis_tier": "triage",
+            }, indicators)
+
+        # 2. Anything merely suspicious is left to the LLM
+        if self._suspicious_automaton.search(text) or any(p.search(text) for p in self._suspicious_patterns):
+            return TriageResult(NEEDS_LLM)
+
+        # 3. Benign only if every line is allow-listed or made of allow-listed items
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+        if lines and all(self._is_benign_line(line) for line in lines):
+            return TriageResult(CLEARLY_BENIGN, {
+                "threat_detected": False,
+                "threat_level": "LOW",
+                "confidence_score": 0.9,
+                "threat_type": "none",
+                "description": "Input matched only allow-listed local rules",
+                "indicators": [],
+                "triage": CLEARLY_BENIGN,
+                "analysis_tier": "triage",
+            })
+
+        return TriageResult(NEEDS_LLM)
+
+    def heuristic_verdict(self, text):
+        """
+        Best-effort local verdict for when the LLM is unavailable
+
+        Uses the triage decision when it is conclusive; otherwise scores the
+        input by how many suspicious keywords and patterns it contains.
+
+        Args:
+            text (str): The text content to assess
+
+        Returns:
+            dict: A verdict in the usual analysis shape, flagged degraded
+        """
+        text = text or ''
+        verdict = self._classify(text).verdict
+        if verdict is None:
+            hits = sorted(self._suspicious_automaton.search(text))
+            hits += [p.pattern for p in self._suspicious_patterns if p.search(text)]
+            if hits:
+                verdict = {
+                    "threat_detected": True,
+                    "threat_level": "HIGH" if len(hits) >= 3 else "MEDIUM",
+                    "confidence_score": min(0.4 + 0.1 * len(hits), 0.7),
+                    "threat_type": "suspicious",
+                    "description": f"Local heuristics flagged suspicious content: {', '.join(hits)}",
+                    "indicators": hits,
+                }
+            else:
+                verdict = {
+                    "threat_detected": False,
+                    "threat_level": "LOW",
+                    "confidence_score": 0.5,
+                    "threat_type": "none",
+                    "description": "No suspicious content found by local heuristics",
+                    "indicators": [],
+                }
+        verdict = dict(verdict, analysis_tier="heuristic", degraded=True)
+        return verdict
+
+    def _is_benign_line(self, line):
+        if any(p.fullmatch(line) for p in self._benign_patterns):
+            return True
+        items = [item.strip().lower() for item in re.split(r'[,;\s]+', line) if item.strip()]
+        return bool(items) and all(item in self._benign_items for item in items)
+
+    def stats(self):
+        """
+        Decision counters for this process
+
+        Returns:
+            dict: Counts per decision plus the fraction of inputs that skipped the LLM
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        total = sum(stats.values())
+        stats['total'] = total
+        stats['llm_bypass_rate'] = (total - stats[NEEDS_LLM]) / total if total else 0.0
+        return stats
+
+_triage_engine = None
+
+def heuristic_verdict(text):
+    """Local degraded-mode verdict, available even when triage is disabled"""
+    return (get_triage_engine() or TriageEngine()).heuristic_verdict(text)
+
+def get_triage_engine():
+    """Return the process-wide triage engine, or None when triage is disabled"""
+    global _triage_engine
+    if not settings.TRIAGE_ENABLED:
+        return None
+    if _triage_engine is None:
+        _triage_engine = TriageEngine()
+    return _triage_engine
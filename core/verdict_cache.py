@@ -0,0 +1,216 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+logger = logging.getLogger('rt_cta')
+
+# Fields a reply needs to count as a verdict
+VERDICT_FIELDS = ('threat_detected', 'threat_level', 'confidence_score')
+
+def is_verdict(value):
+    """Whether an analysis result (JSON string or dict) parsed into a verdict with the expected fields"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return False
+    return isinstance(value, dict) and all(field in value for field in VERDICT_FIELDS)
+
+class VerdictCache:
+    """
+    Content-addressed cache for Groq analysis verdicts.
+
+    Verdicts are keyed by a SHA-256 of the normalized input text, the model
+    name and the prompt version. Lookups go to an in-process LRU tier first
+    and then to an optional Redis tier shared by every worker.
+    """
+
+    KEY_PREFIX = 'rt_cta:verdict:'
+    STATS_KEY = 'rt_cta:verdict_stats'
+    # Shared counters are added up locally and written to Redis at most this often
+    STATS_FLUSH_SECONDS = 10
+
+    def __init__(self, max_entries=None, ttl=None, redis_url=None):
+        self.max_entries = max_entries if max_entries is not None else settings.VERDICT_CACHE_MAX_ENTRIES
+        self.ttl = ttl if ttl is not None else settings.VERDICT_CACHE_TTL
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'local_hits': 0, 'redis_hits': 0, 'misses': 0, 'evictions': 0}
+        self._unflushed = {}
+        self._flushed_at = time.monotonic()
+
+        self.redis = None
+        redis_url = redis_url if redis_url is not None else settings.VERDICT_CACHE_REDIS_URL
+        if redis_url:
+            try:
+                import redis
+                self.redis = redis.Redis.from_url(redis_url)
+            except Exception as e:
+                logger.error(f"Could not connect verdict cache to Redis: {str(e)}")
+
+    @staticmethod
+    def normalize(text):
+        """Collapse whitespace so cosmetic differences share a cache entry"""
+        return ' '.join(str(text).split())
+
+    @classmethod
+    def make_key(cls, text, model, prompt_version):
+        """
+        Build the cache key for an analysis request
+
+        Args:
+            text (str): The input text
+            model (str): The model name used for analysis
+            prompt_version (str): Version of the prompt template
+
+        Returns:
+            str: Hex SHA-256 digest identifying the request
+        """
+        digest = hashlib.sha256()
+        for part in (model, prompt_version, cls.normalize(text)):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return the cached verdict for a key, or None on a miss"""
+        now = time.monotonic()
+        hit = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    hit = True
+                else:
+                    del self._entries[key]
+        if hit:
+            self._record('hits', 'local_hits')
+            return value
+
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(self.KEY_PREFIX + key)
+            except Exception as e:
+                logger.error(f"Verdict cache Redis lookup failed: {str(e)}")
+                raw = None
+            if raw is not None:
+                try:
+                    value = json.loads(raw)
+                except ValueError:
+                    # Corrupt or written by an older version: drop it and analyze again
+                    logger.warning(f"Dropping unreadable verdict cache entry {key[:12]}")
+                    self._delete_shared(key)
+                    value = None
+                if is_verdict(value):
+                    self._store_local(key, value)
+                    self._record('hits', 'redis_hits')
+                    return value
+                if value is not None:
+                    self._delete_shared(key)
+
+        self._record('misses')
+        return None
+
+    def set(self, key, value):
+        """
+        Store a verdict in every tier
+
+        Replies that did not parse into a verdict are not stored, so one
+        malformed answer is not served to every identical input.
+
+        Returns:
+            bool: Whether the value was cached
+        """
+        if not is_verdict(value):
+            logger.warning("Not caching an analysis result that is not a valid verdict")
+            return False
+        self._store_local(key, value)
+        if self.redis is not None:
+            try:
+                self.redis.set(self.KEY_PREFIX + key, json.dumps(value), ex=self.ttl)
+            except Exception as e:
+                logger.error(f"Verdict cache Redis write failed: {str(e)}")
+        return True
+
+    def clear(self):
+        """Drop all locally cached verdicts"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Hit/miss counters for this process and, with Redis, for all workers
+
+        Returns:
+            dict: Counters including the number of LLM calls saved
+        """
+        with self._lock:
+            local = dict(self._stats)
+            local['size'] = len(self._entries)
+        local['llm_calls_saved'] = local['hits']
+        result = {'process': local}
+
+        if self.redis is not None:
+            self.flush_stats()
+            try:
+                shared = {k.decode(): int(v) for k, v in self.redis.hgetall(self.STATS_KEY).items()}
+                shared['llm_calls_saved'] = shared.get('hits', 0)
+                result['shared'] = shared
+            except Exception as e:
+                logger.error(f"Could not read shared verdict cache stats: {str(e)}")
+        return result
+
+    def _store_local(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def flush_stats(self):
+        """Add the counters recorded since the last flush to the shared ones in Redis"""
+        with self._lock:
+            unflushed, self._unflushed = self._unflushed, {}
+            self._flushed_at = time.monotonic()
+        if not unflushed or self.redis is None:
+            return
+        try:
+            pipe = self.redis.pipeline()
+            for counter, count in unflushed.items():
+                pipe.hincrby(self.STATS_KEY, counter, count)
+            pipe.execute()
+        except Exception as e:
+            logger.debug(f"Could not update shared verdict cache stats: {str(e)}")
+
+    def _record(self, *counters):
+        with self._lock:
+            for counter in counters:
+                self._stats[counter] += 1
+                self._unflushed[counter] = self._unflushed.get(counter, 0) + 1
+            due = time.monotonic() - self._flushed_at >= self.STATS_FLUSH_SECONDS
+        if due and self.redis is not None:
+            self.flush_stats()
+
+    def _delete_shared(self, key):
+        try:
+            self.redis.delete(self.KEY_PREFIX + key)
+        except Exception as e:
+            logger.debug(f"Could not delete verdict cache entry: {str(e)}")
+
+_verdict_cache = None
+
+def get_verdict_cache():
+    """Return the process-wide verdict cache, or None when caching is disabled"""
+    global _verdict_cache
+    if not settings.VERDICT_CACHE_ENABLED:
+        return None
+    if _verdict_cache is None:
+        _verdict_cache = VerdictCache()
+    return _verdict_cache
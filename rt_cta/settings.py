@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 import os
+import json
 from datetime import timedelta
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -112,6 +113,31 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
+# Task outcomes are pushed over WebSocket through a transaction.on_commit
+# outbox, sent NOTIFY_BATCH_SIZE at a time; clients without a socket query
+# up to TASK_STATUS_MAX_IDS tasks per /api/tasks/status/ request
+NOTIFY_BATCH_SIZE = int(os.getenv('NOTIFY_BATCH_SIZE', '50'))
+TASK_STATUS_MAX_IDS = int(os.getenv('TASK_STATUS_MAX_IDS', '100'))
+
+# Threat notifications reaching a WebSocket within NOTIFY_COALESCE_MS of each
+# other go out as one threat_batch frame (0 sends each one as it comes); a
+# connection queues at most NOTIFY_QUEUE_MAX distinct alerts, dropping the
+# least severe first when the client cannot keep up
+NOTIFY_COALESCE_MS = int(os.getenv('NOTIFY_COALESCE_MS', '250'))
+NOTIFY_QUEUE_MAX = int(os.getenv('NOTIFY_QUEUE_MAX', '200'))
+
+# Notifications are numbered per user and the last NOTIFY_REPLAY_BUFFER kept
+# for NOTIFY_REPLAY_TTL seconds in Redis, shared by web and worker processes,
+# so a reconnecting client gets only what it missed. Defaults to the Celery
+# broker when it is Redis; an empty URL turns numbering and replay off
+# (reconnecting clients get a fresh snapshot)
+NOTIFY_REPLAY_BUFFER = int(os.getenv('NOTIFY_REPLAY_BUFFER', '500'))
+NOTIFY_REPLAY_TTL = int(os.getenv('NOTIFY_REPLAY_TTL', '86400'))
+NOTIFY_REPLAY_REDIS_URL = os.getenv(
+    'NOTIFY_REPLAY_REDIS_URL',
+    CELERY_BROKER_URL if CELERY_BROKER_URL.startswith(('redis://', 'rediss://')) else ''
+)
+
 # Rest Framework Settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -170,6 +196,36 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Claim-check blob store for uploaded media: the API stores each upload once
+# under its SHA-256 and Celery messages carry only the key. 'media' uses
+# Django's default storage under BLOB_STORE_MEDIA_PREFIX, 'filesystem' a
+# local directory (BLOB_STORE_ROOT) shared with the workers.
+BLOB_STORE_BACKEND = os.getenv('BLOB_STORE_BACKEND', 'media')
+BLOB_STORE_ROOT = os.getenv('BLOB_STORE_ROOT') or os.path.join(BASE_DIR, 'blobs')
+BLOB_STORE_MEDIA_PREFIX = os.getenv('BLOB_STORE_MEDIA_PREFIX', 'blobs')
+
+# Binary upload endpoints (analyze/visual/upload/, analyze/audio/upload/):
+# bodies are streamed into the blob store in chunks and cut off at the cap
+UPLOAD_MAX_IMAGE_BYTES = int(os.getenv('UPLOAD_MAX_IMAGE_BYTES', 20 * 1024 * 1024))
+UPLOAD_MAX_AUDIO_BYTES = int(os.getenv('UPLOAD_MAX_AUDIO_BYTES', 100 * 1024 * 1024))
+UPLOAD_CHUNK_BYTES = int(os.getenv('UPLOAD_CHUNK_BYTES', 64 * 1024))
+
+# NDJSON streaming ingest (api/ingest/text/): records are micro-batched per
+# source type and session, flushed by count, size or age, and dispatched as
+# analysis tasks. Reading slows down once the Celery queue holds
+# INGEST_QUEUE_SLOW_DEPTH messages and stops at INGEST_QUEUE_STOP_DEPTH.
+# Backpressure and early acknowledgements need a WSGI server: Django's ASGI
+# handler reads the whole request body before the view runs.
+INGEST_BATCH_MAX_RECORDS = int(os.getenv('INGEST_BATCH_MAX_RECORDS', '200'))
+INGEST_BATCH_MAX_BYTES = int(os.getenv('INGEST_BATCH_MAX_BYTES', 256 * 1024))
+INGEST_BATCH_MAX_SECONDS = float(os.getenv('INGEST_BATCH_MAX_SECONDS', '2'))
+INGEST_MAX_RECORD_BYTES = int(os.getenv('INGEST_MAX_RECORD_BYTES', 64 * 1024))
+INGEST_QUEUE_SLOW_DEPTH = int(os.getenv('INGEST_QUEUE_SLOW_DEPTH', '1000'))
+INGEST_QUEUE_STOP_DEPTH = int(os.getenv('INGEST_QUEUE_STOP_DEPTH', '5000'))
+INGEST_QUEUE_CHECK_SECONDS = float(os.getenv('INGEST_QUEUE_CHECK_SECONDS', '1'))
+INGEST_SLOWDOWN_SECONDS = float(os.getenv('INGEST_SLOWDOWN_SECONDS', '0.5'))
+INGEST_RETRY_AFTER_SECONDS = int(os.getenv('INGEST_RETRY_AFTER_SECONDS', '30'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -178,6 +234,150 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # Groq API settings
 GROQ_API_KEY = os.getenv('GROQ_API_KEY', '')
 
+# Several comma-separated keys and/or base URLs turn the client into a load-balanced pool
+GROQ_API_KEYS = [key for key in os.getenv('GROQ_API_KEYS', '').split(',') if key] or [GROQ_API_KEY]
+GROQ_BASE_URLS = [url for url in os.getenv('GROQ_BASE_URLS', '').split(',') if url]
+GROQ_POOL_WEIGHTS = [float(weight) for weight in os.getenv('GROQ_POOL_WEIGHTS', '').split(',') if weight]
+GROQ_POOL_STRATEGY = os.getenv('GROQ_POOL_STRATEGY', 'least_loaded')  # or weighted_round_robin
+
+# Leave empty for the public Groq API; point at a local fake endpoint for testing
+GROQ_BASE_URL = os.getenv('GROQ_BASE_URL') or None
+
+# Groq rate-limit budgets per model (requests and tokens per minute). With a
+# Redis URL the budgets are shared by every worker.
+GROQ_RATE_LIMITS = {
+    'default': {'rpm': 30, 'tpm': 6000},
+    'llama3-70b-8192': {'rpm': 30, 'tpm': 6000},
+    'llama3-8b-8192': {'rpm': 30, 'tpm': 30000},
+}
+GROQ_RATE_LIMITS.update(json.loads(os.getenv('GROQ_RATE_LIMITS', '{}')))
+GROQ_RATE_LIMIT_REDIS_URL = os.getenv('GROQ_RATE_LIMIT_REDIS_URL', '')
+GROQ_MAX_RETRIES = int(os.getenv('GROQ_MAX_RETRIES', '4'))
+GROQ_RETRY_BASE_DELAY = float(os.getenv('GROQ_RETRY_BASE_DELAY', '1.0'))
+GROQ_RETRY_MAX_DELAY = float(os.getenv('GROQ_RETRY_MAX_DELAY', '30.0'))
+
+# Circuit breaker around Groq calls. The circuit opens when at least
+# MIN_CALLS of the last WINDOW calls were seen and FAILURE_RATE of them failed
+# or took longer than SLOW_CALL_SECONDS; tasks then get degraded local verdicts.
+# The circuit state is kept per process, so workers may disagree for a while.
+# A degraded analysis is requeued for a full one at most DEGRADED_MAX_REQUEUES times.
+GROQ_TIMEOUT = float(os.getenv('GROQ_TIMEOUT', '30'))
+GROQ_BREAKER_FAILURE_RATE = float(os.getenv('GROQ_BREAKER_FAILURE_RATE', '0.5'))
+GROQ_BREAKER_MIN_CALLS = int(os.getenv('GROQ_BREAKER_MIN_CALLS', '5'))
+GROQ_BREAKER_WINDOW = int(os.getenv('GROQ_BREAKER_WINDOW', '20'))
+GROQ_BREAKER_SLOW_CALL_SECONDS = float(os.getenv('GROQ_BREAKER_SLOW_CALL_SECONDS', '10'))
+GROQ_BREAKER_OPEN_SECONDS = float(os.getenv('GROQ_BREAKER_OPEN_SECONDS', '30'))
+GROQ_BREAKER_HALF_OPEN_PROBES = int(os.getenv('GROQ_BREAKER_HALF_OPEN_PROBES', '1'))
+GROQ_DEGRADED_MAX_REQUEUES = int(os.getenv('GROQ_DEGRADED_MAX_REQUEUES', '10'))
+
+# Connection pool of the async Groq client (one pool per event loop).
+# Requests beyond MAX_CONNECTIONS wait in the client until a connection is free.
+GROQ_ASYNC_MAX_CONNECTIONS = int(os.getenv('GROQ_ASYNC_MAX_CONNECTIONS', '20'))
+GROQ_ASYNC_MAX_KEEPALIVE = int(os.getenv('GROQ_ASYNC_MAX_KEEPALIVE', '20'))
+GROQ_ASYNC_KEEPALIVE_EXPIRY = float(os.getenv('GROQ_ASYNC_KEEPALIVE_EXPIRY', '30'))
+GROQ_ASYNC_CONNECT_TIMEOUT = float(os.getenv('GROQ_ASYNC_CONNECT_TIMEOUT', '5'))
+GROQ_ASYNC_POOL_TIMEOUT = float(os.getenv('GROQ_ASYNC_POOL_TIMEOUT', '60'))
+
+# The notifications WebSocket also answers {"type": "analyze"} messages with
+# the async client: texts of up to WS_ANALYZE_MAX_CHARS, at most
+# WS_ANALYZE_MAX_IN_FLIGHT at a time per connection
+WS_ANALYZE_MAX_CHARS = int(os.getenv('WS_ANALYZE_MAX_CHARS', '20000'))
+WS_ANALYZE_MAX_IN_FLIGHT = int(os.getenv('WS_ANALYZE_MAX_IN_FLIGHT', '20'))
+
+# Groq models. With the cascade enabled the small model screens every input
+# and only uncertain or HIGH/CRITICAL verdicts are re-analyzed by the large one.
+GROQ_SMALL_MODEL = os.getenv('GROQ_SMALL_MODEL', 'llama3-8b-8192')
+GROQ_LARGE_MODEL = os.getenv('GROQ_LARGE_MODEL', 'llama3-70b-8192')
+GROQ_CASCADE_ENABLED = os.getenv('GROQ_CASCADE_ENABLED', 'False') == 'True'
+GROQ_CASCADE_THRESHOLDS = {
+    # Escalate when the small model's confidence falls inside uncertain_band,
+    # or when it reports a threat at one of escalate_levels
+    'text': {'uncertain_band': (0.3, 0.8), 'escalate_levels': ('HIGH', 'CRITICAL')},
+    'audio': {'uncertain_band': (0.3, 0.85), 'escalate_levels': ('HIGH', 'CRITICAL')},
+    'visual': {'uncertain_band': (0.3, 0.8), 'escalate_levels': ('HIGH', 'CRITICAL')},
+}
+GROQ_CASCADE_THRESHOLDS.update(json.loads(os.getenv('GROQ_CASCADE_THRESHOLDS', '{}')))
+
+# Stream single-text completions and push threat_level to the client as soon as it is emitted
+GROQ_STREAMING_ENABLED = os.getenv('GROQ_STREAMING_ENABLED', 'False') == 'True'
+
+# Prompt format: 'compact' keeps the instructions in the system message, cleans
+# the input (ANSI, whitespace, repeated lines) and uses a short-key reply schema;
+# 'full' is the original verbose prompt. Token use per call is recorded per mode.
+GROQ_PROMPT_MODE = os.getenv('GROQ_PROMPT_MODE', 'compact')
+GROQ_COMPACT_MAX_TOKENS = int(os.getenv('GROQ_COMPACT_MAX_TOKENS', '300'))
+GROQ_COMPACT_BATCH_ITEM_TOKENS = int(os.getenv('GROQ_COMPACT_BATCH_ITEM_TOKENS', '100'))
+GROQ_USAGE_REDIS_URL = os.getenv('GROQ_USAGE_REDIS_URL', '')
+
+# Single-flight coalescing of identical in-flight analyses
+# (an empty Redis URL coalesces within each process only). The leader keeps
+# extending its LOCK_TIMEOUT lock while its call runs; other workers wait up
+# to WAIT_TIMEOUT, by default the longest a call can take with every retry
+GROQ_SINGLE_FLIGHT_REDIS_URL = os.getenv('GROQ_SINGLE_FLIGHT_REDIS_URL', '')
+GROQ_SINGLE_FLIGHT_LOCK_TIMEOUT = int(os.getenv('GROQ_SINGLE_FLIGHT_LOCK_TIMEOUT', '30'))
+GROQ_SINGLE_FLIGHT_WAIT_TIMEOUT = int(os.getenv(
+    'GROQ_SINGLE_FLIGHT_WAIT_TIMEOUT',
+    str(int((GROQ_MAX_RETRIES + 1) * GROQ_TIMEOUT + GROQ_MAX_RETRIES * GROQ_RETRY_MAX_DELAY))
+))
+
+# Local triage rules evaluated before any Groq call
+TRIAGE_ENABLED = os.getenv('TRIAGE_ENABLED', 'True') == 'True'
+TRIAGE_RULES_FILE = os.getenv('TRIAGE_RULES_FILE', os.path.join(BASE_DIR, 'core', 'rules', 'triage_rules.json'))
+
+# Limits for packing short texts into a single batched completion
+GROQ_BATCH_MAX_ITEMS = int(os.getenv('GROQ_BATCH_MAX_ITEMS', '20'))
+GROQ_BATCH_MAX_CHARS = int(os.getenv('GROQ_BATCH_MAX_CHARS', '12000'))
+# Packed requests sent at a time when a batch spans several of them
+GROQ_BATCH_CONCURRENCY = int(os.getenv('GROQ_BATCH_CONCURRENCY', '4'))
+# Most texts one POST /api/analyze/text/batch/ request may carry
+TEXT_BATCH_MAX_ITEMS = int(os.getenv('TEXT_BATCH_MAX_ITEMS', '500'))
+
+# Texts longer than GROQ_CHUNK_MAX_TOKENS are split on line/record boundaries
+# and the chunks analyzed GROQ_CHUNK_CONCURRENCY at a time (8192-token context)
+GROQ_CHUNK_MAX_TOKENS = int(os.getenv('GROQ_CHUNK_MAX_TOKENS', '4000'))
+GROQ_CHUNK_CONCURRENCY = int(os.getenv('GROQ_CHUNK_CONCURRENCY', '4'))
+
+# Drain-style log template mining. Multi-line texts are grouped into templates;
+# only templates seen fewer than RARE_COUNT times (plus a sample of their
+# parameters) go to Groq, the rest reuse the template's last verdict.
+LOG_TEMPLATES_ENABLED = os.getenv('LOG_TEMPLATES_ENABLED', 'True') == 'True'
+LOG_TEMPLATE_MIN_LINES = int(os.getenv('LOG_TEMPLATE_MIN_LINES', '3'))
+# Texts with more templates than this fraction of their lines are not logs
+LOG_TEMPLATE_MAX_RATIO = float(os.getenv('LOG_TEMPLATE_MAX_RATIO', '0.5'))
+LOG_TEMPLATE_RARE_COUNT = int(os.getenv('LOG_TEMPLATE_RARE_COUNT', '3'))
+LOG_TEMPLATE_PARAM_SAMPLES = int(os.getenv('LOG_TEMPLATE_PARAM_SAMPLES', '5'))
+LOG_TEMPLATE_DEPTH = int(os.getenv('LOG_TEMPLATE_DEPTH', '4'))
+LOG_TEMPLATE_SIMILARITY = float(os.getenv('LOG_TEMPLATE_SIMILARITY', '0.4'))
+LOG_TEMPLATE_MAX_CHILDREN = int(os.getenv('LOG_TEMPLATE_MAX_CHILDREN', '100'))
+LOG_TEMPLATE_MAX_CLUSTERS = int(os.getenv('LOG_TEMPLATE_MAX_CLUSTERS', '5000'))
+
+# Incremental chat analysis: each batch of new messages is analyzed against a
+# rolling summary and risk state kept in AnalysisSession.metadata, plus the
+# last CHAT_RECENT_MESSAGES messages, instead of the whole conversation
+CHAT_INCREMENTAL_ENABLED = os.getenv('CHAT_INCREMENTAL_ENABLED', 'True') == 'True'
+CHAT_SUMMARY_MAX_WORDS = int(os.getenv('CHAT_SUMMARY_MAX_WORDS', '120'))
+CHAT_RECENT_MESSAGES = int(os.getenv('CHAT_RECENT_MESSAGES', '3'))
+CHAT_MAX_INDICATORS = int(os.getenv('CHAT_MAX_INDICATORS', '20'))
+
+# Near-duplicate verdict reuse: texts whose estimated Jaccard similarity
+# (MinHash LSH over words and word pairs) to an earlier text reaches
+# MIN_SIMILARITY reuse its verdict, if both belong to the same user and
+# contain the same URLs, domains, IPs and hashes. The index keeps at most
+# MAX_ENTRIES signatures and is warmed from recent TextSources.
+NEAR_DUP_ENABLED = os.getenv('NEAR_DUP_ENABLED', 'True') == 'True'
+NEAR_DUP_MIN_SIMILARITY = float(os.getenv('NEAR_DUP_MIN_SIMILARITY', '0.8'))
+NEAR_DUP_NUM_PERM = int(os.getenv('NEAR_DUP_NUM_PERM', '128'))
+NEAR_DUP_BANDS = int(os.getenv('NEAR_DUP_BANDS', '16'))
+NEAR_DUP_MAX_ENTRIES = int(os.getenv('NEAR_DUP_MAX_ENTRIES', '10000'))
+NEAR_DUP_MIN_TOKENS = int(os.getenv('NEAR_DUP_MIN_TOKENS', '8'))
+NEAR_DUP_WARMUP_SOURCES = int(os.getenv('NEAR_DUP_WARMUP_SOURCES', '1000'))
+
+# Verdict cache settings (an empty Redis URL keeps the cache in-process only)
+VERDICT_CACHE_ENABLED = os.getenv('VERDICT_CACHE_ENABLED', 'True') == 'True'
+VERDICT_CACHE_MAX_ENTRIES = int(os.getenv('VERDICT_CACHE_MAX_ENTRIES', '1024'))
+VERDICT_CACHE_TTL = int(os.getenv('VERDICT_CACHE_TTL', '3600'))
+VERDICT_CACHE_REDIS_URL = os.getenv('VERDICT_CACHE_REDIS_URL', '')
+
 # Logging Configuration
 LOGGING = {
     'version': 1,